@@ -0,0 +1,212 @@
+# batch.py
+# --- headless batch mode: answer a JSONL file of questions against one dataset, no Streamlit server ---
+# Usage:
+#   python batch.py data.csv questions.jsonl --output results.jsonl --concurrency 8
+# Each input line is {"question": "...", "id": ..., "language": "Python"|"SQL", "mode": "..."};
+# only "question" is required, a bare JSON string works too. Results are written as they finish.
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions against a CSV dataset.")
+    parser.add_argument("dataset", help="CSV file the questions are about")
+    parser.add_argument("questions", help="JSONL file of questions, '-' for stdin")
+    parser.add_argument("--output", "-o", default="-", help="JSONL results file, '-' for stdout")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="questions in flight at once")
+    parser.add_argument("--language", default="Python", choices=["Python", "SQL"], help="default language")
+    parser.add_argument("--mode", default="Just Code", help="default mode ('Just Code' or 'Explain for Beginners')")
+    parser.add_argument("--no-execute", action="store_true", help="only generate code, don't run it")
+    parser.add_argument("--max-rows", type=int, default=50, help="result rows kept per answer")
+    return parser.parse_args()
+
+
+class BatchDataset:
+    # --- the dataset prepared once and shared by every question: columns, DuckDB view, Arrow IPC ---
+    def __init__(self, csv_path: Path):
+        from utils.ingest import IngestCache
+        from utils.connections import DuckDBConnectionManager, table_name_for
+
+        data = csv_path.read_bytes()
+        self.filename = csv_path.name
+        self.dataset_key = IngestCache.content_hash(data)
+        self.parquet_path = IngestCache.ensure_parquet(
+            data, self.dataset_key, streaming=IngestCache.should_stay_on_disk(data)
+        )
+        self.columns = IngestCache.columns(self.parquet_path)
+        self.column_types = IngestCache.column_types(self.parquet_path)
+        self.sql = DuckDBConnectionManager.acquire(
+            self.dataset_key, table_name_for(self.filename), str(self.parquet_path)
+        )
+        self._ipc_path = None
+
+    @property
+    def ipc_path(self):
+        # Only built when a Python question actually runs
+        if self._ipc_path is None:
+            from utils.ingest import IngestCache
+            self._ipc_path = IngestCache.ensure_ipc(self.dataset_key, parquet_path=self.parquet_path)
+        return self._ipc_path
+
+    def close(self):
+        self.sql.close()
+
+
+def read_questions(source):
+    for index, line in enumerate(source):
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        if isinstance(item, str):
+            item = {"question": item}
+        item.setdefault("id", index)
+        yield item
+
+
+async def answer(item: dict, dataset: BatchDataset, args) -> dict:
+    from utils.formats import rewrite_in_app_code
+    from utils.invokers import AIActionInvoker
+    from utils.library import QueryLibrary
+    from utils.tracing import Tracer
+
+    language = item.get("language", args.language)
+    mode = item.get("mode", args.mode)
+    record = {"id": item["id"], "question": item["question"], "language": language, "mode": mode}
+    timings = {}
+    start = time.perf_counter()
+
+    with Tracer.span("batch", language=language) as span:
+        try:
+            full, in_app = await AIActionInvoker.generate_sections(
+                item["question"], mode, language, dataset.filename, dataset.columns,
+                sql_conn=dataset.sql, types=dataset.column_types,
+            )
+            code = rewrite_in_app_code(in_app)
+            record.update(full_code=full, code=code)
+            timings["generate_ms"] = _ms_since(start)
+
+            if not args.no_execute:
+                run_start = time.perf_counter()
+                record["result"] = await asyncio.to_thread(execute, code, language, dataset, args.max_rows)
+                timings["execute_ms"] = _ms_since(run_start)
+                if record["result"].get("error"):
+                    span.fail(record["result"]["error"])
+            record["status"] = "error" if record.get("result", {}).get("error") else "ok"
+            if record["status"] == "ok" and not args.no_execute:
+                # Verified answers are reused for the same question on the next file with this schema
+                QueryLibrary.remember(item["question"], mode, language, dataset.filename, dataset.columns,
+                                      dataset.column_types, full, in_app)
+        except Exception as e:
+            span.fail(e)
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+
+    timings["total_ms"] = _ms_since(start)
+    record["timings"] = timings
+    return record
+
+
+def execute(code: str, language: str, dataset: BatchDataset, max_rows: int) -> dict:
+    # Runs in a worker thread; both cores are thread-safe and share the app's result cache
+    from utils.handlers import ExecutionHandler
+
+    try:
+        if language == "SQL":
+            result, cached = ExecutionHandler.run_sql(dataset.sql, code)
+            return {"cached": cached, **_frame_json(result.head(max_rows), max_rows), "row_count": result.row_count}
+
+        # Python always goes through the sandbox here: a bad answer must not end the whole batch
+        outcome, cached = ExecutionHandler.run_python(code, dataset.dataset_key, dataset.ipc_path)
+        return {
+            "cached": cached,
+            "has_result": outcome.has_result,
+            "outputs": [_output_json(name, args, max_rows) for name, args, _ in outcome.outputs],
+            "error": outcome.error,
+        }
+    except Exception as e:  # SandboxError, DuckDB errors, ...
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def _frame_json(value, max_rows: int) -> dict:
+    # A Series keeps its index (e.g. the group labels) as the first column
+    frame = value.reset_index() if not hasattr(value, "columns") else value
+    return {
+        "row_count": len(frame),
+        "columns": [str(c) for c in frame.columns],
+        "rows": json.loads(frame.head(max_rows).to_json(orient="values", date_format="iso", default_handler=str)),
+    }
+
+
+def _output_json(name: str, args: tuple, max_rows: int) -> dict:
+    if name == "image_png":
+        return {"call": "image", "png_bytes": len(args[0])}
+    values = []
+    for arg in args:
+        if hasattr(arg, "to_json"):  # DataFrame / Series
+            values.append(_frame_json(arg, max_rows))
+        else:
+            try:
+                json.dumps(arg)
+                values.append(arg)
+            except (TypeError, ValueError):
+                values.append(repr(arg))
+    return {"call": name, "args": values}
+
+
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+async def run_batch(args, source, sink) -> dict:
+    dataset = BatchDataset(Path(args.dataset))
+    slots = asyncio.Semaphore(max(1, args.concurrency))
+    pending = set()
+    counts = {"ok": 0, "error": 0}
+
+    async def run_one(item):
+        try:
+            record = await answer(item, dataset, args)
+            counts[record["status"]] += 1
+            sink.write(json.dumps(record, default=str) + "\n")
+            sink.flush()
+        finally:
+            slots.release()
+
+    try:
+        # Input is read lazily: at most `concurrency` questions are loaded and in flight
+        for item in read_questions(source):
+            await slots.acquire()
+            task = asyncio.create_task(run_one(item))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        dataset.close()
+    return counts
+
+
+def main():
+    args = parse_args()
+    from utils.sandbox import SandboxExecutor
+
+    source = sys.stdin if args.questions == "-" else open(args.questions, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        counts = asyncio.run(run_batch(args, source, sink))
+    finally:
+        SandboxExecutor.shutdown()
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(f"{counts['ok']} ok, {counts['error']} failed in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
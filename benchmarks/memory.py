@@ -0,0 +1,89 @@
+# --- peak-memory benchmark: one "Run In-App Code" interaction, deep copies vs copy-on-write views ---
+# Usage: python benchmarks/memory.py [--rows 1000000] [--output memory.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+GENERATED_CODE = {
+    "read_only": (
+        "df = df.copy()\n"
+        "df.columns = df.columns.str.strip()\n"
+        "result = df.groupby('category')['value'].mean()\n"
+    ),
+    "adds_column": (
+        "df = df.copy()\n"
+        "df['value_x2'] = df['value'] * 2\n"
+        "result = df['value_x2'].sum()\n"
+    ),
+}
+
+SCENARIO = """
+import json, sys, time, tracemalloc
+import numpy as np
+import pyarrow as pa
+
+rows, mode, code = int(sys.argv[1]), sys.argv[2], sys.argv[3]
+rng = np.random.default_rng(0)
+table = pa.table({
+    **{f"num_{i}": rng.random(rows) for i in range(5)},
+    "value": rng.random(rows),
+    "category": pa.array(rng.integers(0, 50, rows).astype(str)),
+})
+
+if mode == "deep_copy":
+    import pandas as pd
+    session_df = table.to_pandas()
+    del table
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = session_df.copy()                      # main.py: state.get_df().copy() on every rerun
+    local = {"df": df.copy(), "pd": pd}         # visualization / execute_code: df.copy() for exec
+    exec(code, local, local)
+else:
+    from utils.frames import isolated_view, cheap_copies
+    import pandas as pd
+    session_df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    tracemalloc.start()
+    start = time.perf_counter()
+    local = {"df": isolated_view(session_df), "pd": pd}
+    exec(cheap_copies(code), local, local)
+
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({"peak_mb": round(peak / 2**20, 1), "seconds": round(elapsed, 4)}))
+"""
+
+
+def run(rows: int, mode: str, code: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    out = subprocess.run(
+        [sys.executable, "-c", SCENARIO, str(rows), mode, code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare peak memory of deep copies vs copy-on-write.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = {"rows": args.rows, "cases": {}}
+    for name, code in GENERATED_CODE.items():
+        report["cases"][name] = {mode: run(args.rows, mode, code) for mode in ("deep_copy", "copy_on_write")}
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
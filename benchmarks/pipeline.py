@@ -0,0 +1,292 @@
+# --- offline end-to-end benchmark of the hot path, with a stub LLM in place of Groq/Mistral ---
+# Usage:
+#   python benchmarks/pipeline.py --sizes 10000,100000 --output bench.json
+#   python benchmarks/pipeline.py --compare bench.json          # diff against an earlier run
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SIZES = "10000,100000,1000000,10000000"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot path with a stub LLM.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated row counts")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="stub LLM latency in seconds")
+    parser.add_argument("--workdir", default=None, help="where synthetic CSVs and caches are kept")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare medians against")
+    return parser.parse_args()
+
+
+ARGS = parse_args() if __name__ == "__main__" else None
+WORKDIR = Path(ARGS.workdir if ARGS and ARGS.workdir else Path(tempfile.gettempdir()) / "myquery-bench")
+
+# The app reads its settings at import time, so isolate it before importing anything from it
+os.environ.update(
+    MYQUERY_CACHE_DIR=str(WORKDIR / "cache"),
+    MYQUERY_DB_PATH=str(WORKDIR / "bench.db"),
+    MYQUERY_LLM_CACHE="0",
+    MYQUERY_OFFLINE="1",
+)
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def make_csv(rows: int) -> Path:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    path = WORKDIR / f"data_{rows}.csv"
+    if path.exists():
+        return path
+
+    rng = np.random.default_rng(rows)
+    table = pa.table({
+        "id": np.arange(rows),
+        "category": pa.array(rng.choice(["A", "B", "C", "D", "E"], rows)),
+        "region": pa.array(rng.choice(["north", "south", "east", "west"], rows)),
+        "amount": rng.gamma(2.0, 50.0, rows).round(2),
+        "quantity": rng.integers(1, 20, rows),
+        "date": pa.array(np.datetime64("2024-01-01") + rng.integers(0, 365, rows).astype("timedelta64[D]")),
+    })
+    WORKDIR.mkdir(parents=True, exist_ok=True)
+    pacsv.write_csv(table, path)
+    return path
+
+
+def max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def rss_bytes() -> int:
+    # Current resident set size; 0 where /proc isn't available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MemorySampler:
+    # Peak growth of RSS and of Arrow's allocator over a block. tracemalloc misses both: Arrow buffers,
+    # DuckDB and the sandbox's memory-mapped frames never go through Python's allocator.
+    interval = 0.005
+
+    def __enter__(self):
+        import pyarrow as pa
+
+        self._arrow = pa.total_allocated_bytes
+        self.rss_start, self.arrow_start = rss_bytes(), self._arrow()
+        self.rss_peak, self.arrow_peak = self.rss_start, self.arrow_start
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.rss_peak = max(self.rss_peak, rss_bytes())
+        self.arrow_peak = max(self.arrow_peak, self._arrow())
+
+
+def measure(stage: str, fn, repeat: int, rows=None, units=1, unit="ops", setup=None) -> dict:
+    # Timings come from plain runs; memory from one extra run under a MemorySampler
+    from utils.tracing import percentile
+
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    with MemorySampler() as memory:
+        fn()
+
+    ordered = sorted(samples)
+    median = percentile(ordered, 50)
+    record = {
+        "stage": stage,
+        "rows": rows,
+        "runs": repeat,
+        "median_ms": round(median * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "throughput_per_s": round(units / median, 1) if median else None,
+        "throughput_unit": unit,
+        "rss_delta_mb": round((memory.rss_peak - memory.rss_start) / 2**20, 2),  # peak growth during one run
+        "arrow_peak_mb": round((memory.arrow_peak - memory.arrow_start) / 2**20, 2),  # Arrow memory pool
+        "max_rss_mb": round(max_rss_mb(), 1),  # whole process high-water mark so far
+    }
+    print(f"  {stage:<28} rows={rows or '-':<9} median={record['median_ms']:>10.3f} ms  "
+          f"rss+={record['rss_delta_mb']:>8.2f} MB  arrow={record['arrow_peak_mb']:>8.2f} MB", file=sys.stderr)
+    return record
+
+
+def text_stages(repeat: int, llm_delay: float) -> list[dict]:
+    import llm_config
+    from stub_llm import StubChatModel, PYTHON_RESPONSE, VISUALIZATION_RESPONSE
+    from utils.formats import strip_lines, rewrite_in_app_code, rewrite_visualization_code
+    from utils.invokers import AIActionInvoker, AIResponseFormatHandler
+    from utils.sessions import SessionState
+
+    llm_config.set_llm_clients(
+        groq=StubChatModel("stub-groq", delay=llm_delay),
+        mistral=StubChatModel("stub-mistral", delay=llm_delay),
+    )
+    cleaned = llm_config.clean_llm_output(PYTHON_RESPONSE)
+    lines = strip_lines(cleaned)
+    joined = AIResponseFormatHandler.join_lines(lines)
+    _, in_app = AIResponseFormatHandler.split_sections(lines, "data.csv")
+    prompt = AIActionInvoker.build_code_prompt("What is the total amount by category?", "Just Code", "Python")
+
+    # Text stages are cheap; loop them so timings are above clock resolution
+    n = 1000
+    loop = lambda fn: (lambda: [fn() for _ in range(n)])
+    return [
+        measure("clean_llm_output", loop(lambda: llm_config.clean_llm_output(PYTHON_RESPONSE)), repeat, units=n),
+        measure("strip_lines", loop(lambda: strip_lines(cleaned)), repeat, units=n),
+        measure("code_normalizer", loop(lambda: AIResponseFormatHandler.code_normalizer(joined)), repeat, units=n),
+        measure("prep_code", loop(lambda: AIResponseFormatHandler.split_sections(lines, "data.csv")), repeat, units=n),
+        measure("rewrite_in_app_code", loop(lambda: rewrite_in_app_code(in_app)), repeat, units=n),
+        measure("rewrite_visualization_code",
+                loop(lambda: rewrite_visualization_code(VISUALIZATION_RESPONSE)), repeat, units=n),
+        measure("ask_llm_groq", lambda: llm_config.ask_llm_groq(prompt), repeat),
+        measure("review_code_with_mistral",
+                lambda: llm_config.review_code_with_mistral(in_app, ["category", "amount"], "Python"), repeat),
+        measure("generate_code_pipeline",
+                lambda: AIActionInvoker.generate_code("What is the total amount by category?", "Just Code", "Python"),
+                repeat, setup=lambda: SessionState.set_filename("data.csv")),
+    ]
+
+
+def data_stages(rows: int, repeat: int) -> list[dict]:
+    import shutil
+    from stub_llm import SQL_RESPONSE, PYTHON_RESPONSE
+    from llm_config import clean_llm_output
+    from utils.formats import strip_lines, rewrite_in_app_code
+    from utils.cache import ResultCache
+    from utils.connections import release_session_connection
+    from utils.handlers import FileHandler, ExecutionHandler
+    from utils.ingest import IngestCache, DATASET_DIR
+    from utils.invokers import AIResponseFormatHandler
+    from utils.sessions import SessionState
+
+    data = make_csv(rows).read_bytes()
+    dataset_key = IngestCache.content_hash(data)
+    clear_ingest = lambda: shutil.rmtree(DATASET_DIR, ignore_errors=True)
+
+    records = [
+        measure("csv_parse", lambda: IngestCache.parse_csv(data), repeat, rows, rows, "rows"),
+        measure("ingest_cold", lambda: IngestCache.load(data, dataset_key), repeat, rows, rows, "rows",
+                setup=clear_ingest),
+        measure("ingest_cached", lambda: IngestCache.load(data, dataset_key), repeat, rows, rows, "rows"),
+    ]
+
+    release_session_connection()
+    FileHandler.load_dataset(data, dataset_key)
+    SessionState.set_filename("data.csv")
+
+    sql = AIResponseFormatHandler.split_sections(
+        strip_lines(clean_llm_output(SQL_RESPONSE.format(table="data"))), "data.csv", "SQL")[1]
+    python = rewrite_in_app_code(AIResponseFormatHandler.split_sections(
+        strip_lines(clean_llm_output(PYTHON_RESPONSE)), "data.csv")[1])
+
+    records += [
+        measure("execute_sql", lambda: ExecutionHandler.execute_code(sql, "SQL"), repeat, rows, rows, "rows",
+                setup=ResultCache.clear),
+        measure("execute_sql_cached", lambda: ExecutionHandler.execute_code(sql, "SQL"), repeat, rows, rows, "rows"),
+        measure("execute_python", lambda: ExecutionHandler.execute_code(python, "Python"), repeat, rows, rows, "rows",
+                setup=ResultCache.clear),
+        measure("execute_python_cached", lambda: ExecutionHandler.execute_code(python, "Python"),
+                repeat, rows, rows, "rows"),
+    ]
+    release_session_connection()
+    return records
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    before = {(r["stage"], r["rows"]): r for r in baseline["results"]}
+    print(f"\n{'stage':<28} {'rows':>9} {'before ms':>12} {'after ms':>12} {'change':>8}", file=sys.stderr)
+    for r in report["results"]:
+        old = before.get((r["stage"], r["rows"]))
+        if old is None or not old["median_ms"]:
+            continue
+        change = (r["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+        print(f"{r['stage']:<28} {str(r['rows'] or '-'):>9} {old['median_ms']:>12.3f} "
+              f"{r['median_ms']:>12.3f} {change:>+7.1f}%", file=sys.stderr)
+
+
+def main():
+    import logging
+    from utils.sandbox import SandboxExecutor
+    from utils.sessions import SessionState
+
+    # Stages call the real Streamlit handlers in bare mode; silence the "no ScriptRunContext" noise
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    SessionState.initialize()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "llm_delay_s": ARGS.llm_delay,
+        "results": [],
+    }
+    try:
+        print("text stages", file=sys.stderr)
+        report["results"] += text_stages(ARGS.repeat, ARGS.llm_delay)
+        for rows in (int(s) for s in ARGS.sizes.split(",") if s.strip()):
+            print(f"data stages, {rows:,} rows", file=sys.stderr)
+            report["results"] += data_stages(rows, ARGS.repeat)
+    finally:
+        SandboxExecutor.shutdown()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if ARGS.output:
+        Path(ARGS.output).write_text(text + "\n")
+    if ARGS.compare:
+        compare(report, ARGS.compare)
+
+
+if __name__ == "__main__":
+    main()
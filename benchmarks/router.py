@@ -0,0 +1,79 @@
+# --- model router under injected faults: one flaky, tail-heavy primary and a steady fallback ---
+# Usage:
+#   python benchmarks/router.py --requests 200 --concurrency 8
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_llm import StubChatModel
+from utils.routing import ModelRouter, AllBackendsFailed
+from utils.tracing import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Latency of the model router with fake backends.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="primary error rate")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="primary share of slow calls")
+    return parser.parse_args()
+
+
+def backends(args):
+    primary = StubChatModel("primary", delay=0.05, fail_rate=args.fail_rate,
+                            slow_rate=args.slow_rate, slow_delay=1.0, seed=1)
+    fallback = StubChatModel("fallback", delay=0.12, seed=2)
+    return [primary, fallback]
+
+
+async def run(router, args, streamed: bool):
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with slots:
+            start = time.perf_counter()
+            try:
+                if streamed:
+                    async for _ in router.astream(f"Python coding assistant {i}"):
+                        break  # time to first chunk
+                else:
+                    await router.ainvoke(f"Python coding assistant {i}")
+                latencies.append(time.perf_counter() - start)
+            except AllBackendsFailed:
+                failures += 1
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    ordered = sorted(latencies)
+    return {
+        "ok": len(latencies),
+        "failed": failures,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    report = {}
+    for label, hedge, attempts in [("primary only", False, 1), ("failover", False, 3), ("failover + hedging", True, 3)]:
+        for streamed in (False, True):
+            router = ModelRouter("generation", backends(args), hedge=hedge, max_attempts=attempts)
+            key = f"{label} ({'stream' if streamed else 'invoke'})"
+            report[key] = asyncio.run(run(router, args, streamed))
+            report[key]["backends"] = router.stats()
+            print(f"{key:<32} p50={report[key]['p50_ms']:>7} p95={report[key]['p95_ms']:>7} "
+                  f"p99={report[key]['p99_ms']:>7} failed={report[key]['failed']}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# --- cold-start benchmark: import cost of the app modules and time to first rendered page ---
+# Usage: python benchmarks/startup.py [--runs 5] [--output startup.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import llm_config, utils.handlers, utils.invokers
+print(time.perf_counter() - start)
+"""
+
+RENDER_SNIPPET = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("main.py", default_timeout=120).run()
+elapsed = time.perf_counter() - start
+assert not at.exception, [e.value for e in at.exception]
+print(elapsed)
+"""
+
+
+def run_fresh(snippet: str) -> float:
+    # Every sample runs in a new interpreter so nothing is already in sys.modules
+    env = dict(os.environ, PYTHONPATH=str(ROOT), MYQUERY_OFFLINE="1")
+    env.setdefault("GROQ_API_KEY", "benchmark")
+    env.setdefault("MISTRAL_API_KEY", "benchmark")
+    out = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "median_s": round(statistics.median(samples), 4),
+        "min_s": round(min(samples), 4),
+        "max_s": round(max(samples), 4),
+        "runs": len(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and first page render.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "import_app_modules": summarize([run_fresh(IMPORT_SNIPPET) for _ in range(args.runs)]),
+        "first_page_render": summarize([run_fresh(RENDER_SNIPPET) for _ in range(args.runs)]),
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# --- offline stand-in for the Groq/Mistral chat models: canned answers, configurable latency ---
+import asyncio
+import random
+import re
+import time
+
+PYTHON_RESPONSE = """Here is the code:
+```python
+# Educational Level: a knowledgeable audience
+df = pd.read_csv('data.csv')
+df = df.copy()
+df.columns = df.columns.str.strip()
+result = df.groupby('category')['amount'].sum().sort_values(ascending=False)
+print(result)
+```
+In-App Version:
+```python
+df = df.copy()
+df.columns = df.columns.str.strip()
+result = df.groupby('category')['amount'].sum().sort_values(ascending=False)
+st.write(result)
+```"""
+
+SQL_RESPONSE = """# Educational Level: a knowledgeable audience
+SELECT category, SUM(amount) AS total_amount
+FROM {table}
+GROUP BY category
+ORDER BY total_amount DESC;
+
+SELECT category, SUM(amount) AS total_amount
+FROM {table}
+GROUP BY category
+ORDER BY total_amount DESC;"""
+
+SUGGESTIONS = """- What is the total amount by category?
+- Which region has the highest average quantity?
+- How does the amount change month over month?
+- What are the top 10 ids by amount?
+- How many rows fall in each region?"""
+
+VISUALIZATION_RESPONSE = """fig, ax = plt.subplots()
+df.groupby('category')['amount'].sum().plot(kind='bar', ax=ax)
+st.pyplot(fig)"""
+
+
+class StubMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class StubBackendError(Exception):
+    pass
+
+
+class StubChatModel:
+    # Exposes the slice of the langchain chat-model API the app uses: invoke, ainvoke, astream.
+    # fail_rate / slow_rate inject provider faults: errors, and tail latency of slow_delay seconds.
+    def __init__(self, model_name="stub", delay=0.0, chunk_size=24, table="data", temperature=0.2,
+                 fail_rate=0.0, slow_rate=0.0, slow_delay=0.0, seed=None):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.table = table
+        self.fail_rate = fail_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def latency(self) -> float:
+        if self.rng.random() < self.fail_rate:
+            raise StubBackendError(f"{self.model_name} is unavailable")
+        return self.slow_delay if self.rng.random() < self.slow_rate else self.delay
+
+    def respond(self, prompt: str) -> str:
+        if "Revise the following code" in prompt or "review and revise" in prompt:
+            # Reviews echo the code back unchanged
+            return prompt.rsplit("Code:", 1)[-1].strip()
+        if "SQL coding assistant" in prompt:
+            return SQL_RESPONSE.format(table=self.table)
+        if "Python coding assistant" in prompt:
+            return PYTHON_RESPONSE
+        if "analytical questions" in prompt:
+            return SUGGESTIONS
+        if "data visualizations" in prompt:
+            return VISUALIZATION_RESPONSE
+        return re.sub(r"\s+", " ", prompt)[:200]
+
+    def invoke(self, prompt: str) -> StubMessage:
+        self.calls += 1
+        time.sleep(self.latency())
+        return StubMessage(self.respond(prompt))
+
+    async def ainvoke(self, prompt: str) -> StubMessage:
+        self.calls += 1
+        await asyncio.sleep(self.latency())
+        return StubMessage(self.respond(prompt))
+
+    async def astream(self, prompt: str):
+        # The normal delay is spread across the chunks, like a real token stream;
+        # a slow call stalls before the first chunk, like a queued request
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency() - self.delay))
+        text = self.respond(prompt)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for chunk in chunks:
+            await asyncio.sleep(self.delay / len(chunks))
+            yield StubMessage(chunk)
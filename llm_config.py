@@ -1,30 +1,101 @@
 import os
+import threading
+from contextlib import aclosing
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 from utils.formats import strip_lines
-from langchain.chat_models import ChatOpenAI
 
 from utils.prompt_template import PromptTemplate
+from utils.tracing import Tracer
+from utils.scheduler import LLMScheduler, SharedRequest
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MISTRAL_API_KEY = os.getenv("GROQ_API_KEY")
 
-# --- Initialize ChatGroq model ---
-llm_groq = ChatGroq(
-    model_name="llama3-70b-8192",
-    temperature=0.2,
-    max_retries=2
-)
-
-llm_mistral = ChatOpenAI(
-    model_name="mistral-medium",
-    temperature=0.2,
-    max_retries=2,
-    openai_api_key=os.getenv("MISTRAL_API_KEY"),
-    openai_api_base=os.getenv("OPENAI_API_BASE")
-)
+# --- LLM clients are built on first use; langchain is slow to import ---
+# Each role is a ModelRouter over "provider:model" backends, fastest healthy one first.
+# One provider per role by default; list more (comma separated) to fail over and hedge across them.
+GENERATION_MODELS = os.getenv("MYQUERY_GENERATION_MODELS", "groq:llama3-70b-8192")
+REVIEW_MODELS = os.getenv("MYQUERY_REVIEW_MODELS", "mistral:mistral-medium")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _build_model(spec: str, max_retries: int = 2):
+    provider, _, model = spec.strip().partition(":")
+    if provider == "groq":
+        from langchain_groq import ChatGroq
+
+        # --- Initialize ChatGroq model ---
+        return ChatGroq(
+            model_name=model,
+            temperature=0.2,
+            max_retries=max_retries
+        )
+    if provider == "mistral":
+        from langchain.chat_models import ChatOpenAI
+
+        return ChatOpenAI(
+            model_name=model,
+            temperature=0.2,
+            max_retries=max_retries,
+            openai_api_key=os.getenv("MISTRAL_API_KEY"),
+            openai_api_base=os.getenv("OPENAI_API_BASE")
+        )
+    raise ValueError(f"unknown LLM provider in {spec!r}")
+
+def _build_router(role: str, specs: str):
+    from utils.routing import ModelRouter, Backend
+
+    specs = [s for s in (s.strip() for s in specs.split(",")) if s]
+    # With a fallback configured the router fails over instead of waiting on client-side retries
+    max_retries = 0 if len(specs) > 1 else 2
+    backends, errors = [], []
+    for spec in specs:
+        try:
+            # Every session's calls to a provider share its rate limits (see utils/scheduler.py)
+            model = _build_model(spec, max_retries)
+            backends.append(Backend(spec, LLMScheduler.wrap(spec.partition(":")[0], model)))
+        except Exception as e:  # e.g. missing API key: serve the role with what is configured
+            errors.append(f"{spec}: {e}")
+    if not backends:
+        raise RuntimeError(f"no usable {role} model ({'; '.join(errors)})")
+    return ModelRouter(role, backends)
+
+def get_llm_groq():
+    with _clients_lock:
+        if "groq" not in _clients:
+            _clients["groq"] = _build_router("generation", GENERATION_MODELS)
+        return _clients["groq"]
+
+def get_llm_mistral():
+    with _clients_lock:
+        if "mistral" not in _clients:
+            _clients["mistral"] = _build_router("review", REVIEW_MODELS)
+        return _clients["mistral"]
+
+def router_stats() -> list[dict]:
+    # Health of the routers built so far; never builds a client just to report on it
+    with _clients_lock:
+        clients = list(_clients.values())
+    return [row for client in clients if hasattr(client, "stats") for row in client.stats()]
+
+def set_llm_clients(groq=None, mistral=None):
+    # Swap in other chat models (benchmarks, batch runs, local fakes); None leaves a role unchanged
+    with _clients_lock:
+        if groq is not None:
+            _clients["groq"] = groq
+        if mistral is not None:
+            _clients["mistral"] = mistral
+
+def __getattr__(name):
+    # Keeps `from llm_config import llm_groq` working without paying for it at import time
+    if name == "llm_groq":
+        return get_llm_groq()
+    if name == "llm_mistral":
+        return get_llm_mistral()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def clean_llm_output(text: str) -> str:
     lines = text.strip().splitlines()
@@ -44,28 +115,87 @@ def clean_llm_output(text: str) -> str:
 
     return "\n".join(filtered).strip()
 
+def _model_info(llm):
+    return getattr(llm, "model_name", type(llm).__name__), getattr(llm, "temperature", None)
+
+def _role(llm) -> str:
+    # Span names follow the role ("llm.groq", "llm.mistral") so swapped-in models stay comparable
+    for role, client in list(_clients.items()):
+        if client is llm:
+            return role
+    return _model_info(llm)[0]
+
+def invoke_llm(llm, prompt: str) -> str:
+    # Identical (model, prompt, temperature) requests are answered from database.db,
+    # or share the upstream call when one is still in flight (see utils/scheduler.py)
+    model, temperature = _model_info(llm)
+
+    with Tracer.span(f"llm.{_role(llm)}", model=model, prompt_chars=len(prompt)) as span:
+        return SharedRequest(model, prompt, temperature, span).invoke(lambda: llm.invoke(prompt))
+
 def ask_llm_groq(prompt: str) -> list[str]:
     # print(f"Groq LLM prompt: {prompt}")
-    response = llm_groq.invoke(prompt)
-    cleaned_text = clean_llm_output(response.content)
+    response = invoke_llm(get_llm_groq(), prompt)
+    cleaned_text = clean_llm_output(response)
     return strip_lines(cleaned_text) 
 
-def review_code_with_mistral(code: str, dataset_columns: list[str], language: str ) -> str:
+def build_review_prompt(code: str, dataset_columns: list[str], language: str, diagnostics=None) -> str:
     cols_str = ", ".join(dataset_columns)
+    # Local validator findings, when the code was escalated to review because of them
+    issues = PromptTemplate.REVIEW_ISSUES.value.format(
+        diagnostics="\n        ".join(f"- {d}" for d in diagnostics)
+    ) if diagnostics else ""
     if language == "Python":
-        review_prompt = PromptTemplate.Python_REVIEW_CODE.value.format(
+        return PromptTemplate.Python_REVIEW_CODE.value.format(
             cols_str=cols_str,
+            issues=issues,
             code=code
         )
     else: #SQL
-        review_prompt = PromptTemplate.SQL_REVIEW_CODE.value.format(
+        return PromptTemplate.SQL_REVIEW_CODE.value.format(
             cols_str=cols_str,
+            issues=issues,
             code=code
         )
+
+def review_code_with_mistral(code: str, dataset_columns: list[str], language: str, diagnostics=None) -> str:
+    review_prompt = build_review_prompt(code, dataset_columns, language, diagnostics)
     
     try:
-        response = llm_mistral.invoke(review_prompt)
-        return clean_llm_output(response.content)
+        response = invoke_llm(get_llm_mistral(), review_prompt)
+        return clean_llm_output(response)
+    except Exception as e:
+        return f"Mistral error: {e}"
+
+# --- async variants, used by the streaming code-generation pipeline ---
+async def ainvoke_llm(llm, prompt: str) -> str:
+    model, temperature = _model_info(llm)
+
+    with Tracer.span(f"llm.{_role(llm)}", model=model, prompt_chars=len(prompt)) as span:
+        return await SharedRequest(model, prompt, temperature, span).ainvoke(lambda: llm.ainvoke(prompt))
+
+async def astream_llm(llm, prompt: str):
+    # Yields raw text chunks as they arrive; a cache hit comes back as one chunk
+    model, temperature = _model_info(llm)
+
+    # Detached span: a generator can be closed from another context, which a `with` span can't survive
+    span = Tracer.start(f"llm.{_role(llm)}", model=model, prompt_chars=len(prompt), streamed=True)
+    try:
+        # aclosing: closing this generator must reach the shared request now, so followers can retry
+        async with aclosing(SharedRequest(model, prompt, temperature, span).astream(lambda: llm.astream(prompt))) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    except Exception as e:
+        span.end(error=e)
+        raise
+    finally:
+        span.end()
+
+async def areview_code_with_mistral(code: str, dataset_columns: list[str], language: str, diagnostics=None) -> str:
+    review_prompt = build_review_prompt(code, dataset_columns, language, diagnostics)
+
+    try:
+        response = await ainvoke_llm(get_llm_mistral(), review_prompt)
+        return clean_llm_output(response)
     except Exception as e:
         return f"Mistral error: {e}"
-    
\ No newline at end of file
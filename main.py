@@ -1,13 +1,11 @@
 # main.py
-import re
 import streamlit as st
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-from llm_config import llm_groq
+from llm_config import GROQ_API_KEY, get_llm_groq, invoke_llm
 from utils.sessions import SessionState
-from utils.handlers import FileHandler, ExecutionHandler
+from utils.handlers import FileHandler, ExecutionHandler, DataHandler, MetricsHandler
 from utils.invokers import AIActionInvoker
+from utils.formats import rewrite_in_app_code, rewrite_visualization_code
+from utils.schema import ColumnIndex
 
 state = SessionState()
 
@@ -20,13 +18,19 @@ state.initialize()
 # --- file upload, appear in sidebar ---
 FileHandler.upload_files()
 
+# --- every table SQL can join, also in sidebar ---
+FileHandler.show_catalog()
+
+# --- latency breakdown per stage, also in sidebar ---
+MetricsHandler.show_panel()
+
 # --- Main UI ---
 st.markdown("<h1>Welcome to your Data Assistant!</h1>", unsafe_allow_html=True)
 st.write("Ask questions about your data — I'll generate Python code and explain it!")
 
 
-if state.get_df() is not None:
-    st.dataframe(state.get_df().head(10))
+if state.has_data():
+    st.dataframe(DataHandler.preview(10))
 
     # Global SQLite connection object (I don't know where to put this, so I put it here)
     if "sqlite_conn" not in st.session_state:
@@ -38,10 +42,12 @@ if state.get_df() is not None:
         AIActionInvoker.get_questions_suggestions()
 
     # --- Show suggested questions ---
+    picked = None
     for i, s in enumerate(state.get_suggested_questions()):
         if s.strip():
             if st.button(s, key=f"suggestion_{i}"):
                 state.set_question_input(s)
+                picked = s
 
      # --- Inputs for code generation ---
     st.divider()
@@ -49,6 +55,10 @@ if state.get_df() is not None:
     question = st.text_input("💬 Ask your question:", value=state.get_question_input() or "")
     language = st.radio("🗣️ Language", ["Python", "SQL"], horizontal=True)
 
+    # A clicked suggestion shows its answer straight away when it was prepared in the background
+    if picked and AIActionInvoker.use_prefetched(picked, mode, language):
+        state.add_recent_question(picked)
+
     if st.button("🔍 Submit"):
         if not question:
             st.warning("Ask something!")
@@ -64,14 +74,15 @@ if state.get_full_code() != "":
 
 if state.get_in_app_code() != "":
     st.markdown("### ⚙️ Full Script (Streamlit Compatible)")
-    in_app = state.get_in_app_code()
-    in_app = re.sub(r'pd\.read_csv\s*\((?:[^)(]+|\([^)]*\))*\)', "df.copy()", in_app)
-    in_app = re.sub(r'df\s*=\s*pd\.DataFrame\s*\(\s*\)', "df = df.copy()", in_app)
-    in_app = re.sub(r'set\s*\(\s*stopwords_words\s*\)', "stopwords_words", in_app)
+    in_app = rewrite_in_app_code(state.get_in_app_code())
     st.code(in_app, "python")
     
     if st.button("▶️ Run In-App Code"):
         ExecutionHandler.execute_code(in_app, language)
+    # SQL results stay on screen (and pageable) across reruns
+    ExecutionHandler.show_result_view(in_app)
+    # Large datasets: the sample preview, replaced by the full result once the background run ends
+    ExecutionHandler.show_progressive_run(in_app)
 
     if st.button("🔎 Explain Code"):
         try:
@@ -79,7 +90,7 @@ if state.get_in_app_code() != "":
                 prompt = f"Explain this Python pandas code line‑by‑line:\n{in_app}"
             else:
                 prompt = f"Explain this SQL code line‑by‑line:\n{in_app}"
-            state.set_explanation(llm_groq.invoke(prompt).content)
+            state.set_explanation(invoke_llm(get_llm_groq(), prompt))
         except Exception as e:
             st.error(f"Explain error: {e}")
 
@@ -89,20 +100,19 @@ if state.get_in_app_code() != "":
         
         
 
-# --- Helper: Detect column types ---
-def get_column_types(df):
-    numerical = df.select_dtypes(include=['number']).columns.tolist()
-    categorical = df.select_dtypes(include=['object', 'category', 'bool']).columns.tolist()
-    datetime = df.select_dtypes(include=['datetime64', 'datetime']).columns.tolist()
+# --- Helper: Detect column types (from the schema stored at ingest, no DataFrame scan) ---
+def get_column_types():
+    types = state.get_column_types()
+    numerical = [c for c, t in types.items() if t in ("int", "float")]
+    categorical = [c for c, t in types.items() if t in ("str", "bool")]
+    datetime = [c for c, t in types.items() if t in ("date", "time")]
     return numerical, categorical, datetime
 
 # --- AI-Driven Visualization Based on User Question ---
-if state.get_df() is not None:
+if state.has_data():
     st.divider()
     st.markdown("### :bar_chart: Custom Visualization")
 
-    df = state.get_df().copy()
-
     chart_type = st.selectbox("Select chart type", [
         "Histogram", "Bar Chart", "Line Chart", "Scatter Plot", "Heatmap"])
 
@@ -112,7 +122,12 @@ if state.get_df() is not None:
 
     if st.button(":bar_chart: Generate Visualization"):
 
-        columns_list = df.columns.tolist()
+        columns_list, _ = ColumnIndex.prompt_columns(
+            f"{question_for_plot} {chart_type}", state.get_columns_as_list(), state.get_column_types()
+        )
+        _, _, date_columns = get_column_types()
+        if DataHandler.chart_sampled():
+            st.caption(f"Chart drawn from a sample of up to {DataHandler.CHART_SAMPLE_ROWS:,} rows.")
 
         vis_prompt = f"""
         You are a helpful Python assistant that creates data visualizations using matplotlib or seaborn in Streamlit.
@@ -125,8 +140,9 @@ if state.get_df() is not None:
         Instructions:
         - Do NOT combine numerical columns into strings (e.g., avoid 'rpm-torque' keys)
         - Use numeric columns as-is for axes, especially when analyzing correlations
-        - If question implies correlation, use a seaborn.heatmap on a correlation matrix (df.corr())
-        - If the question involves days, months, or datetime grouping, always convert columns like df["Date"] using pd.to_datetime(df["Date"], errors="coerce")
+        - If question implies correlation, use a seaborn.heatmap on a correlation matrix (df.corr(numeric_only=True))
+        - These columns are already datetime64, use them directly without pd.to_datetime: {date_columns}
+        - If the question involves days, months, or datetime grouping on any other date-like column, convert it like df["Date"] using pd.to_datetime(df["Date"], errors="coerce")
         - If the question is about counts by category, group appropriately using groupby
         - Automatically select appropriate columns for x and y based on the question
         - Create the chart using this structure:
@@ -143,19 +159,13 @@ if state.get_df() is not None:
 
 
         try:
-            vis_code = llm_groq.invoke(vis_prompt).content
-            if isinstance(vis_code, list):
-                vis_code = "\n".join(vis_code)
-
-            vis_code = re.sub(r"```(?:python)?", "", vis_code).strip("`")
-            vis_code = re.sub(r"\bst\.pyplot\s*\(\s*\)", "st.pyplot(fig)", vis_code)
-            if "fig, ax = plt.subplots()" not in vis_code:
-                vis_code = "fig, ax = plt.subplots()\n" + vis_code
-
-            local = {"df": df.copy(), "st": st, "plt": plt, "sns": sns, "pd": pd}
+            vis_code = invoke_llm(get_llm_groq(), vis_prompt)
+            vis_code = rewrite_visualization_code(vis_code)
 
-            with st.spinner("Generating chart..."):
-                exec(vis_code, {}, local)
+            outcome = ExecutionHandler.run_chart(vis_code, chart_type)
+            outcome.replay(st)
+            if outcome.error:
+                st.error(f"Visualization error: {outcome.error}")
 
         except Exception as e:
             st.error(f"Visualization error: {e}")
@@ -170,6 +180,6 @@ if state.get_recent_questions() != []:
             state.remove_recent_question(i)
             st.rerun()
 
-if llm_groq is None:
+if not GROQ_API_KEY:
     st.error("🚫 AI functionality is not available. Please configure your API keys.")
     st.stop()
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = Path(tempfile.mkdtemp(prefix="myquery-tests-"))
+
+# The app reads its settings at import time, so isolate it before any test imports it
+os.environ.update(
+    MYQUERY_CACHE_DIR=str(WORKDIR / "cache"),
+    MYQUERY_DB_PATH=str(WORKDIR / "tests.db"),
+    MYQUERY_LLM_CACHE="0",
+    MYQUERY_OFFLINE="1",
+)
+os.environ.setdefault("GROQ_API_KEY", "tests")
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,83 @@
+import duckdb
+import pytest
+from utils.catalog import DatasetCatalog, parquet_source
+from utils.connections import DuckDBConnectionManager
+from utils.ingest import IngestCache
+
+ORDERS = b"order_id,customer_id,amount\n0,1,10.5\n1,2,20\n2,1,30\n3,3,40\n4,2,50\n5,1,60\n"
+CUSTOMERS = b"customer_id,name,city\n1,ann,x\n2,bob,\n3,cy,z\n"
+
+
+def upload(name: str, data: bytes) -> dict:
+    key = IngestCache.content_hash(data)
+    return DatasetCatalog.add(name, key, f"{name}.csv", IngestCache.ensure_parquet(data, key))
+
+
+def session(name: str, data: bytes):
+    key = IngestCache.content_hash(data)
+    return DuckDBConnectionManager.acquire(key, name, IngestCache.ensure_parquet(data, key))
+
+
+def fetch(handle, query: str) -> list:
+    return list(handle.execute(query).itertuples(index=False, name=None))
+
+
+def test_entry_has_rows_types_and_footer_statistics():
+    entry = upload("cat_orders", ORDERS)
+    assert (entry["rows"], entry["columns"]) == (6, 3)
+    assert list(entry["types"]) == ["order_id", "customer_id", "amount"]
+    assert entry["column_stats"]["amount"] == {"nulls": 0, "min": "10.5", "max": "60.0"}
+    assert "cat_orders" in [t["name"] for t in DatasetCatalog.tables()]
+
+
+def test_views_read_widened_columns():
+    upload("cat_widened", ORDERS)
+    types = duckdb.sql(f"DESCRIBE SELECT * FROM {parquet_source(IngestCache.ensure_parquet(ORDERS))}")
+    assert {row[0]: row[1] for row in types.fetchall()} == {
+        "order_id": "BIGINT", "customer_id": "BIGINT", "amount": "DOUBLE",
+    }
+
+
+def test_session_queries_join_other_uploads():
+    upload("cat_customers", CUSTOMERS)
+    handle = session("cat_sales", ORDERS)
+    query = ("SELECT c.name, SUM(o.amount) AS total FROM cat_sales o JOIN cat_customers c USING (customer_id) "
+             "GROUP BY c.name ORDER BY total DESC")
+    assert fetch(handle, query) == [("ann", 100.5), ("bob", 70.0), ("cy", 40.0)]
+    assert DatasetCatalog.dependencies(query, "cat_sales") == (
+        ("cat_customers", IngestCache.content_hash(CUSTOMERS)),
+    )
+    assert DatasetCatalog.joined_columns(query, "cat_sales") == [
+        "cat_customers.customer_id", "cat_customers.name", "cat_customers.city",
+    ]
+
+
+def test_name_collision_gets_a_suffix_and_removal_reaches_sessions():
+    upload("cat_people", CUSTOMERS)
+    handle = session("cat_lookup", ORDERS)
+    query = "SELECT name FROM cat_people ORDER BY customer_id"
+    assert fetch(handle, query) == [("ann",), ("bob",), ("cy",)]
+
+    # Another upload with the same name never replaces the table other sessions use
+    changed = CUSTOMERS.replace(b"ann", b"ANN")
+    entry = upload("cat_people", changed)
+    assert entry["name"] == f"cat_people_{IngestCache.content_hash(changed)[:8]}"
+    assert fetch(handle, query) == [("ann",), ("bob",), ("cy",)]
+    assert fetch(handle, f"SELECT name FROM {entry['name']} ORDER BY customer_id") == [("ANN",), ("bob",), ("cy",)]
+    assert upload("cat_people", CUSTOMERS)["name"] == "cat_people"
+
+    DatasetCatalog.remove("cat_people")
+    with pytest.raises(duckdb.CatalogException):
+        handle.execute(query)
+
+
+def test_prompt_lists_only_the_given_tables_named_in_the_question_first():
+    upload("cat_regions", b"region,manager\nnorth,a\nsouth,b\n")
+    upload("cat_targets", b"customer_id,target\n1,5\n")
+    upload("cat_private", b"customer_id,secret\n1,x\n")
+    lines = DatasetCatalog.prompt_tables("targets per cat_regions manager", ["cat_regions", "cat_targets"],
+                                         ["customer_id"])
+    assert lines.splitlines()[0].strip().startswith("- cat_regions (2 rows)")
+    assert "cat_targets" in lines
+    assert "cat_private" not in lines
+    assert DatasetCatalog.prompt_tables("anything", [], ["customer_id"]) == ""
@@ -0,0 +1,95 @@
+import io
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from utils.connections import DuckDBConnectionManager
+from utils.dtypes import DtypeOptimizer
+from utils.ingest import IngestCache
+from utils.store import DatasetStore
+
+ROWS = 2000
+CSV = ("id,small,big,half,price,region,comment,day\n" + "".join(
+    f"{i},{i % 100},{i * 10_000_000_000},{i / 2},{i * 1.01:.2f},{'NSEW'[i % 4]},"
+    f"{'' if i % 9 == 0 else f'note {i}'},{i % 12 + 1:02d}/{i % 28 + 1:02d}/2024\n"
+    for i in range(ROWS)
+)).encode()
+
+
+def expected_frame() -> pd.DataFrame:
+    # What pandas itself makes of the file, with text as pyarrow strings and the dates parsed
+    df = pd.read_csv(io.BytesIO(CSV))
+    for column in ("region", "comment"):
+        df[column] = df[column].astype(pd.StringDtype("pyarrow"))
+    df["day"] = pd.to_datetime(df["day"], format="%m/%d/%Y")
+    return df
+
+
+def assert_computation_frame(df: pd.DataFrame):
+    expected = expected_frame()
+    for column in ("id", "small", "big"):
+        assert df[column].dtype == "int64", column
+    for column in ("half", "price"):
+        assert df[column].dtype == "float64", column
+    for column in ("region", "comment"):
+        assert df[column].dtype == pd.StringDtype("pyarrow"), column
+    assert not any(isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    assert pd.api.types.is_datetime64_dtype(df["day"])
+
+
+@pytest.fixture(scope="module")
+def parquet_path():
+    return IngestCache.ensure_parquet(CSV)
+
+
+def test_storage_is_narrow(parquet_path):
+    schema = pq.read_schema(parquet_path)
+    assert str(schema.field("small").type) == "int8"
+    assert str(schema.field("id").type) == "int16"
+    assert str(schema.field("big").type) == "int64"
+    assert str(schema.field("half").type) == "float"          # exact in float32
+    assert str(schema.field("price").type) == "double"        # 1.01 * i is not
+    assert str(schema.field("region").type).startswith("dictionary")
+    report = DtypeOptimizer.report(schema)
+    assert report["rows"] == ROWS and report["bytes_after"] < report["bytes_before"]
+
+
+def test_loaded_frame_matches_read_csv():
+    assert_computation_frame(IngestCache.load(CSV))
+
+
+def test_shared_store_frame_matches_read_csv(parquet_path):
+    handle = DatasetStore.acquire(IngestCache.content_hash(CSV), parquet_path)
+    try:
+        assert_computation_frame(handle.frame)
+        assert str(handle.table.schema.field("small").type) == "int64"
+    finally:
+        handle.close()
+
+
+def test_sandbox_frame_matches_read_csv(parquet_path):
+    from collections import OrderedDict
+    from utils.sandbox import _load_frame
+
+    ipc_path = IngestCache.ensure_ipc(IngestCache.content_hash(CSV), parquet_path=parquet_path)
+    assert_computation_frame(_load_frame(OrderedDict(), "frame", str(ipc_path)))
+
+
+@pytest.mark.parametrize("source", ["parquet", "arrow"])
+def test_duckdb_sees_wide_types(parquet_path, source):
+    key = f"dtypes-{source}"
+    data = parquet_path if source == "parquet" else pq.read_table(parquet_path)
+    handle = DuckDBConnectionManager.acquire(key, "t", data)
+    try:
+        types = dict(DuckDBConnectionManager.execute(key, "DESCRIBE t")[["column_name", "column_type"]].values)
+        assert types.pop("day").startswith("TIMESTAMP")
+        assert types == {
+            "id": "BIGINT", "small": "BIGINT", "big": "BIGINT", "half": "DOUBLE", "price": "DOUBLE",
+            "region": "VARCHAR", "comment": "VARCHAR",
+        }
+        total = DuckDBConnectionManager.execute(key, "SELECT SUM(small) AS s, SUM(price) AS p FROM t")
+        expected = expected_frame()
+        assert total["s"][0] == expected["small"].sum()
+        assert total["p"][0] == pytest.approx(expected["price"].sum())
+    finally:
+        handle.close()
@@ -0,0 +1,96 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from utils import ingest
+from utils.dtypes import DtypeOptimizer
+from utils.ingest import IngestCache
+
+HEADER = b"id,category,amount,day,note\n"
+
+
+def rows(start: int, stop: int) -> bytes:
+    return b"".join(
+        b"%d,%s,%.2f,%s,%s\n" % (
+            i, b"ABC"[i % 3:i % 3 + 1], i * 1.25, b"03/%02d/2024" % (i % 28 + 1), b"" if i % 7 == 0 else b"n%d" % i,
+        )
+        for i in range(start, stop)
+    )
+
+
+def full_parse(data: bytes):
+    # What a fresh ingest of the whole file stores (Parquet has no second-resolution timestamps)
+    buffer = pa.BufferOutputStream()
+    pq.write_table(DtypeOptimizer.optimize(IngestCache.parse_csv(data)), buffer)
+    return pq.read_table(pa.BufferReader(buffer.getvalue()))
+
+
+def stored(data: bytes):
+    path = IngestCache.ensure_parquet(data)
+    return path, pq.read_table(path)
+
+
+def test_appended_rows_match_a_full_parse():
+    base = HEADER + rows(0, 300)
+    grown = base + rows(300, 450)
+    stored(base)
+
+    path, table = stored(grown)
+    assert path.is_dir() and len(IngestCache.segments(path)) == 2
+    expected = full_parse(grown)
+    assert table.schema.remove_metadata() == expected.schema.remove_metadata()
+    assert table.to_pylist() == expected.to_pylist()
+    assert IngestCache.row_count(path) == 450
+
+
+def test_repeated_appends_keep_adding_segments():
+    data = HEADER + rows(1000, 1100)
+    stored(data)
+    for start in (1100, 1200, 1300):
+        data += rows(start, start + 100)
+        path, table = stored(data)
+    assert len(IngestCache.segments(path)) == 4
+    assert table.to_pylist() == full_parse(data).to_pylist()
+
+
+def test_segments_are_compacted_past_the_limit(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_SEGMENTS", 2)
+    data = HEADER + rows(2000, 2100)
+    stored(data)
+    for start in (2100, 2200):
+        data += rows(start, start + 100)
+        path, table = stored(data)
+    assert len(IngestCache.segments(path)) == 1
+    assert table.to_pylist() == full_parse(data).to_pylist()
+
+
+def test_corrupt_segmented_copy_is_parsed_again():
+    base = HEADER + rows(3000, 3100)
+    grown = base + rows(3100, 3200)
+    stored(base)
+    path, _ = stored(grown)
+    IngestCache.segments(path)[-1].write_bytes(b"not parquet")
+
+    table = IngestCache.load_table(grown)
+    assert table.to_pylist() == full_parse(grown).to_pylist()
+    path = IngestCache.parquet_path(IngestCache.content_hash(grown))
+    assert path.is_file() and pq.read_table(path).num_rows == 200
+
+
+def test_rows_that_do_not_fit_the_stored_types_are_parsed_in_full():
+    base = HEADER + rows(0, 50)                     # ids fit a narrow integer
+    grown = base + b"5000000000,A,1.00,03/01/2024,big\n"
+    stored(base)
+
+    path, table = stored(grown)
+    assert not path.is_dir()
+    assert table.to_pylist() == full_parse(grown).to_pylist()
+
+
+@pytest.mark.parametrize("start, tail", [(3000, b""), (4000, b"7,A,1.0,03/01/2024,x\n")])
+def test_edited_rows_are_not_taken_for_appends(start, tail):
+    base = HEADER + rows(start, start + 10)
+    stored(base)
+    edited = base.replace(b"%d," % (start + 5), b"%d," % (start + 6)) + tail   # an earlier row changed
+    path, table = stored(edited)
+    assert not path.is_dir()
+    assert table.to_pylist() == full_parse(edited).to_pylist()
@@ -0,0 +1,59 @@
+import csv
+from utils.connections import DuckDBConnectionManager
+from utils.ingest import IngestCache
+from utils.results import ResultSet
+
+DATA = b"id,city,amount\n" + b"".join(
+    b"%d,%s,%d\n" % (i, (b"Paris", b"Oslo", b"Lima")[i % 3], (i * 37) % 101) for i in range(250)
+)
+QUERY = "SELECT id, city, amount FROM results_data ORDER BY amount DESC, id"
+
+
+def result(cache_key: str, query: str = QUERY) -> ResultSet:
+    key = IngestCache.content_hash(DATA)
+    handle = DuckDBConnectionManager.acquire(key, "results_data", IngestCache.ensure_parquet(DATA, key))
+    return ResultSet.create(handle, query, cache_key)
+
+
+def expected():
+    rows = [(i, ("Paris", "Oslo", "Lima")[i % 3], (i * 37) % 101) for i in range(250)]
+    return sorted(rows, key=lambda r: (-r[2], r[0]))
+
+
+def ids(frame) -> list:
+    return frame["id"].tolist()
+
+
+def test_pages_keep_the_query_order():
+    results = result("results-order")
+    assert results.row_count == 250 and results.columns == ["id", "city", "amount"]
+    pages = [ids(results.page(n, rows=100)) for n in range(3)]
+    assert [len(p) for p in pages] == [100, 100, 50]
+    assert sum(pages, []) == [r[0] for r in expected()]
+    assert results.page(3, rows=100).empty
+
+
+def test_sorted_and_filtered_pages():
+    results = result("results-filter")
+    assert ids(results.page(0, rows=5, sort="id")) == [0, 1, 2, 3, 4]
+    assert ids(results.page(0, rows=5, sort="id", descending=True)) == [249, 248, 247, 246, 245]
+    oslo = [r[0] for r in expected() if r[1] == "Oslo"]
+    assert results.count("city", "osl") == len(oslo)
+    assert ids(results.page(0, rows=1000, filter_column="city", filter_text="OSL")) == oslo
+    assert results.count(None, "lima") == len([r for r in expected() if r[1] == "Lima"])
+
+
+def test_cached_result_and_export():
+    results = result("results-export")
+    assert ResultSet.cached("results-export").row_count == 250
+    assert ResultSet.cached("results-missing") is None
+    path = results.export_csv(sort="id", filter_column="city", filter_text="Paris")
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [int(r["id"]) for r in rows] == list(range(0, 250, 3))
+
+
+def test_statements_that_are_not_a_select_still_page():
+    results = result("results-describe", "DESCRIBE results_data")
+    assert results.row_count == 3
+    assert results.page(0)["column_name"].tolist() == ["id", "city", "amount"]
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+import pytest
+from utils import routing
+from utils.routing import ModelRouter, AllBackendsFailed
+
+
+class FakeModel:
+    # Answers after `delay` seconds, or raises while `failing`; records every call
+    def __init__(self, name, delay=0.0, failing=False):
+        self.model_name = name
+        self.delay = delay
+        self.failing = failing
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError(f"{self.model_name} down")
+        return f"{self.model_name}: {prompt}"
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError(f"{self.model_name} down")
+        return f"{self.model_name}: {prompt}"
+
+    async def astream(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError(f"{self.model_name} down")
+        for word in ("from", self.model_name):
+            yield word
+
+
+def collect(router, prompt):
+    async def run():
+        return [chunk async for chunk in router.astream(prompt)]
+    return asyncio.run(run())
+
+
+def test_configured_order_until_measured():
+    primary, fallback = FakeModel("primary"), FakeModel("fallback")
+    router = ModelRouter("generation", [primary, fallback], hedge=False)
+    assert [b.name for b in router.candidates("invoke")] == ["primary", "fallback"]
+    assert router.invoke("q") == "primary: q"
+    assert fallback.calls == 0
+
+
+def test_failover_in_order():
+    first, second, third = FakeModel("first", failing=True), FakeModel("second", failing=True), FakeModel("third")
+    router = ModelRouter("generation", [first, second, third], hedge=False)
+    assert router.invoke("q") == "third: q"
+    assert (first.calls, second.calls, third.calls) == (1, 1, 1)
+
+
+def test_measured_backends_ranked_by_expected_latency():
+    slow, fast = FakeModel("slow"), FakeModel("fast")
+    router = ModelRouter("generation", [slow, fast], hedge=False)
+    for _ in range(routing.MIN_SAMPLES):
+        router.backends[0].health.record_success("invoke", 0.5)
+        router.backends[1].health.record_success("invoke", 0.1)
+    assert [b.name for b in router.candidates("invoke")] == ["fast", "slow"]
+    # Errors inflate the expected latency
+    for _ in range(routing.BREAKER_FAILURES - 1):
+        router.backends[1].health.record_failure()
+    router.backends[1].health.record_success("invoke", 0.1)
+    assert router.backends[1].health.expected_seconds("invoke") > 0.1
+
+
+def test_sync_failover_inside_running_loop():
+    primary, fallback = FakeModel("primary", failing=True), FakeModel("fallback")
+    router = ModelRouter("generation", [primary, fallback], hedge=False)
+
+    async def run():
+        return router.invoke("q")  # no nested event loop: plain failover
+    assert asyncio.run(run()) == "fallback: q"
+
+
+class LoopBoundModel(FakeModel):
+    # Like a chat model's cached async HTTP client: only usable on the loop it first ran on
+    loop = None
+
+    async def ainvoke(self, prompt):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        if self.loop is not asyncio.get_running_loop():
+            raise RuntimeError("Event loop is closed")
+        return await super().ainvoke(prompt)
+
+
+def test_sync_calls_share_one_event_loop():
+    backend = LoopBoundModel("primary")
+    router = ModelRouter("generation", [backend], hedge=False)
+    answers = [router.invoke("q") for _ in range(2)]
+    thread = threading.Thread(target=lambda: answers.append(router.invoke("q")))
+    thread.start()
+    thread.join()
+    assert answers == ["primary: q"] * 3
+    assert router.backends[0].health.consecutive_failures == 0
+
+
+def test_stream_fails_over_before_first_chunk():
+    primary, fallback = FakeModel("primary", failing=True), FakeModel("fallback")
+    router = ModelRouter("generation", [primary, fallback], hedge=False)
+    assert collect(router, "q") == ["from", "fallback"]
+
+
+def test_all_backends_failed():
+    router = ModelRouter("review", [FakeModel("a", failing=True), FakeModel("b", failing=True)], hedge=False)
+    with pytest.raises(AllBackendsFailed, match="a: a down; b: b down"):
+        asyncio.run(router.ainvoke("q"))
+
+
+def test_hedge_answers_from_spare_when_primary_is_slow(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_DEFAULT_SECONDS", 0.05)
+    slow, fast = FakeModel("slow", delay=2.0), FakeModel("fast", delay=0.01)
+    router = ModelRouter("generation", [slow, fast], hedge=True)
+    start = time.monotonic()
+    assert asyncio.run(router.ainvoke("q")) == "fast: q"
+    assert time.monotonic() - start < 1.0
+    assert (slow.calls, fast.calls) == (1, 1)
+
+
+def test_no_hedge_while_primary_is_within_its_delay(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_DEFAULT_SECONDS", 1.0)
+    primary, spare = FakeModel("primary", delay=0.01), FakeModel("spare")
+    router = ModelRouter("generation", [primary, spare], hedge=True)
+    assert asyncio.run(router.ainvoke("q")) == "primary: q"
+    assert spare.calls == 0
+
+
+def test_no_hedge_without_another_healthy_backend(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_DEFAULT_SECONDS", 0.05)
+    only = FakeModel("only", delay=0.2)
+    router = ModelRouter("generation", [only], hedge=True)
+    assert asyncio.run(router.ainvoke("q")) == "only: q"
+    assert only.calls == 1
+
+
+def test_hedged_stream_closes_the_loser(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_DEFAULT_SECONDS", 0.05)
+    slow, fast = FakeModel("slow", delay=2.0), FakeModel("fast")
+    router = ModelRouter("generation", [slow, fast], hedge=True)
+    assert collect(router, "q") == ["from", "fast"]
+
+
+def test_breaker_opens_then_half_open_probe(monkeypatch):
+    monkeypatch.setattr(routing, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(routing, "BREAKER_COOLDOWN_SECONDS", 60)
+    flaky, steady = FakeModel("flaky", failing=True), FakeModel("steady")
+    router = ModelRouter("generation", [flaky, steady], hedge=False)
+    health = router.backends[0].health
+
+    router.invoke("1")
+    assert health.state() == "closed"
+    router.invoke("2")
+    assert health.state() == "open"
+
+    # Open: skipped without a call, and ranked last
+    router.invoke("3")
+    assert flaky.calls == 2
+    assert router.candidates("invoke")[-1].name == "flaky"
+
+    # Cooldown over: exactly one probe gets through
+    health.open_until = time.monotonic() - 1
+    assert health.state() == "half-open"
+    assert health.allow() is True
+    assert health.allow() is False
+
+    # A failed probe re-opens the breaker, a successful one closes it
+    health.record_failure()
+    assert health.state() == "open"
+    health.open_until = time.monotonic() - 1
+    flaky.failing = False
+    assert router.invoke("4") == "flaky: 4"
+    assert health.state() == "closed"
+
+
+def test_open_breaker_still_tried_when_nothing_else_is_left(monkeypatch):
+    monkeypatch.setattr(routing, "BREAKER_FAILURES", 1)
+    only = FakeModel("only", failing=True)
+    router = ModelRouter("review", [only], hedge=False)
+    with pytest.raises(AllBackendsFailed):
+        asyncio.run(router.ainvoke("q"))
+    assert router.backends[0].health.state() == "open"
+    # Still cooling down, but a fully degraded role still gets an attempt
+    only.failing = False
+    assert asyncio.run(router.ainvoke("q")) == "only: q"
+    assert router.backends[0].health.state() == "closed"
+
+
+def test_latency_ranking_uses_the_shared_percentile():
+    health = routing.BackendHealth()
+    for seconds in (1, 2, 3, 4):
+        health.record_success("invoke", seconds)
+    assert health.percentile("invoke", 50) is None   # too few samples
+    health.record_success("invoke", 5)
+    assert health.percentile("invoke", 50) == 3
+    assert health.percentile("invoke", 95) == pytest.approx(4.8)
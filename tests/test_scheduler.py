@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+import pytest
+from llm_config import invoke_llm, ainvoke_llm, astream_llm
+from utils.scheduler import RateLimiter, InFlight, Abandoned
+
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = {"input_tokens": 10, "output_tokens": 5}
+
+
+class FakeModel:
+    # Streams "a", "b", "c", "d" a chunk every `delay` seconds, or raises while `failing`
+    def __init__(self, delay=0.1, failing=False):
+        self.model_name = "fake"
+        self.temperature = 0.2
+        self.delay = delay
+        self.failing = failing
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay * 3)
+        if self.failing:
+            raise RuntimeError("upstream down")
+        return Message("whole")
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay * 3)
+        return Message("whole")
+
+    async def astream(self, prompt):
+        self.calls += 1
+        for chunk in "abcd":
+            await asyncio.sleep(self.delay)
+            yield Message(chunk)
+
+
+def stream(llm, prompt):
+    async def run():
+        return "".join([chunk async for chunk in astream_llm(llm, prompt)])
+    return asyncio.run(run())
+
+
+def in_threads(*targets, stagger=0.03):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join()
+
+
+def test_identical_calls_share_one_upstream_call():
+    llm, results = FakeModel(), {}
+    in_threads(
+        lambda: results.__setitem__(0, invoke_llm(llm, "shared invoke")),
+        lambda: results.__setitem__(1, invoke_llm(llm, "shared invoke")),
+        lambda: results.__setitem__(2, asyncio.run(ainvoke_llm(llm, "shared invoke"))),
+    )
+    assert results == {0: "whole", 1: "whole", 2: "whole"}
+    assert llm.calls == 1
+    assert InFlight.stats()["in_flight"] == 0
+
+
+def test_streams_follow_the_leaders_chunks():
+    llm, results = FakeModel(), {}
+    in_threads(*(lambda i=i: results.__setitem__(i, stream(llm, "shared stream")) for i in range(3)))
+    assert results == {0: "abcd", 1: "abcd", 2: "abcd"}
+    assert llm.calls == 1
+
+
+def test_errors_are_shared():
+    llm, errors = FakeModel(failing=True), []
+
+    def call():
+        try:
+            invoke_llm(llm, "shared failure")
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    in_threads(call, call)
+    assert errors == ["upstream down", "upstream down"]
+    assert llm.calls == 1
+
+
+def cancelled_leader(llm, prompt, after):
+    async def run():
+        async def consume():
+            async for _ in astream_llm(llm, prompt):
+                pass
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(after)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(run())
+
+
+def test_cancelled_leader_lets_waiting_followers_retry():
+    llm, results = FakeModel(), {}
+    in_threads(
+        lambda: cancelled_leader(llm, "abandoned early", after=0.05),
+        lambda: results.__setitem__("follower", stream(llm, "abandoned early")),
+    )
+    assert results == {"follower": "abcd"}
+    assert llm.calls == 2
+
+
+def test_follower_with_partial_answer_is_not_retried():
+    llm, errors = FakeModel(), []
+
+    def follower():
+        try:
+            stream(llm, "abandoned late")
+        except Abandoned as e:
+            errors.append(e)
+
+    in_threads(lambda: cancelled_leader(llm, "abandoned late", after=0.25), follower)
+    assert len(errors) == 1
+    assert llm.calls == 1
+
+
+def test_rate_limiter_settles_reserved_tokens():
+    limiter = RateLimiter("tests", 0, 1000)
+    reserved = limiter.wait("x" * 400)
+    left = limiter.stats()["tokens_left"]
+    limiter.settle(reserved, {"prompt_tokens": 100, "completion_tokens": 50})
+    stats = limiter.stats()
+    assert stats["tokens_left"] == left + reserved - 150
+    assert stats["granted"] == 1
+    assert stats["wait_p50_s"] is not None
@@ -0,0 +1,35 @@
+import pytest
+from utils.tracing import Tracer
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    monkeypatch.setattr(Tracer, "enabled", True)
+    Tracer.clear()
+    yield
+    Tracer.clear()
+
+
+def names(spans) -> list:
+    return sorted(s["name"] for s in spans)
+
+
+def test_nested_spans_are_written_when_the_root_ends(tracing):
+    with Tracer.span("run"):
+        with Tracer.span("execute"):
+            pass
+        assert Tracer.export() == []
+    spans = Tracer.export()
+    assert names(spans) == ["execute", "run"]
+    assert len({s["trace_id"] for s in spans}) == 1
+
+
+def test_detached_span_ending_after_the_root_is_kept(tracing):
+    with Tracer.span("generate"):
+        stream = Tracer.start("llm.stream")
+    assert names(Tracer.export()) == ["generate"]
+    stream.set(completion_tokens=12)
+    stream.end()
+    spans = {s["name"]: s for s in Tracer.export()}
+    assert spans["llm.stream"]["parent_id"] == spans["generate"]["span_id"]
+    assert spans["llm.stream"]["completion_tokens"] == 12
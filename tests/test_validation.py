@@ -0,0 +1,78 @@
+import duckdb
+import pytest
+from utils.validation import CodeValidator
+from utils.invokers import AIResponseFormatHandler
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE sales AS SELECT * FROM (VALUES ('A', 1.5), ('B', 2.0)) t(category, amount)")
+    yield conn
+    conn.close()
+
+
+def test_single_select_passes(conn):
+    assert CodeValidator.validate_sql("SELECT category, SUM(amount) FROM sales GROUP BY category;", conn) == []
+
+
+def test_multiple_statements_are_reported(conn):
+    query = "SELECT category FROM sales;\nSELECT category FROM sales;"
+    assert CodeValidator.validate_sql(query, conn) == ["expected a single SQL statement, got 2"]
+
+
+def test_unknown_column_is_reported(conn):
+    diagnostics = CodeValidator.validate_sql("SELECT revenue FROM sales", conn)
+    assert len(diagnostics) == 1 and "revenue" in diagnostics[0]
+
+
+def test_non_select_is_not_checked_locally(conn):
+    assert CodeValidator.validate_sql("DROP TABLE sales", conn) == [
+        "only SELECT queries are checked locally, got DROP"
+    ]
+
+
+def test_syntax_error_is_reported(conn):
+    assert CodeValidator.validate_sql("SELEC category FROM sales", conn)
+
+
+def test_sql_response_splits_into_standalone_and_clean_query(conn):
+    response = (
+        "-- SELECT: each category and its total\n"
+        "SELECT category, SUM(amount) AS total -- summed per category\n"
+        "FROM sales\n"
+        "GROUP BY category;\n"
+        "SELECT category, SUM(amount) AS total\n"
+        "FROM sales\n"
+        "GROUP BY category;"
+    )
+    full, in_app = AIResponseFormatHandler.split_sections(response, "sales.csv", "SQL")
+    assert full.startswith("-- SELECT") and full.count("SELECT category") == 1
+    assert in_app == "SELECT category, SUM(amount) AS total\nFROM sales\nGROUP BY category;"
+    assert CodeValidator.validate_sql(in_app, conn) == []
+
+
+def test_single_sql_statement_is_used_for_both_sections():
+    full, in_app = AIResponseFormatHandler.split_sections("SELECT 1;", None, "SQL")
+    assert full == in_app == "SELECT 1;"
+
+
+def test_python_without_marker_is_unchanged():
+    full, in_app = AIResponseFormatHandler.split_sections("result = df['a'].sum()", None, "Python")
+    assert full == in_app == "result = df['a'].sum()"
+
+
+def test_stripped_header_names_need_the_code_to_strip_them():
+    columns = [" Sales", "Region "]
+    assert CodeValidator.validate_python("total = df['Sales'].sum()", columns) == [
+        "line 1: column 'Sales' is ' Sales' in the dataset; strip df.columns first"
+    ]
+    stripped = (
+        "data = df.copy()\n"
+        "data.columns = data.columns.str.strip()\n"
+        "result = data.groupby('Region')['Sales'].sum()\n"
+    )
+    assert CodeValidator.validate_python(stripped, columns) == []
+    # A reference before the strip still needs the original header
+    early = "total = df['Sales'].sum()\ndf.columns = df.columns.str.strip()\n"
+    assert len(CodeValidator.validate_python(early, columns)) == 1
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from .database import ensure_schema, CACHE_DIR, env_flag, env_int
+
+
+class LLMCache:
+    # --- persistent prompt -> response cache, shared by every session and worker ---
+    enabled = env_flag("MYQUERY_LLM_CACHE")
+    ttl_seconds = env_int("MYQUERY_LLM_CACHE_TTL", 7 * 24 * 3600)
+    max_bytes = env_int("MYQUERY_LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024)
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access);
+    """
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        # Only whitespace that can't change meaning: line endings, trailing spaces, blank edges.
+        # Indentation is kept because it is significant in the Python code we send for review.
+        lines = prompt.replace("\r\n", "\n").split("\n")
+        return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+    @classmethod
+    def make_key(cls, model: str, prompt: str, temperature) -> str:
+        raw = f"{model}\x00{temperature}\x00{cls.normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, model: str, prompt: str, temperature=None):
+        if not cls.enabled:
+            return None
+        key = cls.make_key(model, prompt, temperature)
+        now = time.time()
+        try:
+            with closing(cls._connect()) as conn:
+                row = conn.execute(
+                    "SELECT response FROM llm_cache WHERE key = ? AND created_at > ?",
+                    (key, now - cls.ttl_seconds),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE llm_cache SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                    (now, key),
+                )
+                return row[0]
+        except sqlite3.Error:
+            return None  # a broken cache must never block the actual LLM call
+
+    @classmethod
+    def set(cls, model: str, prompt: str, temperature, response: str):
+        if not cls.enabled or not isinstance(response, str):
+            return
+        key = cls.make_key(model, prompt, temperature)
+        now = time.time()
+        try:
+            with closing(cls._connect()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache "
+                    "(key, model, response, size, created_at, last_access, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, model, response, len(response.encode("utf-8")), now, now),
+                )
+                cls._evict(conn, now)
+        except sqlite3.Error:
+            pass
+
+    @classmethod
+    def clear(cls):
+        with closing(cls._connect()) as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    @classmethod
+    def stats(cls) -> dict:
+        with closing(cls._connect()) as conn:
+            entries, size, hits = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_cache"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "hits": hits}
+
+    @classmethod
+    def _evict(cls, conn, now: float):
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - cls.ttl_seconds,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= cls.max_bytes:
+            return
+
+        # Drop least recently used entries until we are back under the size budget
+        kept = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access DESC"):
+            kept += size
+            if kept > cls.max_bytes:
+                stale.append((key,))
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+
+    @classmethod
+    def _connect(cls):
+        return ensure_schema(cls._schema)
+
+
+class ResultCache:
+    # --- bounded in-memory LRU of execution results, optionally spilling evictions to disk ---
+    max_bytes = env_int("MYQUERY_RESULT_CACHE_MB", 256) * 1024 * 1024
+    spill_enabled = env_flag("MYQUERY_RESULT_CACHE_SPILL")
+    spill_max_bytes = env_int("MYQUERY_RESULT_CACHE_SPILL_MB", 1024) * 1024 * 1024
+    spill_dir = CACHE_DIR / "results"
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()  # key -> (value, size)
+    _bytes = 0
+    _counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "spills": 0}
+
+    @staticmethod
+    def make_key(dataset_key: str, language: str, normalized_code: str, *scope) -> str:
+        raw = "\x00".join([dataset_key, language, *map(str, scope), normalized_code])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, key: str):
+        with cls._lock:
+            if key in cls._entries:
+                cls._entries.move_to_end(key)
+                cls._counters["hits"] += 1
+                return cls._entries[key][0]
+
+        value = cls._read_spilled(key)
+        with cls._lock:
+            if value is None:
+                cls._counters["misses"] += 1
+                return None
+            cls._counters["disk_hits"] += 1
+        cls.put(key, value)  # promote back into memory
+        return value
+
+    @classmethod
+    def put(cls, key: str, value):
+        size = cls._sizeof(value)
+        if size > cls.max_bytes // 4:
+            return  # one huge result shouldn't flush everything else
+
+        evicted = []
+        with cls._lock:
+            if key in cls._entries:
+                cls._bytes -= cls._entries.pop(key)[1]
+            cls._entries[key] = (value, size)
+            cls._bytes += size
+            while cls._bytes > cls.max_bytes and cls._entries:
+                old_key, (old_value, old_size) = cls._entries.popitem(last=False)
+                cls._bytes -= old_size
+                cls._counters["evictions"] += 1
+                evicted.append((old_key, old_value))
+
+        for old_key, old_value in evicted:
+            cls._spill(old_key, old_value)
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            lookups = cls._counters["hits"] + cls._counters["disk_hits"] + cls._counters["misses"]
+            hits = cls._counters["hits"] + cls._counters["disk_hits"]
+            return {
+                **cls._counters,
+                "entries": len(cls._entries),
+                "bytes": cls._bytes,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+            cls._bytes = 0
+        for path in cls.spill_dir.glob("*.pkl"):
+            path.unlink(missing_ok=True)
+
+    @classmethod
+    def _sizeof(cls, value) -> int:
+        if hasattr(value, "memory_usage"):  # DataFrame
+            return int(value.memory_usage(deep=True).sum())
+        try:
+            return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return cls.max_bytes  # unpicklable, treat as too big to keep
+
+    @classmethod
+    def _spill(cls, key: str, value):
+        if not cls.spill_enabled:
+            return
+        try:
+            cls.spill_dir.mkdir(parents=True, exist_ok=True)
+            path = cls.spill_dir / f"{key}.pkl"
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            with cls._lock:
+                cls._counters["spills"] += 1
+            cls._trim_spill_dir()
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            pass
+
+    @classmethod
+    def _read_spilled(cls, key: str):
+        if not cls.spill_enabled:
+            return None
+        path = cls.spill_dir / f"{key}.pkl"
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)  # mark as recently used for the disk LRU
+            return value
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    @classmethod
+    def _trim_spill_dir(cls):
+        files = sorted(cls.spill_dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = 0
+        for path in files:
+            total += path.stat().st_size
+            if total > cls.spill_max_bytes:
+                path.unlink(missing_ok=True)
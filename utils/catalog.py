@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .database import CACHE_DIR, env_int
+from .formats import quote_sql_identifier, quote_sql_literal
+from .ingest import IngestCache
+from .dtypes import DtypeOptimizer
+
+# --- settings ---
+CATALOG_PATH = Path(os.getenv("MYQUERY_CATALOG_PATH", CACHE_DIR / "catalog.duckdb"))
+PROMPT_TABLES = env_int("MYQUERY_CATALOG_PROMPT_TABLES", 8)   # other tables listed in a SQL prompt
+
+SQL_TYPES = {pa.int64(): "BIGINT", pa.float64(): "DOUBLE", pa.string(): "VARCHAR"}
+
+
+class DatasetCatalog:
+    # --- every uploaded table, kept across restarts in a DuckDB database file ---
+    # Each table is a view over the upload's Parquet copy (see utils/ingest.py) plus a row of statistics
+    # in meta.tables. Session connections get the same views (see DuckDBConnectionManager), so generated
+    # SQL can join uploaded tables inside DuckDB. The file can also be opened with the duckdb CLI.
+    # Sessions only list and prompt with their own uploads and tables they add by name (see FileHandler).
+    _conn = None
+    _lock = threading.Lock()
+    _version = 0           # bumped on every change; connections re-sync their views when it moves
+    persistent = True      # False when another process holds the file and an in-memory catalog is used
+
+    @classmethod
+    def add(cls, table_name: str, dataset_key: str, filename: str, parquet_path) -> dict:
+        # Tables are shared by every session, so a name is never re-pointed at other data: an upload
+        # whose name is taken by different content gets "<name>_<hash>" (entry["name"] is the one used)
+        path = Path(parquet_path).resolve()
+        schema = IngestCache.schema(path)
+        entry = {
+            "name": table_name,
+            "dataset_key": dataset_key,
+            "filename": filename,
+            "path": str(path),
+            "rows": IngestCache.row_count(path),
+            "columns": len(schema.names),
+            "bytes": sum(segment.stat().st_size for segment in IngestCache.segments(path)),
+            "types": IngestCache.column_types(path),
+            "column_stats": _column_stats(path),
+        }
+        conn = cls._cursor()
+        with cls._lock:
+            current = conn.execute("SELECT dataset_key FROM meta.tables WHERE name = ?", [table_name]).fetchone()
+            if current is not None and current[0] != dataset_key:
+                table_name = entry["name"] = f"{table_name}_{dataset_key[:8]}"
+                current = conn.execute("SELECT dataset_key FROM meta.tables WHERE name = ?", [table_name]).fetchone()
+            if current is not None:
+                return entry
+            conn.execute("BEGIN")
+            conn.execute(f"CREATE OR REPLACE VIEW {quote_sql_identifier(table_name)} AS "
+                         f"SELECT * FROM {parquet_source(path)}")
+            conn.execute(
+                "INSERT INTO meta.tables VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [table_name, dataset_key, filename, entry["path"], entry["rows"], entry["columns"],
+                 entry["bytes"], json.dumps(entry["types"]), json.dumps(entry["column_stats"]), time.time()],
+            )
+            conn.execute("COMMIT")
+            cls._version += 1
+        return entry
+
+    @classmethod
+    def remove(cls, table_name: str):
+        conn = cls._cursor()
+        with cls._lock:
+            conn.execute("BEGIN")
+            conn.execute(f"DROP VIEW IF EXISTS {quote_sql_identifier(table_name)}")
+            conn.execute("DELETE FROM meta.tables WHERE name = ?", [table_name])
+            conn.execute("COMMIT")
+            cls._version += 1
+
+    @classmethod
+    def tables(cls) -> list[dict]:
+        # Most recently updated first; tables whose Parquet copy was deleted with the cache are dropped
+        rows = cls._cursor().execute(
+            "SELECT name, dataset_key, filename, path, rows, columns, bytes, types, column_stats, updated_at "
+            "FROM meta.tables ORDER BY updated_at DESC"
+        ).fetchall()
+        tables = []
+        for name, dataset_key, filename, path, n_rows, n_columns, size, types, stats, updated_at in rows:
+            if not Path(path).exists():
+                cls.remove(name)
+                continue
+            tables.append({
+                "name": name, "dataset_key": dataset_key, "filename": filename, "path": path, "rows": n_rows,
+                "columns": n_columns, "bytes": size, "types": json.loads(types),
+                "column_stats": json.loads(stats), "updated_at": updated_at,
+            })
+        return tables
+
+    @classmethod
+    def version(cls) -> int:
+        return cls._version
+
+    @classmethod
+    def stats(cls) -> dict:
+        tables = cls.tables()
+        return {
+            "tables": len(tables),
+            "rows": sum(t["rows"] for t in tables),
+            "bytes": sum(t["bytes"] for t in tables),
+            "persistent": cls.persistent,
+        }
+
+    # --- session connections ---
+    @classmethod
+    def sync(cls, conn, own_tables: set, synced: dict) -> dict:
+        # Creates views on `conn` for catalog tables it doesn't register itself and drops views of
+        # removed ones. synced: table name -> dataset key from the previous call; returns the new one.
+        current = {t["name"]: t for t in cls.tables() if t["name"] not in own_tables}
+        for name in set(synced) - set(current):
+            conn.execute(f"DROP VIEW IF EXISTS {quote_sql_identifier(name)}")
+        for name, table in current.items():
+            if synced.get(name) != table["dataset_key"]:
+                conn.execute(f"CREATE OR REPLACE VIEW {quote_sql_identifier(name)} AS "
+                             f"SELECT * FROM {parquet_source(table['path'])}")
+        return {name: table["dataset_key"] for name, table in current.items()}
+
+    @classmethod
+    def dependencies(cls, query: str, exclude: str) -> tuple:
+        # (name, dataset key) of the other catalog tables a query reads, for result cache keys
+        tables = {t["name"]: t["dataset_key"] for t in cls.tables() if t["name"] != exclude}
+        if not tables:
+            return ()
+        referenced = cls._referenced(query)
+        if referenced is None:
+            referenced = {name for name in tables if re.search(rf"(?<![\w.]){re.escape(name)}(?!\w)", query)}
+        return tuple(sorted((name, tables[name]) for name in referenced if name in tables))
+
+    @classmethod
+    def prompt_tables(cls, question: str, names, columns: list[str]) -> str:
+        # Lines describing the other tables for the SQL prompt, out of `names` (the session's own
+        # uploads and the tables it added): those named in the question first, then those sharing
+        # a column (a likely join key) with the current dataset, then the newest
+        from .schema import ColumnIndex
+
+        lowered = question.lower()
+        shared = set(map(str, columns))
+        names = set(names)
+        if not names:
+            return ""
+        try:
+            candidates = [t for t in cls.tables() if t["name"] in names]
+        except duckdb.Error:
+            return ""  # a broken catalog must never block generation
+        ranked = sorted(
+            candidates,
+            key=lambda t: (t["name"].lower() not in lowered, not shared.intersection(t["types"]), -t["updated_at"]),
+        )[:PROMPT_TABLES]
+        lines = []
+        for table in ranked:
+            cols, _ = ColumnIndex.prompt_columns(question, list(table["types"]), table["types"])
+            lines.append(f"          - {table['name']} ({table['rows']:,} rows) with columns [{cols}]")
+        return "\n".join(lines)
+
+    @classmethod
+    def _referenced(cls, query: str):
+        # Table names in the parsed query (parser only: binding would expand the views), or None
+        # for statements json_serialize_sql can't represent
+        try:
+            tree = json.loads(cls._cursor().execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0])
+        except duckdb.Error:
+            return None
+        if tree.get("error"):
+            return None
+        names, stack = set(), [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                if node.get("type") == "BASE_TABLE" and node.get("table_name"):
+                    names.add(node["table_name"])
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        return names
+
+    @classmethod
+    def joined_columns(cls, query: str, exclude: str) -> list[str]:
+        # "table.column" for the other catalog tables a query reads, for the review prompt's column list
+        joined = dict(cls.dependencies(query, exclude))
+        return [f"{t['name']}.{c}" for t in cls.tables() if t["name"] in joined for c in t["types"]]
+
+    # --- storage ---
+    @classmethod
+    def _cursor(cls):
+        # One connection to the catalog file per process; each call gets its own cursor (thread-safe)
+        if cls._conn is None:
+            with cls._lock:
+                if cls._conn is None:
+                    CATALOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    try:
+                        conn = duckdb.connect(str(CATALOG_PATH))
+                    except duckdb.IOException:
+                        # Locked by another process (the app, or a batch run): work from memory
+                        conn = duckdb.connect()
+                        cls.persistent = False
+                    conn.execute("CREATE SCHEMA IF NOT EXISTS meta")
+                    conn.execute(
+                        """CREATE TABLE IF NOT EXISTS meta.tables (
+                            name VARCHAR PRIMARY KEY,
+                            dataset_key VARCHAR NOT NULL,
+                            filename VARCHAR NOT NULL,
+                            path VARCHAR NOT NULL,
+                            rows BIGINT NOT NULL,
+                            columns INTEGER NOT NULL,
+                            bytes BIGINT NOT NULL,
+                            types VARCHAR NOT NULL,
+                            column_stats VARCHAR NOT NULL,
+                            updated_at DOUBLE NOT NULL
+                        )"""
+                    )
+                    cls._conn = conn
+        return cls._conn.cursor()
+
+
+def parquet_source(path) -> str:
+    # Appended uploads are a directory of segments, read in order. Columns stored narrow
+    # (see utils/dtypes.py) are cast back to BIGINT / DOUBLE / VARCHAR for queries.
+    schema = IngestCache.schema(path)
+    if Path(path).is_dir():
+        path = Path(path) / "part-*.parquet"
+    scan = f"read_parquet({quote_sql_literal(path)})"
+    widened = {field.name: DtypeOptimizer.computation_type(field.type) for field in schema}
+    if all(widened[field.name] == field.type for field in schema):
+        return scan
+    columns = ", ".join(
+        f"CAST({quote_sql_identifier(field.name)} AS {SQL_TYPES[widened[field.name]]}) "
+        f"AS {quote_sql_identifier(field.name)}"
+        if widened[field.name] != field.type else quote_sql_identifier(field.name)
+        for field in schema
+    )
+    return f"(SELECT {columns} FROM {scan})"
+
+
+def _column_stats(path) -> dict:
+    # Null counts and value ranges per column from the Parquet footers; no data is read
+    stats = {}
+    for segment in IngestCache.segments(path):
+        metadata = pq.ParquetFile(segment).metadata
+        for group_index in range(metadata.num_row_groups):
+            group = metadata.row_group(group_index)
+            for column_index in range(group.num_columns):
+                column = group.column(column_index)
+                entry = stats.setdefault(column.path_in_schema, {"nulls": 0, "min": None, "max": None})
+                footer = column.statistics
+                if footer is None or not footer.has_null_count:
+                    entry["nulls"] = None
+                elif entry["nulls"] is not None:
+                    entry["nulls"] += footer.null_count
+                if footer is not None and footer.has_min_max:
+                    try:
+                        entry["min"] = footer.min if entry["min"] is None else min(entry["min"], footer.min)
+                        entry["max"] = footer.max if entry["max"] is None else max(entry["max"], footer.max)
+                    except TypeError:
+                        pass
+    return {name: {"nulls": s["nulls"], "min": _text(s["min"]), "max": _text(s["max"])} for name, s in stats.items()}
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return None if value is None else str(value)[:64]
@@ -0,0 +1,163 @@
+import threading
+from os import PathLike
+import weakref
+import duckdb
+import pyarrow as pa
+import streamlit as st
+from .sessions import SessionState
+from .formats import quote_sql_identifier
+from .catalog import DatasetCatalog, parquet_source
+from .dtypes import DtypeOptimizer
+
+state = SessionState()
+
+
+class DuckDBConnectionManager:
+    # --- one warm connection per dataset, shared by every session that has it loaded ---
+    # Besides its own table, each connection has a view of every other table in the DatasetCatalog,
+    # re-synced before a query whenever the catalog changed, so generated SQL can join them.
+    _lock = threading.Lock()
+    _entries = {}
+
+    @classmethod
+    def acquire(cls, dataset_key: str, table_name: str, source) -> "DuckDBHandle":
+        # source is either an in-memory DataFrame or the path of an on-disk Parquet copy
+        with cls._lock:
+            entry = cls._entries.get(dataset_key)
+            if entry is None:
+                entry = {
+                    "conn": duckdb.connect(),
+                    "lock": threading.Lock(),
+                    "tables": set(),
+                    "refs": 0,
+                    "running": None,    # cancel token of the query being executed, see interrupt()
+                    "catalog": {},      # catalog views on this connection: table name -> dataset key
+                    "catalog_version": None,
+                }
+                cls._entries[dataset_key] = entry
+            entry["refs"] += 1
+
+        # Register once per table name; later runs reuse the catalog entry
+        with entry["lock"]:
+            if table_name not in entry["tables"]:
+                if isinstance(source, (str, PathLike)):
+                    # Lazy view: DuckDB scans the file per query and pushes filters/projections down
+                    entry["conn"].execute(
+                        f"CREATE OR REPLACE VIEW {quote_sql_identifier(table_name)} AS "
+                        f"SELECT * FROM {parquet_source(source)}"
+                    )
+                else:
+                    if table_name in entry["catalog"]:
+                        entry["conn"].execute(f"DROP VIEW IF EXISTS {quote_sql_identifier(table_name)}")
+                    if isinstance(source, pa.Table):
+                        source = DtypeOptimizer.widen(source)  # SQL computes on int64 / float64 / VARCHAR
+                    entry["conn"].register(table_name, source)
+                entry["tables"].add(table_name)
+                entry["catalog"].pop(table_name, None)
+            cls._sync_catalog(entry)
+
+        return DuckDBHandle(dataset_key, table_name)
+
+    @classmethod
+    def release(cls, dataset_key: str):
+        with cls._lock:
+            entry = cls._entries.get(dataset_key)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            cls._entries.pop(dataset_key)
+
+        with entry["lock"]:
+            entry["conn"].close()
+
+    @classmethod
+    def execute(cls, dataset_key: str, query: str, arrow: bool = False, cancel=None):
+        entry = cls._entries[dataset_key]
+        # A DuckDB connection is not safe to share between threads without serializing
+        with entry["lock"]:
+            if cancel is not None and cancel.is_set():
+                raise duckdb.InterruptException("query cancelled before it started")
+            cls._sync_catalog(entry)
+            entry["running"] = cancel
+            try:
+                result = entry["conn"].execute(query)
+                return result.arrow() if arrow else result.fetchdf()
+            finally:
+                entry["running"] = None
+
+    @classmethod
+    def interrupt(cls, dataset_key: str, cancel):
+        # Stops the query started with this cancel token, and only that one: the connection is
+        # shared, so a query from another session must not be interrupted by mistake
+        cancel.set()
+        entry = cls._entries.get(dataset_key)
+        if entry is not None and entry["running"] is cancel:
+            entry["conn"].interrupt()
+
+    @staticmethod
+    def _sync_catalog(entry):
+        # Called with the entry's lock held
+        version = DatasetCatalog.version()
+        if entry["catalog_version"] == version:
+            return
+        try:
+            entry["catalog"] = DatasetCatalog.sync(entry["conn"], entry["tables"], entry["catalog"])
+            entry["catalog_version"] = version
+        except duckdb.Error:
+            pass  # the connection's own table still works; other tables are retried on the next query
+
+    @classmethod
+    def open_datasets(cls) -> list[str]:
+        with cls._lock:
+            return list(cls._entries)
+
+
+class DuckDBHandle:
+    # --- lightweight per-session reference; releasing it (or GC at session end) drops the ref ---
+    def __init__(self, dataset_key: str, table_name: str):
+        self.dataset_key = dataset_key
+        self.table_name = table_name
+        self._finalizer = weakref.finalize(self, DuckDBConnectionManager.release, dataset_key)
+
+    def execute(self, query: str, arrow: bool = False, cancel=None):
+        return DuckDBConnectionManager.execute(self.dataset_key, query, arrow, cancel)
+
+    def interrupt(self, cancel):
+        DuckDBConnectionManager.interrupt(self.dataset_key, cancel)
+
+    def select(self, clause: str = "", arrow: bool = False):
+        return self.execute(f"SELECT * FROM {quote_sql_identifier(self.table_name)} {clause}", arrow)
+
+    def close(self):
+        self._finalizer()
+
+
+def table_name_for(filename: str) -> str:
+    return filename.replace(".csv", "").replace(" ", "_")  # sanitize table name
+
+
+def get_session_connection() -> DuckDBHandle:
+    handle = st.session_state.get("duckdb_handle")
+    dataset_key = state.get_dataset_key()
+    table_name = table_name_for(state.get_filename())
+
+    if handle is not None and handle.dataset_key == dataset_key and handle.table_name == table_name:
+        return handle
+
+    # Dataset changed (or first run) - drop the old reference before taking a new one
+    if handle is not None:
+        handle.close()
+
+    # In-memory datasets register the mapped Arrow table the session frame was built from
+    source = state.get_dataset_path() if state.is_out_of_core() else state.get_dataset_handle().table
+    handle = DuckDBConnectionManager.acquire(dataset_key, table_name, source)
+    st.session_state["duckdb_handle"] = handle
+    return handle
+
+
+def release_session_connection():
+    handle = st.session_state.pop("duckdb_handle", None)
+    if handle is not None:
+        handle.close()
@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+# --- settings: MYQUERY_* environment variables read once at import ---
+def env_flag(name: str, default: bool = True) -> bool:
+    # Any value but "0" turns a flag on
+    value = os.getenv(name)
+    return default if value is None else value != "0"
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+# --- local persistence: the bundled SQLite file and the on-disk cache folder ---
+DATABASE_PATH = Path(os.getenv("MYQUERY_DB_PATH", Path(__file__).resolve().parent.parent / "database.db"))
+CACHE_DIR = Path(os.getenv("MYQUERY_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+
+_schemas_ready = set()
+_schema_lock = threading.Lock()
+
+
+def connect() -> sqlite3.Connection:
+    # One short-lived connection per call keeps this safe across Streamlit's script threads
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def ensure_schema(ddl: str) -> sqlite3.Connection:
+    # connect(), after running the CREATE ... IF NOT EXISTS script once per process
+    conn = connect()
+    if ddl not in _schemas_ready:
+        with _schema_lock:
+            if ddl not in _schemas_ready:
+                conn.executescript(ddl)
+                _schemas_ready.add(ddl)
+    return conn
@@ -0,0 +1,166 @@
+import json
+import pyarrow as pa
+import pyarrow.compute as pc
+from .database import env_flag, env_float
+
+# --- settings ---
+TYPE_OPTIMIZATION = env_flag("MYQUERY_OPTIMIZE_DTYPES")
+# Text columns with at most this share of distinct values are stored dictionary-encoded
+CATEGORY_MAX_RATIO = env_float("MYQUERY_CATEGORY_MAX_RATIO", 0.5)
+DATE_FORMATS = (
+    "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d", "%d.%m.%Y", "%d-%m-%Y", "%m-%d-%Y",
+    "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S", "%d %b %Y", "%b %d %Y", "%b %d, %Y", "%d %B %Y", "%B %d, %Y",
+)
+DATE_SAMPLE_ROWS = 1000
+METADATA_KEY = b"myquery.dtypes"
+
+
+class DtypeOptimizer:
+    # --- ingest-time typing: smallest integer types, dictionary-encoded text, dates parsed once ---
+    # Runs on the Arrow table before it is stored, so the chosen schema lives in the Parquet footer
+    # (with the before/after storage size in its metadata) and every later load reuses it.
+    # Narrow types are a storage format only: widen() turns them back into int64 / float64 / plain
+    # strings before pandas or DuckDB compute on them, so sums can't overflow and nothing is categorical.
+
+    @classmethod
+    def optimize(cls, table: pa.Table) -> pa.Table:
+        if not TYPE_OPTIMIZATION or table.num_rows == 0:
+            return table
+
+        columns, fields, changes = [], [], {}
+        for field, column in zip(table.schema, table.columns):
+            new_field, new_column = cls._optimize_column(field, column)
+            if new_field.type != field.type:
+                changes[field.name] = f"{field.type} -> {_describe(new_field)}"
+            fields.append(new_field)
+            columns.append(new_column)
+
+        # Sizes of the Arrow data as parsed and as stored (the uncompressed IPC copy holds the latter)
+        optimized = pa.Table.from_arrays(columns, schema=pa.schema(fields))
+        report = {"rows": table.num_rows, "bytes_before": table.nbytes, "bytes_after": optimized.nbytes,
+                  "changes": changes}
+        metadata = {**(table.schema.metadata or {}), METADATA_KEY: json.dumps(report).encode("utf-8")}
+        return optimized.replace_schema_metadata(metadata)
+
+    @classmethod
+    def widen(cls, table: pa.Table) -> pa.Table:
+        # The stored table with computation types; unchanged columns keep their (mapped) buffers
+        fields, columns, changed = [], [], False
+        for field, column in zip(table.schema, table.columns):
+            kind = cls.computation_type(field.type)
+            if kind != field.type:
+                field, column, changed = field.with_type(kind), column.cast(kind), True
+            fields.append(field)
+            columns.append(column)
+        if not changed:
+            return table
+        return pa.Table.from_arrays(columns, schema=pa.schema(fields, metadata=table.schema.metadata))
+
+    @staticmethod
+    def computation_type(kind: pa.DataType) -> pa.DataType:
+        if pa.types.is_signed_integer(kind) and kind.bit_width < 64:
+            return pa.int64()
+        if pa.types.is_float16(kind) or pa.types.is_float32(kind):
+            return pa.float64()
+        if pa.types.is_dictionary(kind) and pa.types.is_string(kind.value_type):
+            return pa.string()
+        return kind
+
+    @classmethod
+    def conform(cls, table: pa.Table, schema: pa.Schema) -> pa.Table:
+        # Bring freshly parsed rows (e.g. an appended CSV tail) to a stored schema; raises
+        # pa.ArrowInvalid when a value doesn't fit, e.g. a new row overflows an int8 column
+        columns = []
+        for field in schema:
+            column = table.column(field.name)
+            date_format = (field.metadata or {}).get(b"format")
+            if date_format is not None and pa.types.is_string(column.type):
+                parsed = pc.strptime(column, format=date_format.decode(), unit=field.type.unit, error_is_null=True)
+                if parsed.null_count != column.null_count:
+                    raise pa.ArrowInvalid(f"column {field.name!r}: value not in {date_format.decode()} format")
+                column = parsed
+            elif pa.types.is_float32(field.type):
+                narrowed = column.cast(pa.float64()).cast(pa.float32())
+                if not pc.all(pc.equal(narrowed.cast(pa.float64()), column.cast(pa.float64())), skip_nulls=True).as_py():
+                    raise pa.ArrowInvalid(f"column {field.name!r}: value needs float64")
+                column = narrowed
+            columns.append(column.cast(field.type))
+        return pa.Table.from_arrays(columns, schema=schema)
+
+    @staticmethod
+    def report(schema: pa.Schema) -> dict:
+        # The before/after storage size recorded at ingest; empty for untyped datasets
+        raw = (schema.metadata or {}).get(METADATA_KEY)
+        return json.loads(raw) if raw else {}
+
+    # --- per column ---
+    @classmethod
+    def _optimize_column(cls, field: pa.Field, column: pa.ChunkedArray):
+        kind = field.type
+        if pa.types.is_integer(kind) and kind.bit_width > 8:
+            return cls._narrow_integer(field, column)
+        if pa.types.is_float64(kind):
+            return cls._narrow_float(field, column)
+        if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+            parsed = cls._parse_dates(field, column)
+            if parsed is not None:
+                return parsed
+            return cls._encode_dictionary(field, column)
+        return field, column
+
+    @staticmethod
+    def _narrow_integer(field, column):
+        if column.null_count == len(column):
+            return field, column
+        bounds = pc.min_max(column)
+        low, high = bounds["min"].as_py(), bounds["max"].as_py()
+        for candidate in (pa.int8(), pa.int16(), pa.int32()):
+            if candidate.bit_width >= field.type.bit_width:
+                break
+            limit = 2 ** (candidate.bit_width - 1)
+            if -limit <= low and high < limit:
+                return field.with_type(candidate), column.cast(candidate)
+        return field, column
+
+    @staticmethod
+    def _narrow_float(field, column):
+        # Only when no value changes: decimal fractions like 12.63 are not exact in float32
+        narrowed = column.cast(pa.float32())
+        same = pc.equal(narrowed.cast(pa.float64()), column)
+        if pc.all(same, skip_nulls=True).as_py() in (True, None) and pc.sum(pc.is_nan(column)).as_py() in (0, None):
+            return field.with_type(pa.float32()), narrowed
+        return field, column
+
+    @staticmethod
+    def _parse_dates(field, column):
+        values = column.drop_null()
+        if len(values) == 0:
+            return None
+        sample = values.slice(0, DATE_SAMPLE_ROWS)
+        for date_format in DATE_FORMATS:
+            if pc.strptime(sample, format=date_format, unit="s", error_is_null=True).null_count:
+                continue
+            parsed = pc.strptime(column, format=date_format, unit="s", error_is_null=True)
+            if parsed.null_count == column.null_count:
+                # The format is kept so appended rows are parsed the same way
+                return field.with_type(parsed.type).with_metadata({b"format": date_format.encode()}), parsed
+        return None
+
+    @staticmethod
+    def _encode_dictionary(field, column):
+        present = len(column) - column.null_count
+        if present == 0:
+            return field, column
+        distinct = pc.count_distinct(column).as_py()
+        if distinct > CATEGORY_MAX_RATIO * present:
+            return field, column  # mostly unique text gains nothing from a dictionary
+        dictionary_type = pa.dictionary(pa.int32(), pa.string())
+        return field.with_type(dictionary_type), column.cast(pa.string()).dictionary_encode()
+
+
+def _describe(field: pa.Field) -> str:
+    if pa.types.is_dictionary(field.type):
+        return "dictionary-encoded string"
+    date_format = (field.metadata or {}).get(b"format")
+    return f"{field.type} (parsed from {date_format.decode()})" if date_format else str(field.type)
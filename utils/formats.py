@@ -1,4 +1,5 @@
 import re
+import ast
 
 def patch_missing_imports(code):
     patched = code
@@ -13,6 +14,68 @@ def patch_missing_imports(code):
     
     return patched
 
+def rewrite_in_app_code(in_app):
+    # Point generated code at the session DataFrame instead of re-reading the CSV
+    in_app = re.sub(r'pd\.read_csv\s*\((?:[^)(]+|\([^)]*\))*\)', "df.copy()", in_app)
+    in_app = re.sub(r'df\s*=\s*pd\.DataFrame\s*\(\s*\)', "df = df.copy()", in_app)
+    in_app = re.sub(r'set\s*\(\s*stopwords_words\s*\)', "stopwords_words", in_app)
+    return in_app
+
+def rewrite_visualization_code(vis_code):
+    if isinstance(vis_code, list):
+        vis_code = "\n".join(vis_code)
+
+    vis_code = re.sub(r"```(?:python)?", "", vis_code).strip("`")
+    vis_code = re.sub(r"\bst\.pyplot\s*\(\s*\)", "st.pyplot(fig)", vis_code)
+    if "fig, ax = plt.subplots()" not in vis_code:
+        vis_code = "fig, ax = plt.subplots()\n" + vis_code
+    return vis_code
+
+def quote_sql_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def quote_sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def normalize_sql(query):
+    # Drop comments and collapse whitespace, leaving quoted strings/identifiers untouched
+    out = []
+    i, n = 0, len(query)
+    while i < n:
+        ch = query[i]
+        if ch in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if query[end] == ch:
+                    if end + 1 < n and query[end + 1] == ch:  # escaped quote
+                        end += 2
+                        continue
+                    break
+                end += 1
+            out.append(query[i:end + 1])
+            i = end + 1
+        elif query.startswith("--", i):
+            end = query.find("\n", i)
+            i = n if end == -1 else end
+        elif query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        elif ch.isspace():
+            if out and out[-1] != " ":
+                out.append(" ")
+            i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out).strip().rstrip(";").strip()
+
+def normalize_python(code):
+    # The AST ignores comments, blank lines and formatting but keeps everything that runs
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return "\n".join(line.rstrip() for line in code.strip().splitlines())
+
 def strip_lines(text):
     lines = text.splitlines()
     cleaned = []
@@ -0,0 +1,33 @@
+import re
+import pandas as pd
+
+# --- copy-on-write: a shallow copy is isolated from the original, and only the
+# columns that code actually modifies get copied (pandas >= 2.0) ---
+pd.set_option("mode.copy_on_write", True)
+
+
+def isolated_view(df: pd.DataFrame) -> pd.DataFrame:
+    # O(1) handle for generated code; writes land in private copies, never in the session frame
+    return df.copy(deep=False)
+
+
+def cheap_copies(code: str) -> str:
+    # Generated code always starts with `df = df.copy()`. Under copy-on-write a shallow copy
+    # gives the same isolation without duplicating every column up front.
+    return re.sub(r"\bdf\.copy\(\s*\)", "df.copy(deep=False)", code)
+
+
+def arrow_to_pandas(table) -> pd.DataFrame:
+    # Stored (narrow) types are widened first: code sees int64 / float64, never categoricals.
+    # split_blocks keeps null-free numeric columns as zero-copy views of the Arrow buffers.
+    # Text stays in Arrow memory (string[pyarrow]) instead of one Python object per cell,
+    # and dates become datetime64.
+    import pyarrow as pa
+    from .dtypes import DtypeOptimizer
+
+    strings = pd.StringDtype("pyarrow")
+    return DtypeOptimizer.widen(table).to_pandas(
+        date_as_object=False,
+        split_blocks=True,
+        types_mapper={pa.string(): strings, pa.large_string(): strings}.get,
+    )
@@ -1,55 +1,271 @@
-from matplotlib import pyplot as plt
-import nltk
+import json
 import warnings
+from pathlib import Path
 import numpy as np
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-from nltk.corpus import stopwords
+import pyarrow as pa
 from .sessions import SessionState
-import duckdb
+from .connections import DuckDBConnectionManager, get_session_connection, release_session_connection, table_name_for
+from .catalog import DatasetCatalog
+from .ingest import IngestCache
+from .lazy import plt, sns, nltk, ensure_nltk_data, english_stopwords
+from .frames import isolated_view, cheap_copies, arrow_to_pandas
+from .sandbox import SANDBOX_ENABLED, SandboxExecutor, SandboxError, run_recorded
+from .progressive import ProgressiveRun, PROGRESSIVE_ENABLED, PROGRESSIVE_MIN_ROWS, PREVIEW_ROWS
+from .cache import ResultCache
+from .results import ResultSet, PAGE_ROWS
+from .formats import normalize_sql, normalize_python
+from .tracing import Tracer
+from .database import env_int
+from .schema import ColumnIndex
+from .store import DatasetStore
+from .prefetch import Prefetcher
+from .invokers import AIActionInvoker
+from .library import QueryLibrary
+from .scheduler import LLMScheduler
+from llm_config import GROQ_API_KEY, router_stats
 
 state = SessionState()
 
-# --- nltk setup, ensure that its downloaded when needed, need to debug later ---
-nltk.download('punkt')
-nltk.download('stopwords')
-
 class FileHandler:
     def upload_files():
         with st.sidebar:
             st.title("📊 Data Assistant")
-            uploaded_file = st.file_uploader("Upload your CSV file here", type="csv")
-            if uploaded_file:
+            uploaded_files = st.file_uploader("Upload your CSV files here", type="csv", accept_multiple_files=True)
+            if uploaded_files:
+                # Every file becomes a catalog table SQL can join; one of them is the active dataset
+                FileHandler.catalog_uploads(uploaded_files)
+                uploaded_file = uploaded_files[-1]
+                if len(uploaded_files) > 1:
+                    picked = st.selectbox("Active table", range(len(uploaded_files)), index=len(uploaded_files) - 1,
+                                          format_func=lambda i: uploaded_files[i].name, key="active_upload")
+                    uploaded_file = uploaded_files[picked]
+
+                # Reruns with the same files attached skip hashing and parsing entirely
                 state.set_filename(uploaded_file.name)
-                state.set_df(pd.read_csv(uploaded_file))
+                dataset_key = state.get_uploads()[uploaded_file.file_id]
+                if dataset_key != state.get_dataset_key() or not state.has_data():
+                    release_session_connection()  # new dataset, old DuckDB registration is stale
+                    FileHandler.load_dataset(uploaded_file.getvalue(), dataset_key)
+                    FileHandler.start_prefetch()
                 st.success(f"✅ {uploaded_file.name} uploaded!")
+                if state.is_out_of_core():
+                    st.caption("🗄️ Large file: kept on disk and queried through DuckDB.")
+                report = state.get_dtype_report()
+                if report.get("changes"):
+                    st.caption(f"🧮 Typed on load: ~{report['bytes_before'] / 2**20:,.1f} MB → "
+                               f"~{report['bytes_after'] / 2**20:,.1f} MB stored")
+                    with st.expander("Column types"):
+                        st.dataframe(pd.DataFrame(
+                            [{"column": name, "change": change} for name, change in report["changes"].items()]
+                        ).set_index("column"))
+
+    @staticmethod
+    def catalog_uploads(uploaded_files):
+        # Each file is hashed, stored as Parquet and added to the DatasetCatalog once per session
+        uploads = dict(state.get_uploads())
+        tables = dict(state.get_catalog_tables())
+        for uploaded_file in uploaded_files:
+            if uploaded_file.file_id in uploads:
+                continue
+            data = uploaded_file.getvalue()
+            dataset_key = IngestCache.content_hash(data)
+            path = IngestCache.ensure_parquet(data, dataset_key, streaming=IngestCache.should_stay_on_disk(data))
+            try:
+                entry = DatasetCatalog.add(table_name_for(uploaded_file.name), dataset_key, uploaded_file.name, path)
+                tables[entry["name"]] = True
+            except Exception as e:
+                st.warning(f"⚠️ {uploaded_file.name} is not available to joins: {e}")
+            uploads[uploaded_file.file_id] = dataset_key
+        state.set_uploads(uploads)
+        state.set_catalog_tables(tables)
+
+    @staticmethod
+    def show_catalog():
+        # The catalog tables this session sees: its own uploads and tables it added by name.
+        # Other sessions' tables are never listed, only reachable by typing their exact name.
+        visible = dict(state.get_catalog_tables())
+        tables = [t for t in DatasetCatalog.tables() if t["name"] in visible]
+        with st.sidebar.expander(f"🗂️ Tables ({len(tables)})"):
+            if tables:
+                st.dataframe(pd.DataFrame([
+                    {"table": t["name"], "rows": t["rows"], "columns": t["columns"], "MB": round(t["bytes"] / 2**20, 1)}
+                    for t in tables
+                ]).set_index("table"))
+                st.caption("SQL questions can join any of these tables.")
+            if not DatasetCatalog.persistent:
+                st.caption("The catalog file is in use by another process; tables added now last until restart.")
+            st.text_input("Add an earlier upload by table name", key="catalog_add",
+                          on_change=FileHandler.add_catalog_table)
+            if not tables:
+                return
+            name = st.selectbox("Table", [t["name"] for t in tables], key="catalog_table")
+            table = next(t for t in tables if t["name"] == name)
+            st.dataframe(pd.DataFrame([
+                {"column": column, "type": kind, **table["column_stats"].get(column, {})}
+                for column, kind in table["types"].items()
+            ]).set_index("column"))
+            # Only this session's own uploads can be dropped from the catalog; added ones are just hidden
+            if st.button("Remove from catalog" if visible[name] else "Hide", key="catalog_remove"):
+                if visible[name]:
+                    DatasetCatalog.remove(name)
+                del visible[name]
+                state.set_catalog_tables(visible)
+                st.rerun()
+
+    @staticmethod
+    def add_catalog_table():
+        # on_change of the "add by table name" input, which it clears again
+        wanted = st.session_state.get("catalog_add", "").strip()
+        st.session_state["catalog_add"] = ""
+        if not wanted:
+            return
+        if any(t["name"] == wanted for t in DatasetCatalog.tables()):
+            state.set_catalog_tables({**state.get_catalog_tables(), wanted: False})
+        else:
+            st.toast(f"No table named {wanted}")
+
+    @staticmethod
+    def load_dataset(data: bytes, dataset_key: str):
+        out_of_core = IngestCache.should_stay_on_disk(data)
+        path = IngestCache.ensure_parquet(data, dataset_key, streaming=out_of_core)
+
+        state.set_dataset_key(dataset_key)
+        state.set_dataset_path(str(path))
+        state.set_out_of_core(out_of_core)
+        if out_of_core:
+            state.set_dataset_handle(None)
+            state.set_columns(IngestCache.columns(path))
+        else:
+            # Sessions with the same file share one memory-mapped frame instead of each parsing a copy
+            handle = DatasetStore.acquire(dataset_key, path)
+            state.set_dataset_handle(handle)
+            state.set_columns(handle.frame.columns.tolist())
+        state.set_column_types(IngestCache.column_types(path))
+        state.set_dtype_report(IngestCache.dtype_report(path))
+        state.set_row_count(IngestCache.row_count(path))
+        state.set_progressive_run(None)  # a full run on the previous dataset is no longer wanted
+
+        # Wide datasets get their column-retrieval index now, not on the first question
+        ColumnIndex.warm(state.get_columns_as_list(), state.get_column_types())
+
+    @staticmethod
+    def start_prefetch():
+        # Suggestions and their answers are prepared in the background while the user looks at the data;
+        # starting a new job cancels the previous upload's
+        if not GROQ_API_KEY:
+            return
+        state.set_prefetch_job(Prefetcher.start({
+            "filename": state.get_filename(),
+            "dataset_key": state.get_dataset_key(),
+            "parquet_path": state.get_dataset_path(),
+            "columns": state.get_columns_as_list(),
+            "types": state.get_column_types(),
+            "source": state.get_dataset_path() if state.is_out_of_core() else state.get_dataset_handle().table,
+            "out_of_core": state.is_out_of_core(),
+            "tables": AIActionInvoker.joinable_tables(),
+        }))
+
+
+class DataHandler:
+    # --- dataset access that works for both in-memory and out-of-core sessions ---
+    CHART_SAMPLE_ROWS = env_int("MYQUERY_CHART_SAMPLE_ROWS", 200_000)
+
+    @staticmethod
+    def preview(rows: int = 10):
+        if state.is_out_of_core():
+            return get_session_connection().select(f"LIMIT {int(rows)}")
+        return state.get_df().head(rows)
+
+    @staticmethod
+    def full_frame():
+        if state.is_out_of_core():
+            st.warning("⚠️ Python runs on a large dataset load it fully into memory; SQL stays on disk.")
+            return get_session_connection().select()
+        return isolated_view(state.get_df())
+
+    @staticmethod
+    def chart_sampled() -> bool:
+        return state.get_row_count() > DataHandler.CHART_SAMPLE_ROWS
+
+    @staticmethod
+    def chart_frame():
+        # Charts don't need every row: large datasets are drawn from a fixed uniform sample (see sample_table)
+        if state.is_out_of_core():
+            return get_session_connection().select(
+                f"USING SAMPLE reservoir({DataHandler.CHART_SAMPLE_ROWS} ROWS) REPEATABLE (42)"
+            )
+        if DataHandler.chart_sampled():
+            return arrow_to_pandas(DataHandler.sample_table(DataHandler.CHART_SAMPLE_ROWS))
+        return isolated_view(state.get_df())
+
+    @staticmethod
+    def sample_table(rows: int) -> pa.Table:
+        # Uniform random rows, the same ones every time: reservoir-sampled inside DuckDB for on-disk data
+        if state.is_out_of_core():
+            return get_session_connection().select(f"USING SAMPLE reservoir({int(rows)} ROWS) REPEATABLE (42)", arrow=True)
+        table = state.get_dataset_handle().table
+        picks = np.random.default_rng(42).choice(table.num_rows, size=min(rows, table.num_rows), replace=False)
+        return table.take(np.sort(picks))
+
+    @staticmethod
+    def sample_source(rows: int):
+        # (sample key, Arrow IPC path) for previews; the sample is drawn once per dataset and shared
+        name = f"{state.get_dataset_key()}-sample{rows}"
+        return name, IngestCache.ensure_ipc(name, make_table=lambda: DataHandler.sample_table(rows))
+
+    @staticmethod
+    def sandbox_source(chart: bool = False):
+        # (frame_key, Arrow IPC path) for sandbox workers; built once per dataset and shared
+        dataset_key = state.get_dataset_key()
+        if chart and (state.is_out_of_core() or DataHandler.chart_sampled()):
+            return DataHandler.sample_source(DataHandler.CHART_SAMPLE_ROWS)
+        return dataset_key, IngestCache.ensure_ipc(dataset_key, parquet_path=state.get_dataset_path())
+
 
 class ExecutionHandler: 
+    PROGRESS_POLL_SECONDS = 1.0
+
+    @Tracer.traced("execute")
     def execute_code(in_app,language):
+        Tracer.annotate(language=language, code_chars=len(in_app), sandboxed=language != "SQL" and SANDBOX_ENABLED)
+        state.set_progressive_run(None)
+        state.set_result_view(None, None)
+        if ExecutionHandler.wants_preview(language) and ExecutionHandler.start_progressive(in_app, language):
+            return  # shown by show_progressive_run
         if language == "SQL":
             try:
-                # Get the DataFrame and original filename
-                df = state.get_df()
-                filename = state.get_filename() 
-                table_name = filename.replace(".csv", "").replace(" ", "_")  # sanitize table name
+                # Reuse the warm connection for this dataset, table named after the file (no .csv)
+                conn = get_session_connection()
 
-                # Connect and register table with original file name (no .csv)
-                conn = duckdb.connect()
-                conn.register(table_name, df)
+                result, cached = ExecutionHandler.run_sql(conn, in_app)
+                if cached:
+                    st.caption("⚡ Cached result")
 
-                # Execute the query
-                query = in_app.strip()
-                result_df = conn.execute(query).fetchdf()
-
-                st.dataframe(result_df)
+                state.set_result_view(in_app, result)  # shown, and paged, by show_result_view
                 st.success("✅ SQL query ran successfully.")
-                conn.close()
+                ExecutionHandler.remember_verified(language)
             except Exception as e:
+                Tracer.fail(e)
                 st.error(f"SQL run error: {e}")
+        elif SANDBOX_ENABLED:
+            try:
+                outcome = ExecutionHandler.run_sandboxed(in_app)
+                outcome.replay(st)
+                if outcome.error:
+                    Tracer.fail(outcome.error)
+                    st.error(f"Run error: {outcome.error}")
+                else:
+                    ExecutionHandler.remember_verified(language)
+                    if outcome.has_result:
+                        st.success("✅ Code ran successfully.")
+            except SandboxError as e:
+                Tracer.fail(e)
+                st.error(f"Run error: {e}")
         else:
             local = {
-                "df": state.get_df().copy(),
+                "df": DataHandler.full_frame(),
                 "pd": pd,
                 "np": np,
                 "plt": plt,
@@ -57,15 +273,21 @@ class ExecutionHandler:
                 "nltk": nltk,
                 "st": st,
                 # "word_tokenize": word_tokenize,
-                "stopwords": stopwords,
-                "stopwords_words": list(stopwords.words("english")),
                 "__builtins__": __builtins__,
             }
 
+            # --- nltk corpora are only loaded when the generated code actually uses them ---
+            if "stopwords" in in_app:
+                ensure_nltk_data("stopwords")
+                local["stopwords"] = nltk.corpus.stopwords
+                local["stopwords_words"] = english_stopwords()
+            if "tokenize" in in_app:
+                ensure_nltk_data("punkt", "punkt_tab")
+
             try:
                 with warnings.catch_warnings():
                     warnings.simplefilter("ignore", category=DeprecationWarning)
-                    exec(in_app, local, local)
+                    exec(cheap_copies(in_app), local, local)
 
                 func_candidates = [v for v in local.values() if callable(v)]
                 if len(func_candidates) == 1:
@@ -73,9 +295,299 @@ class ExecutionHandler:
 
                 if "result" in local:
                     st.success("✅ Code ran successfully.")
+                ExecutionHandler.remember_verified(language)
+
+            except Exception as e:
+                Tracer.fail(e)
+                st.error(f"Run error: {e}")
+
+    # --- progressive runs: a sample result right away, the full one in the background ---
+    @staticmethod
+    def wants_preview(language: str) -> bool:
+        # In-process Python renders straight into the page, so it can't run in the background
+        return (PROGRESSIVE_ENABLED and state.get_row_count() > max(PROGRESSIVE_MIN_ROWS, PREVIEW_ROWS)
+                and (language == "SQL" or SANDBOX_ENABLED))
 
+    @staticmethod
+    def start_progressive(code: str, language: str) -> bool:
+        # False when the full result is already cached: then the normal path shows it at once
+        if language == "SQL":
+            conn = get_session_connection()
+            if ResultSet.cached(ExecutionHandler.sql_cache_key(conn, code)) is not None:
+                return False
+            sample_key, sample_ipc = DataHandler.sample_source(PREVIEW_ROWS)
+            try:
+                with st.spinner("⏳ Running on a sample..."):
+                    sample = DuckDBConnectionManager.acquire(sample_key, conn.table_name, IngestCache.read_ipc(sample_ipc))
+                    try:
+                        preview, _ = ExecutionHandler.run_sql(sample, code)
+                    finally:
+                        sample.close()
             except Exception as e:
+                Tracer.fail(e)
+                st.error(f"SQL run error: {e}")
+                return True  # the full run would fail the same way
+            run = lambda cancel: ExecutionHandler.run_sql(conn, code, cancel)[0]
+            interrupt = conn.interrupt
+        else:
+            frame_key, ipc_path = DataHandler.sandbox_source()
+            if ResultCache.get(ExecutionHandler.python_cache_key(frame_key, code)) is not None:
+                return False
+            sample_key, sample_ipc = DataHandler.sample_source(PREVIEW_ROWS)
+            try:
+                with st.spinner("⏳ Running on a sample..."):
+                    preview, _ = ExecutionHandler.run_python(code, sample_key, sample_ipc)
+            except SandboxError as e:
+                Tracer.fail(e)
                 st.error(f"Run error: {e}")
+                return True
+            if preview.error:
+                Tracer.fail(preview.error)
+                preview.replay(st)
+                st.error(f"Run error: {preview.error}")
+                return True
+            run = lambda cancel: ExecutionHandler.run_python(code, frame_key, ipc_path, cancel)[0]
+            interrupt = None
+
+        Tracer.annotate(progressive=True, sample_rows=PREVIEW_ROWS)
+        entry = ExecutionHandler.library_entry(language)
+        # A Python result can carry the code's own error instead of raising
+        on_done = ((lambda result: None if getattr(result, "error", None) else QueryLibrary.remember(**entry))
+                   if entry is not None else None)
+        state.set_progressive_run(
+            ProgressiveRun(code, language, preview, PREVIEW_ROWS, state.get_row_count(), run, interrupt, on_done)
+        )
+        return True
+
+    @staticmethod
+    def show_result_view(code: str):
+        view = state.get_result_view()
+        if view is not None and view["code"] == code:
+            ResultViewer.show(view["result"], "sql_result")
+
+    @staticmethod
+    def show_progressive_run(code: str):
+        run = state.get_progressive_run()
+        if run is None or run.code != code:
+            return
+        polling = run.running
+
+        # Polls while the full run is going; the panel swaps the preview for the full result
+        @st.fragment(run_every=ExecutionHandler.PROGRESS_POLL_SECONDS if polling else None)
+        def panel():
+            if run.running:
+                st.info(f"🔎 Preliminary: computed on a {run.sample_rows:,}-row sample of {run.total_rows:,} rows "
+                        f"(counts and sums are not scaled up). Full run in progress, {run.elapsed():.0f}s...")
+                if st.button("⏹️ Cancel full run", key="cancel_full_run"):
+                    run.cancel()
+                ExecutionHandler.show_result(run.language, run.preview)
+                return
+            if polling:
+                st.rerun()  # finished: redraw once more without polling
+
+            if run.status == "done":
+                st.caption(f"✅ Full result on all {run.total_rows:,} rows ({run.elapsed():.1f}s)")
+                ExecutionHandler.show_result(run.language, run.result)
+            elif run.status == "cancelled":
+                st.warning("Full run cancelled; showing the preliminary sample result.")
+                ExecutionHandler.show_result(run.language, run.preview)
+            else:
+                st.error(f"Full run error: {run.error}")
+                st.caption("Preliminary sample result:")
+                ExecutionHandler.show_result(run.language, run.preview)
+
+        panel()
+
+    # --- query library: generated code that ran cleanly is kept for the next file with this schema ---
+    @staticmethod
+    def library_entry(language: str):
+        # Only unedited generated code, run in the language it was generated for
+        origin = state.get_code_origin()
+        if origin is None or origin["language"] != language or origin["in_app"] != state.get_in_app_code():
+            return None
+        return {
+            "question": origin["question"], "mode": origin["mode"], "language": language,
+            "filename": state.get_filename(), "columns": state.get_columns_as_list(),
+            "types": state.get_column_types(), "full_code": state.get_full_code(), "in_app_code": origin["in_app"],
+        }
+
+    @staticmethod
+    def remember_verified(language: str):
+        entry = ExecutionHandler.library_entry(language)
+        if entry is not None:
+            QueryLibrary.remember(**entry)
+
+    @staticmethod
+    def show_result(language: str, value):
+        if language == "SQL":
+            ResultViewer.show(value, "progressive_result")
+            return
+        value.replay(st)
+        if value.error:
+            st.error(f"Run error: {value.error}")
+
+    @staticmethod
+    @Tracer.traced("chart")
+    def run_chart(code: str, chart_type: str):
+        # Rendered figures are cached per dataset, chart type and code. Chart code gets at most
+        # CHART_SAMPLE_ROWS rows, so drawing time doesn't grow with the row count.
+        if SANDBOX_ENABLED:
+            frame_key, ipc_path = DataHandler.sandbox_source(chart=True)
+        else:
+            frame_key = state.get_dataset_key()  # chart_frame's sample is repeatable
+        cache_key = ResultCache.make_key(frame_key, "Chart", normalize_python(code), chart_type)
+        outcome = ResultCache.get(cache_key)
+        Tracer.annotate(chart_type=chart_type, cache_hit=outcome is not None, sandboxed=SANDBOX_ENABLED)
+        if outcome is not None:
+            st.caption("⚡ Cached chart")
+            return outcome
+
+        with st.spinner("Generating chart..."):
+            if SANDBOX_ENABLED:
+                outcome = SandboxExecutor.run(code, frame_key, ipc_path)
+            else:
+                outcome = run_recorded(code, DataHandler.chart_frame())
+        if not outcome.error:
+            ResultCache.put(cache_key, outcome)
+        return outcome
+
+    @staticmethod
+    @Tracer.traced("sandbox")
+    def run_sandboxed(code: str):
+        # Generated code runs in a worker process: it can't block this server or outlive the timeout
+        frame_key, ipc_path = DataHandler.sandbox_source()
+        with st.spinner("⏳ Running code..."):
+            outcome, cached = ExecutionHandler.run_python(code, frame_key, ipc_path)
+        if cached:
+            st.caption("⚡ Cached result")
+        return outcome
+
+    # --- Streamlit-free cores, shared with the headless batch runner ---
+    @staticmethod
+    def sql_cache_key(conn, query: str) -> str:
+        # Joined catalog tables are part of the key: a new upload under their name is new data
+        return ResultCache.make_key(conn.dataset_key, "SQL", normalize_sql(query.strip()), conn.table_name,
+                                    *DatasetCatalog.dependencies(query, conn.table_name))
+
+    @staticmethod
+    def python_cache_key(frame_key: str, code: str) -> str:
+        return ResultCache.make_key(frame_key, "Python", normalize_python(code))
+
+    @staticmethod
+    def run_sql(conn, query: str, cancel=None):
+        # Execute the query into a ResultSet (spilled to Parquet as it runs, read back a page at
+        # a time), unless this dataset already answered the same query
+        query = query.strip()
+        cache_key = ExecutionHandler.sql_cache_key(conn, query)
+        result = ResultSet.cached(cache_key)
+        cached = result is not None
+        if not cached:
+            result = ResultSet.create(conn, query, cache_key, cancel)
+        Tracer.annotate(cache_hit=cached, rows=result.row_count)
+        return result, cached
+
+    @staticmethod
+    def run_python(code: str, frame_key: str, ipc_path, cancel=None):
+        cache_key = ExecutionHandler.python_cache_key(frame_key, code)
+        outcome = ResultCache.get(cache_key)
+        cached = outcome is not None
+        if not cached:
+            outcome = SandboxExecutor.run(code, frame_key, ipc_path, cancel=cancel)
+            if not outcome.error:
+                ResultCache.put(cache_key, outcome)
+        Tracer.annotate(cache_hit=cached)
+        return outcome, cached
+
+
+class ResultViewer:
+    # --- a ResultSet on screen: sorting, filtering and paging run in DuckDB, one page reaches the browser ---
+    @staticmethod
+    def show(result, key: str):
+        try:
+            if result.row_count <= PAGE_ROWS:
+                st.dataframe(result.page(0))  # all of it; the grid sorts small results itself
+                ResultViewer.show_tools(result, key, {})
+                return
+
+            cols = st.columns([3, 1, 3, 3])
+            sort = cols[0].selectbox("Sort by", [None] + result.columns, key=f"{key}_sort",
+                                     format_func=lambda c: "(query order)" if c is None else str(c))
+            descending = cols[1].checkbox("Desc", key=f"{key}_desc")
+            filter_column = cols[2].selectbox("Filter", [None] + result.columns, key=f"{key}_filter_column",
+                                              format_func=lambda c: "(any column)" if c is None else str(c))
+            filter_text = cols[3].text_input("Contains", key=f"{key}_filter")
+            view = {"sort": sort, "descending": descending, "filter_column": filter_column, "filter_text": filter_text}
+
+            matching = result.count(filter_column, filter_text)
+            pages = max(1, -(-matching // PAGE_ROWS))
+            if st.session_state.get(f"{key}_page", 1) > pages:  # e.g. a narrower filter
+                st.session_state[f"{key}_page"] = pages
+            page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+            st.dataframe(result.page(page - 1, **view))
+            first = (page - 1) * PAGE_ROWS
+            shown = f"rows {first + 1:,}–{min(first + PAGE_ROWS, matching):,}" if matching else "no rows"
+            total = f"{matching:,} of {result.row_count:,} matching" if filter_text else f"{result.row_count:,} rows"
+            st.caption(f"{total}, showing {shown}")
+            ResultViewer.show_tools(result, key, view)
+        except FileNotFoundError as e:
+            st.warning(str(e))
+
+    @staticmethod
+    def show_tools(result, key: str, view: dict):
+        if st.checkbox("📊 Summary statistics", key=f"{key}_summary"):
+            st.dataframe(result.summary())
+
+        # The CSV is written to disk by DuckDB first; the button then serves that file
+        export_key = f"{key}_export_path"
+        if st.button("📄 Prepare CSV export", key=f"{key}_export"):
+            with st.spinner("Writing CSV..."):
+                st.session_state[export_key] = str(result.export_csv(**view))
+        path = st.session_state.get(export_key)
+        if path and Path(path).exists() and Path(path).stem.startswith(result.path.stem):
+            with open(path, "rb") as f:
+                st.download_button("⬇️ Download CSV", f, file_name="result.csv", mime="text/csv", key=f"{key}_download")
+
+
+class MetricsHandler:
+    # --- sidebar panel with per-stage latency percentiles from the recorded spans ---
+    WINDOWS = {"Last hour": 3600, "Last 24 hours": 24 * 3600, "Last 7 days": 7 * 24 * 3600, "All": None}
 
+    @staticmethod
+    def show_panel():
+        if not Tracer.enabled:
+            return
+        with st.sidebar.expander("⏱️ Performance"):
+            window = st.selectbox("Window", list(MetricsHandler.WINDOWS), index=1, key="metrics_window")
+            routers = router_stats()
+            if routers:
+                st.dataframe(pd.DataFrame(routers).set_index("backend")[["role", "state", "error_rate"]])
+            limits = LLMScheduler.stats()
+            if limits:
+                # Shared rate limits: calls waiting now, and how long granted calls waited
+                st.dataframe(pd.DataFrame(limits).set_index("provider")[
+                    ["queued", "clients_waiting", "wait_p50_s", "wait_p95_s", "rate_limited"]
+                ])
+            shared = DatasetStore.stats()
+            if shared["datasets"]:
+                st.caption(f"{shared['datasets']} dataset(s) in memory ({shared['bytes'] / 2**20:,.0f} MB), "
+                           f"held by {shared['sessions']} session(s)")
 
+            spans = Tracer.export(MetricsHandler.WINDOWS[window])
+            if not spans:
+                st.caption("No timings recorded yet.")
+                return
 
+            summary = pd.DataFrame(Tracer.summary(spans=spans)).set_index("stage")
+            st.dataframe(summary[["count", "p50_ms", "p95_ms", "cache_hit_rate"]])
+            st.caption(f"{summary['prompt_tokens'].sum():,} prompt / "
+                       f"{summary['completion_tokens'].sum():,} completion tokens, "
+                       f"~{summary['tokens_saved'].sum():,} saved by column selection, "
+                       f"{summary['library_hits'].sum():,} answer(s) reused from the query library, "
+                       f"{summary['coalesced'].sum():,} LLM call(s) shared with an identical one in flight")
+            st.download_button(
+                "Export spans (JSONL)",
+                "\n".join(json.dumps(span) for span in spans),
+                file_name="myquery-spans.jsonl",
+                mime="application/json",
+            )
@@ -0,0 +1,306 @@
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from .formats import quote_sql_literal
+from .database import CACHE_DIR, ensure_schema, env_int
+from .dtypes import DtypeOptimizer
+from .frames import arrow_to_pandas
+
+# --- local, on-disk columnar copies of every upload, keyed by content hash ---
+DATASET_DIR = CACHE_DIR / "datasets"
+IPC_DIR = CACHE_DIR / "ipc"
+
+# Uploads at least this big are kept on disk and queried through DuckDB instead of pandas
+OUT_OF_CORE_BYTES = env_int("MYQUERY_OUT_OF_CORE_BYTES", 512 * 1024 * 1024)
+
+# An upload that extends an earlier one is stored as that upload's Parquet segments plus one
+# for the new rows; past this many segments they are compacted into one file
+MAX_SEGMENTS = env_int("MYQUERY_INGEST_MAX_SEGMENTS", 16)
+APPEND_CANDIDATES = 3
+
+
+class IngestCache:
+    _schema = """
+        CREATE TABLE IF NOT EXISTS ingest_files (
+            dataset_key TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            header_hash TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ingest_files_header ON ingest_files (header_hash, size);
+    """
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def parquet_path(dataset_key: str) -> Path:
+        # A directory of part-*.parquet segments for appended uploads, a single file otherwise
+        segmented = DATASET_DIR / dataset_key
+        return segmented if segmented.is_dir() else DATASET_DIR / f"{dataset_key}.parquet"
+
+    @staticmethod
+    def segments(path) -> list[Path]:
+        path = Path(path)
+        return sorted(path.glob("part-*.parquet")) if path.is_dir() else [path]
+
+    @classmethod
+    def is_cached(cls, dataset_key: str) -> bool:
+        return cls.parquet_path(dataset_key).exists()
+
+    @classmethod
+    def load(cls, data: bytes, dataset_key: str = None) -> pd.DataFrame:
+        return arrow_to_pandas(cls.load_table(data, dataset_key))
+
+    @classmethod
+    def load_table(cls, data: bytes, dataset_key: str = None) -> pa.Table:
+        if dataset_key is None:
+            dataset_key = cls.content_hash(data)
+
+        path = cls.parquet_path(dataset_key)
+        if path.exists():
+            try:
+                return pq.read_table(path)
+            except (OSError, pa.ArrowInvalid):
+                # Truncated/corrupt copy, parse again; a broken segmented copy is rewritten as one file
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+                path = cls.parquet_path(dataset_key)
+
+        table = DtypeOptimizer.optimize(cls.parse_csv(data))
+        cls._write(table, path)
+        cls._remember(data, dataset_key)
+        return table
+
+    @classmethod
+    def ensure_parquet(cls, data: bytes, dataset_key: str = None, streaming: bool = False) -> Path:
+        if dataset_key is None:
+            dataset_key = cls.content_hash(data)
+
+        path = cls.parquet_path(dataset_key)
+        if not path.exists():
+            # Re-uploads of a growing file only parse the rows added since last time
+            if cls._append(data, dataset_key, streaming):
+                path = cls.parquet_path(dataset_key)
+            elif streaming:
+                cls._convert_out_of_core(data, path)  # DuckDB's own type detection; nothing is held in pandas
+            else:
+                cls._write(DtypeOptimizer.optimize(cls.parse_csv(data)), path)
+            cls._remember(data, dataset_key)
+        return path
+
+    @classmethod
+    def ensure_ipc(cls, name: str, parquet_path=None, make_table=None) -> Path:
+        # Uncompressed Arrow IPC copy that sandbox workers memory-map instead of unpickling
+        path = IPC_DIR / f"{name}.arrow"
+        if path.exists():
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cls._tmp_path(path)
+        if make_table is not None:
+            table = make_table()
+            with ipc.new_file(tmp_path, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            # Stream batch by batch so large (out-of-core) datasets never sit in memory
+            with ipc.new_file(tmp_path, cls.schema(parquet_path)) as writer:
+                for segment in cls.segments(parquet_path):
+                    for batch in pq.ParquetFile(segment).iter_batches():
+                        writer.write_batch(batch)
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def read_ipc(path) -> pa.Table:
+        # Memory-mapped: the table's buffers are views of the file, shared through the page cache
+        return ipc.open_file(pa.memory_map(str(path))).read_all()
+
+    @classmethod
+    def schema(cls, path) -> pa.Schema:
+        # From the (first) Parquet footer; no data is read
+        return pq.read_schema(cls.segments(path)[0])
+
+    @classmethod
+    def columns(cls, path: Path) -> list[str]:
+        return cls.schema(path).names
+
+    @classmethod
+    def column_types(cls, path: Path) -> dict:
+        # Compact dtype per column
+        from .schema import short_type
+        return {field.name: short_type(field.type) for field in cls.schema(path)}
+
+    @classmethod
+    def row_count(cls, path: Path) -> int:
+        return sum(pq.ParquetFile(segment).metadata.num_rows for segment in cls.segments(path))
+
+    @classmethod
+    def dtype_report(cls, path: Path) -> dict:
+        # Memory before/after the ingest-time typing pass, as recorded in the stored schema
+        return DtypeOptimizer.report(cls.schema(path))
+
+    @staticmethod
+    def should_stay_on_disk(data: bytes) -> bool:
+        return len(data) >= OUT_OF_CORE_BYTES
+
+    @staticmethod
+    def parse_csv(data: bytes) -> pa.Table:
+        # pyarrow parses on all cores; keep pandas-like null handling for text columns
+        try:
+            return pacsv.read_csv(
+                pa.BufferReader(data),
+                convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+            )
+        except pa.ArrowInvalid:
+            # Ragged or oddly quoted files: fall back to the more forgiving pandas parser
+            df = pd.read_csv(io.BytesIO(data))
+            return pa.Table.from_pandas(df, preserve_index=False)
+
+    # --- incremental ingest ---
+    @classmethod
+    def _append(cls, data: bytes, dataset_key: str, streaming: bool) -> bool:
+        # If `data` is an earlier upload plus more rows (same bytes up to a row boundary), parse just
+        # the new rows against the earlier schema. Caches keyed by the old content hash stay valid
+        # for the old data; schema-only ones (column index, LLM prompts) carry over unchanged.
+        header_end = data.find(b"\n") + 1
+        if header_end <= 0:
+            return False
+
+        view = memoryview(data)
+        for base_key, size in cls._candidates(data[:header_end], len(data)):
+            at_boundary = data[size - 1:size] == b"\n" or data[size:size + 1] in (b"\n", b"\r")
+            if not at_boundary or hashlib.sha256(view[:size]).hexdigest() != base_key:
+                continue
+            base = cls.parquet_path(base_key)
+            if not base.exists() or (streaming and len(data) - size >= OUT_OF_CORE_BYTES):
+                return False
+            try:
+                schema = cls.schema(base)
+                tail = cls._parse_rows(data[:header_end] + data[size:], schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, OSError):
+                return False  # new rows don't fit the old column types: parse the whole file
+            cls._write_segments(dataset_key, cls.segments(base), tail)
+            return True
+        return False
+
+    @staticmethod
+    def _parse_rows(data: bytes, schema: pa.Schema) -> pa.Table:
+        # Read every column as text, then convert exactly as the stored schema says
+        # (including the date formats and dictionary encoding chosen at the first ingest)
+        table = pacsv.read_csv(
+            pa.BufferReader(data),
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in schema.names}, strings_can_be_null=True
+            ),
+        )
+        if table.column_names != schema.names:
+            raise pa.ArrowInvalid("header does not match the stored columns")
+        return DtypeOptimizer.conform(table, schema)
+
+    @classmethod
+    def _write_segments(cls, dataset_key: str, base_segments: list[Path], tail: pa.Table):
+        target = DATASET_DIR / dataset_key
+        tmp_dir = cls._tmp_path(target, ".dir")
+        tmp_dir.mkdir(parents=True)
+        try:
+            if len(base_segments) + 1 > MAX_SEGMENTS:
+                # Compact: stream the old segments and the new rows into one file (still no CSV parsing)
+                with pq.ParquetWriter(tmp_dir / "part-00000.parquet", tail.schema) as writer:
+                    for segment in base_segments:
+                        for batch in pq.ParquetFile(segment).iter_batches():
+                            writer.write_batch(batch)
+                    writer.write_table(tail)
+            else:
+                # Earlier segments are immutable, so they are hard-linked rather than copied
+                for index, segment in enumerate(base_segments):
+                    part = tmp_dir / f"part-{index:05d}.parquet"
+                    try:
+                        os.link(segment, part)
+                    except OSError:
+                        shutil.copyfile(segment, part)
+                pq.write_table(tail, tmp_dir / f"part-{len(base_segments):05d}.parquet")
+            try:
+                os.replace(tmp_dir, target)  # atomic; a concurrent session may have got there first
+            except OSError:
+                if not target.is_dir():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def _candidates(cls, header: bytes, size: int) -> list[tuple]:
+        # Earlier uploads with the same header that are shorter than this one, longest first
+        try:
+            with closing(cls._connect()) as conn:
+                return conn.execute(
+                    "SELECT dataset_key, size FROM ingest_files WHERE header_hash = ? AND size < ? "
+                    "ORDER BY size DESC LIMIT ?",
+                    (hashlib.sha256(header).hexdigest(), size, APPEND_CANDIDATES),
+                ).fetchall()
+        except sqlite3.Error:
+            return []
+
+    @classmethod
+    def _remember(cls, data: bytes, dataset_key: str):
+        header = data[:data.find(b"\n") + 1]
+        if not header:
+            return
+        try:
+            with closing(cls._connect()) as conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO ingest_files (dataset_key, size, header_hash, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (dataset_key, len(data), hashlib.sha256(header).hexdigest(), time.time()),
+                )
+        except sqlite3.Error:
+            pass  # only costs the next re-upload a full parse
+
+    @classmethod
+    def _connect(cls):
+        return ensure_schema(cls._schema)
+
+    @staticmethod
+    def _tmp_path(path: Path, suffix: str = ".tmp") -> Path:
+        return path.with_suffix(f".{os.getpid()}.{threading.get_ident()}{suffix}")
+
+    @classmethod
+    def _write(cls, table: pa.Table, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cls._tmp_path(path)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)  # atomic, concurrent sessions never see half a file
+
+    @classmethod
+    def _convert_out_of_core(cls, data: bytes, path: Path):
+        # DuckDB streams CSV -> Parquet with bounded memory; nothing is materialized in pandas
+        import duckdb
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        csv_path = cls._tmp_path(path, ".csv")
+        tmp_path = cls._tmp_path(path)
+        csv_path.write_bytes(data)
+        try:
+            with duckdb.connect() as conn:
+                conn.execute(
+                    f"COPY (SELECT * FROM read_csv_auto({quote_sql_literal(csv_path)})) "
+                    f"TO {quote_sql_literal(tmp_path)} (FORMAT PARQUET)"
+                )
+            os.replace(tmp_path, path)
+        finally:
+            csv_path.unlink(missing_ok=True)
+            tmp_path.unlink(missing_ok=True)
@@ -1,9 +1,25 @@
 import re
+import asyncio
+import concurrent.futures
 import streamlit as st
 from .prompt_template import PromptTemplate
 from .sessions import SessionState
-from utils.formats import patch_missing_imports
-from llm_config import ask_llm_groq, review_code_with_mistral, llm_groq
+from .tracing import Tracer
+from .validation import CodeValidator, LOCAL_VALIDATION
+from .schema import ColumnIndex
+from .library import QueryLibrary
+from .connections import get_session_connection, table_name_for
+from .catalog import DatasetCatalog
+from .scheduler import LLMLoop
+from utils.formats import patch_missing_imports, strip_lines
+from llm_config import (
+    ask_llm_groq,
+    review_code_with_mistral,
+    areview_code_with_mistral,
+    astream_llm,
+    clean_llm_output,
+    get_llm_groq,
+)
 
 state = SessionState()
 
@@ -19,48 +35,225 @@ class AIActionInvoker:
 
     @staticmethod
     def get_questions_suggestions():
-        prompt = PromptTemplate.SUGGEST_QUESTIONS.value.format(
-            cols=state.get_columns(),
-        )
+        # Usually already fetched in the background right after upload (see utils/prefetch.py)
+        job = state.get_prefetch_job()
+        if job is not None:
+            with st.spinner("✨ Finishing suggestions..."):
+                suggestions = job.wait_suggestions()
+            if suggestions:
+                state.set_suggested_questions(suggestions)
+                return
         try:
-            state.set_suggested_questions(AIActionInvoker.call_llm_groq(prompt))
+            state.set_suggested_questions(
+                AIActionInvoker.suggest_questions(state.get_columns_as_list(), state.get_column_types())
+            )
         except Exception as e:
             st.error(f"Suggestion error: {e}")
 
     @staticmethod
-    def generate_code(question:str, mode:str, language:str):
+    def suggest_questions(columns: list[str], types: dict) -> list[str]:
+        cols, savings = ColumnIndex.prompt_columns("", columns, types)
+        prompt = PromptTemplate.SUGGEST_QUESTIONS.value.format(
+            cols=cols,
+        )
+        with Tracer.span("suggestions", **savings):
+            return AIActionInvoker.call_llm_groq(prompt)
+
+    @staticmethod
+    def use_prefetched(question: str, mode: str, language: str) -> bool:
+        # Show the background-prepared answer for this question, if there is one
+        job = state.get_prefetch_job()
+        if job is None:
+            return False
+        if job.is_ready(question):
+            answer = job.answer(question, mode, language)
+        else:
+            with st.spinner("🤖 Finishing the prepared answer..."):
+                answer = job.answer(question, mode, language)
+        if answer is None:
+            return False
+
+        full, in_app = answer
+        state.set_full_code(full)
+        state.set_in_app_code(in_app)
+        state.set_explanation("")
+        state.set_code_origin(question, mode, language)
+        return True
+
+    @staticmethod
+    def joinable_tables() -> list[str]:
+        # The catalog tables this session may JOIN with: its other uploads and the ones it added
+        visible = state.get_catalog_tables()
+        if not visible:
+            return []
+        try:
+            tables = DatasetCatalog.tables()
+        except Exception:
+            return []  # a broken catalog must never block generation
+        return [t["name"] for t in tables if t["name"] in visible and t["dataset_key"] != state.get_dataset_key()]
+
+    @staticmethod
+    def build_code_prompt(question: str, mode: str, language: str, filename=None, cols=None, types=None,
+                          tables=None) -> str:
+        # filename/cols/types/tables default to the current session; the batch runner passes its own
+        filename = state.get_filename() if filename is None else filename
+        columns = state.get_columns_as_list() if cols is None else cols
+        types = state.get_column_types() if types is None else types
+        # Wide datasets only list the columns relevant to the question
+        cols, savings = ColumnIndex.prompt_columns(question, columns, types)
+        Tracer.annotate(**savings)
         explain_flag = ("and add beginner-friendly comments" if mode.startswith("Explain") else "a knowledgeable audience")
         if language == "Python":
-            prompt = PromptTemplate.Python_CODE_GENERATION.value.format(
+            return PromptTemplate.Python_CODE_GENERATION.value.format(
                 question=question,
-                filename=state.get_filename(),
-                cols=state.get_columns(),
+                filename=filename,
+                cols=cols,
                 explain_flag=explain_flag
             )
         else: #SQL
-            prompt = PromptTemplate.SQL_CODE_GENERATION.value.format(
+            # The session's other catalog tables are in the connection too (see utils/catalog.py)
+            tables = AIActionInvoker.joinable_tables() if tables is None else tables
+            tables = DatasetCatalog.prompt_tables(question, tables, columns)
+            if tables:
+                tables = "\n        - Other tables you can JOIN with it:\n" + tables
+            return PromptTemplate.SQL_CODE_GENERATION.value.format(
                 question=question,
-                filename=state.get_filename(),
-                cols=state.get_columns(),
+                filename=filename,
+                cols=cols,
+                tables=tables,
                 explain_flag=explain_flag  
         )
 
+    @staticmethod
+    def generate_code(question:str, mode:str, language:str):
+        if AIActionInvoker.use_prefetched(question, mode, language):
+            return
+        filename = state.get_filename()
+        if not filename:
+            st.warning("⚠️ No filename found in session state. Skipping filename replacement.")
+        placeholder = st.empty()
+        streamed = [""]   # newest response text, set on the LLM loop and drawn from this thread
+
         try:
             with st.spinner("🤖 Generating code..."):
-                res = AIActionInvoker.call_llm_groq(prompt)
-                AIResponseFormatHandler.prep_code(res)
-
-                mistral_review = AIActionInvoker.call_llm_mistral(
-                    state.get_full_code(), 
-                    state.get_columns_as_list(),
-                    language=language
-                    
-                )
-                state.set_in_app_code(mistral_review)
-                # print(state.get_in_app_code())
+                sql_conn = get_session_connection() if language == "SQL" and LOCAL_VALIDATION else None
+                # The pipeline runs on the shared LLM loop (see utils/scheduler.py); the session
+                # is only read and written here, on the script thread
+                job = LLMLoop.submit(AIActionInvoker.generate_sections(
+                    question, mode, language, filename, state.get_columns_as_list(),
+                    lambda text: streamed.__setitem__(0, text), sql_conn, state.get_column_types(),
+                    AIActionInvoker.joinable_tables(),
+                ))
+                shown = ""
+                try:
+                    while True:
+                        try:
+                            # The timeout throttles redraws, so a fast token stream doesn't flood the frontend
+                            full, in_app = job.result(timeout=0.05)
+                            break
+                        except concurrent.futures.TimeoutError:
+                            if streamed[0] != shown:
+                                shown = streamed[0]
+                                placeholder.code(shown, "python")
+                finally:
+                    job.cancel()  # the script was stopped or rerun: stop streaming too
+            state.set_full_code(full)
+            state.set_in_app_code(in_app)
+            state.set_explanation("")
+            state.set_code_origin(question, mode, language)
 
         except Exception as e:
             st.error(f"Code generation error: {e}")
+        finally:
+            placeholder.empty()
+
+    # --- async pipeline stages: stream -> (standalone ready) review, in parallel with the rest ---
+    @staticmethod
+    async def stream_code(prompt: str):
+        # Yields the accumulated response text after every chunk
+        text = ""
+        async for chunk in astream_llm(get_llm_groq(), prompt):
+            text += chunk
+            yield text
+
+    @staticmethod
+    async def review_code(code: str, dataset_columns: list[str], language: str, diagnostics=None) -> str:
+        with Tracer.span("review", language=language, code_chars=len(code), escalated=bool(diagnostics)):
+            return await areview_code_with_mistral(code, dataset_columns, language, diagnostics)
+
+    @staticmethod
+    def validate_code(code: str, language: str, dataset_columns: list[str], sql_conn=None) -> list[str]:
+        with Tracer.span("validate", language=language) as span:
+            diagnostics = CodeValidator.validate(code, language, dataset_columns, sql_conn)
+            span.set(passed=not diagnostics, issues=len(diagnostics))
+            return diagnostics
+
+    @staticmethod
+    async def generate_sections(question: str, mode: str, language: str, filename: str, columns: list[str],
+                                on_update=None, sql_conn=None, types=None, tables=()):
+        # Session-free core: returns (standalone code, in-app code). Code that passes local
+        # validation is used as generated; only failures go to the review LLM, with the diagnostics.
+        with Tracer.span("generate", language=language, mode=mode) as trace:
+            # Same question on a file with the same schema: code that already ran, no LLM call
+            reused = QueryLibrary.lookup(question, mode, language, filename, columns, types or {})
+            if reused is not None:
+                full, in_app, match = reused
+                trace.set(library_hit=True, library_similarity=match["similarity"])
+                return full, in_app
+
+            prompt = AIActionInvoker.build_code_prompt(question, mode, language, filename, columns, types or {}, tables)
+            trace.set(prompt_chars=len(prompt))
+
+            # The review prompt lists the columns relevant to the question and the code under review
+            def review(code, diagnostics=None):
+                review_columns = ColumnIndex.select(f"{question}\n{code}", columns, types)
+                if language == "SQL":
+                    review_columns = review_columns + DatasetCatalog.joined_columns(code, table_name_for(filename or ""))
+                return asyncio.create_task(AIActionInvoker.review_code(code, review_columns, language, diagnostics))
+
+            review_task = None
+            standalone = None
+            text = ""
+            try:
+                async for text in AIActionInvoker.stream_code(prompt):
+                    if on_update is not None:
+                        on_update(text)
+
+                    # The standalone section is final once the In-App marker arrives: check it right
+                    # away, and if it needs review start that while the rest is still streaming
+                    if standalone is None:
+                        standalone = AIResponseFormatHandler.standalone_section(text, filename)
+                        if standalone is not None:
+                            diagnostics = (AIActionInvoker.validate_code(standalone, language, columns, sql_conn)
+                                           if LOCAL_VALIDATION else None)
+                            if diagnostics is None or diagnostics:
+                                trace.set(review_started_ms=round(trace.elapsed_ms(), 1))
+                                review_task = review(standalone, diagnostics)
+
+                with Tracer.span("postprocess", response_chars=len(text)):
+                    # Python that may skip review must keep every line; strip_lines is lossy
+                    # (drops st.write, plt calls, loop headers) and relied on the review to repair it
+                    if LOCAL_VALIDATION and language == "Python":
+                        res = AIResponseFormatHandler.extract_code(text)
+                    else:
+                        res = strip_lines(clean_llm_output(text))
+                    full, in_app = AIResponseFormatHandler.split_sections(res, filename, language)
+
+                if review_task is None:
+                    if not LOCAL_VALIDATION:  # response had no In-App section, review the whole thing
+                        review_task = review(full)
+                    else:
+                        diagnostics = AIActionInvoker.validate_code(in_app, language, columns, sql_conn)
+                        if not diagnostics:
+                            trace.set(review_skipped=True)
+                            return full, in_app
+                        review_task = review(in_app, diagnostics)
+                return full, await review_task
+
+            except BaseException:
+                if review_task is not None:
+                    review_task.cancel()
+                raise
 
 
 class AIResponseFormatHandler:
@@ -70,6 +263,17 @@ class AIResponseFormatHandler:
         if filename is None:
             filename = state.get_filename()
 
+        if not filename:
+            st.warning("⚠️ No filename found in session state. Skipping filename replacement.")
+
+        full, in_app = AIResponseFormatHandler.split_sections(res, filename)
+
+        state.set_full_code(full)
+        state.set_in_app_code(in_app)
+        state.set_explanation("")
+
+    @staticmethod
+    def split_sections(res, filename=None, language=None):
         if isinstance(res, list):
             res = AIResponseFormatHandler.join_lines(res)
 
@@ -79,13 +283,13 @@ class AIResponseFormatHandler:
             parts = normalized.split("# In-App Version")
             full = parts[0].replace("# Standalone Code", "").strip()
             in_app = parts[1].strip()
+        elif language == "SQL":
+            full, in_app = AIResponseFormatHandler.split_sql(normalized)
         else:
             full = in_app = normalized.strip()
 
         if filename:
             full = full.replace("data.csv", filename)
-        else:
-            st.warning("⚠️ No filename found in session state. Skipping filename replacement.")
 
         # Additional streamlit-specific patches
         in_app = patch_missing_imports(in_app)
@@ -93,9 +297,38 @@ class AIResponseFormatHandler:
         in_app = re.sub(r'print\s*\((.*?)\)', r'st.write(\1)', in_app)
         in_app = re.sub(r'@st\.cache\b', '@st.cache_data', in_app)
 
-        state.set_full_code(full)
-        state.set_in_app_code(in_app)
-        state.set_explanation("")
+        return full, in_app
+
+    @staticmethod
+    def split_sql(text: str):
+        # SQL responses have no In-App marker: the commented query comes first, the clean one last
+        import duckdb
+
+        try:
+            statements = [s.query.strip().rstrip(";") + ";" for s in duckdb.extract_statements(text)]
+        except duckdb.Error:
+            statements = []  # unparseable: kept whole, validation reports it
+        if len(statements) < 2:
+            return text.strip(), text.strip()
+        return statements[0], statements[-1]
+
+    @staticmethod
+    def standalone_section(partial: str, filename=None):
+        # Every cleanup step is line-local, so the standalone part of a partial response is
+        # final once the In-App marker line has fully arrived. Returns None until then.
+        complete = partial[: partial.rfind("\n") + 1]
+        if "In-App" not in complete:
+            return None
+        res = AIResponseFormatHandler.extract_code(complete)
+        if "# In-App Version" not in AIResponseFormatHandler.code_normalizer(res):
+            return None
+        return AIResponseFormatHandler.split_sections(res, filename)[0]
+
+    @staticmethod
+    def extract_code(text: str) -> str:
+        # Everything but the code fences and filler lines, so the code can run exactly as generated
+        lines = clean_llm_output(text).splitlines()
+        return "\n".join(line for line in lines if not line.strip().startswith("```")).strip()
 
     @staticmethod
     def code_normalizer(res: str) -> str:
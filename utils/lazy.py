@@ -0,0 +1,84 @@
+import importlib
+import os
+import threading
+import types
+from pathlib import Path
+from .database import env_flag
+
+# --- NLTK corpora are read from a local folder, never downloaded at import time ---
+NLTK_DATA_DIR = Path(os.getenv("MYQUERY_NLTK_DATA", Path(__file__).resolve().parent.parent / "nltk_data"))
+NLTK_PACKAGES = {
+    "stopwords": "corpora/stopwords",
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+}
+OFFLINE = env_flag("MYQUERY_OFFLINE", default=False)
+
+
+class LazyModule(types.ModuleType):
+    # --- stands in for a heavy module and imports it on first attribute access ---
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+plt = LazyModule("matplotlib.pyplot")
+sns = LazyModule("seaborn")
+nltk = LazyModule("nltk")
+
+_stopwords_cache = {}
+
+
+def ensure_nltk_data(*packages: str) -> bool:
+    # Looks in the local data dir first; only reaches the network when not running offline
+    if str(NLTK_DATA_DIR) not in nltk.data.path:
+        nltk.data.path.insert(0, str(NLTK_DATA_DIR))
+
+    available = True
+    for package in packages:
+        try:
+            nltk.data.find(NLTK_PACKAGES[package])
+        except LookupError:
+            if OFFLINE or not nltk.download(package, download_dir=str(NLTK_DATA_DIR), quiet=True):
+                available = False
+    return available
+
+
+def english_stopwords() -> list[str]:
+    if "english" not in _stopwords_cache:
+        if ensure_nltk_data("stopwords"):
+            from nltk.corpus import stopwords
+            _stopwords_cache["english"] = list(stopwords.words("english"))
+        else:
+            return []  # not provisioned; don't cache so a later provision is picked up
+    return _stopwords_cache["english"]
+
+
+def provision_nltk_data():
+    NLTK_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    for package in NLTK_PACKAGES:
+        nltk.download(package, download_dir=str(NLTK_DATA_DIR))
+
+
+if __name__ == "__main__":
+    # Run once at image build time: python -m utils.lazy
+    provision_nltk_data()
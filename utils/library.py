@@ -0,0 +1,217 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from .database import ensure_schema, env_flag, env_float, env_int
+
+# --- settings ---
+LIBRARY_ENABLED = env_flag("MYQUERY_LIBRARY")
+MIN_SIMILARITY = env_float("MYQUERY_LIBRARY_MIN_SIMILARITY", 0.9)   # cosine of normalized questions
+MAX_ENTRIES = env_int("MYQUERY_LIBRARY_MAX_ENTRIES", 5000)
+INDEXES_KEPT = 32
+
+# Words that don't change what is being asked, and spellings of the same request
+STOPWORDS = frozenset(
+    "a an the of for in on at to by per from with and or is are was were be what which who whose how "
+    "do does did can could would should please show me give list find get tell i we you my our their "
+    "this that these those each every all there it its as into than then".split()
+)
+SYNONYMS = {
+    "avg": "average", "mean": "average", "sum": "total", "num": "count", "number": "count",
+    "qty": "quantity", "amt": "amount", "max": "maximum", "highest": "maximum", "largest": "maximum",
+    "biggest": "maximum", "min": "minimum", "lowest": "minimum", "smallest": "minimum",
+    "monthly": "month", "daily": "day", "yearly": "year", "annual": "year", "weekly": "week",
+}
+
+
+def schema_fingerprint(columns: list[str], types: dict) -> str:
+    # Column names in file order with their short dtypes: next month's file with the same layout matches
+    raw = "\x00".join(f"{c}\x01{types.get(c, '')}" for c in columns)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_question(question: str) -> str:
+    words = []
+    for word in re.findall(r"[a-z0-9_.]+", question.lower()):
+        word = word.strip(".")
+        if not word or word in STOPWORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]  # "regions" -> "region"
+        words.append(word)
+    return " ".join(words)
+
+
+def _numbers(normalized: str) -> tuple:
+    # "top 5" and "top 10" are different questions however similar the rest is
+    return tuple(w for w in normalized.split() if re.fullmatch(r"\d+(\.\d+)?", w))
+
+
+class QueryLibrary:
+    # --- generated code that ran successfully, reused for the same question on the same schema ---
+    # Entries are keyed by schema fingerprint, language and mode. A question matches when its normalized
+    # form is close enough (TF-IDF cosine) to a stored one; the stored code is then adapted to the new
+    # file name and SQL table name and used instead of calling the LLM.
+    _schema = """
+        CREATE TABLE IF NOT EXISTS query_library (
+            id INTEGER PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            language TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            normalized TEXT NOT NULL,
+            question TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            full_code TEXT NOT NULL,
+            in_app_code TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            uses INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (fingerprint, language, mode, normalized)
+        );
+    """
+    _lock = threading.Lock()
+    _indexes = OrderedDict()   # (fingerprint, language, mode) -> {"version", "ids", "vectorizer", "matrix"}
+
+    @classmethod
+    def lookup(cls, question: str, mode: str, language: str, filename: str, columns: list[str], types: dict):
+        # (full code, in-app code, match info) for a stored answer to this question, else None
+        if not LIBRARY_ENABLED or not question.strip():
+            return None
+        normalized = normalize_question(question)
+        scope = (schema_fingerprint(columns, types or {}), language, mode)
+        try:
+            index = cls._index(scope)
+            if index is None:
+                return None
+            scores = (index["matrix"] @ index["vectorizer"].transform([normalized]).T).toarray().ravel()
+            # Words no stored question uses are invisible to the vectorizer; count them against the match
+            words = normalized.split()
+            scores *= sum(w in index["vectorizer"].vocabulary_ for w in words) / max(1, len(words))
+            for position in scores.argsort()[::-1]:
+                if scores[position] < MIN_SIMILARITY:
+                    return None
+                entry = cls._entry(index["ids"][position])
+                if entry is not None and _numbers(entry["normalized"]) == _numbers(normalized):
+                    break
+            else:
+                return None
+            cls._touch(entry["id"])
+        except (sqlite3.Error, ValueError):
+            return None  # a broken library must never block generation
+
+        full, in_app = (_substitute(code, entry["filename"], filename, language)
+                        for code in (entry["full_code"], entry["in_app_code"]))
+        return full, in_app, {"question": entry["question"], "similarity": round(float(scores[position]), 3)}
+
+    @classmethod
+    def remember(cls, question: str, mode: str, language: str, filename: str, columns: list[str], types: dict,
+                 full_code: str, in_app_code: str):
+        # Called once the in-app code has run without error
+        if not LIBRARY_ENABLED or not question.strip() or not in_app_code.strip():
+            return
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        now = time.time()
+        try:
+            with closing(cls._connect()) as conn:
+                conn.execute(
+                    "INSERT INTO query_library (fingerprint, language, mode, normalized, question, filename, "
+                    "full_code, in_app_code, created_at, last_used, uses) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0) "
+                    "ON CONFLICT (fingerprint, language, mode, normalized) DO UPDATE SET "
+                    "question = excluded.question, filename = excluded.filename, full_code = excluded.full_code, "
+                    "in_app_code = excluded.in_app_code, last_used = excluded.last_used",
+                    (schema_fingerprint(columns, types or {}), language, mode, normalized, question, filename,
+                     full_code, in_app_code, now, now),
+                )
+                cls._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    @classmethod
+    def stats(cls) -> dict:
+        with closing(cls._connect()) as conn:
+            entries, uses, schemas = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(uses), 0), COUNT(DISTINCT fingerprint) FROM query_library"
+            ).fetchone()
+        return {"entries": entries, "uses": uses, "schemas": schemas}
+
+    @classmethod
+    def clear(cls):
+        with closing(cls._connect()) as conn:
+            conn.execute("DELETE FROM query_library")
+        with cls._lock:
+            cls._indexes.clear()
+
+    # --- similarity index, one per schema/language/mode, rebuilt when its entries change ---
+    @classmethod
+    def _index(cls, scope: tuple):
+        with closing(cls._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, normalized, created_at FROM query_library "
+                "WHERE fingerprint = ? AND language = ? AND mode = ? ORDER BY id",
+                scope,
+            ).fetchall()
+        if not rows:
+            return None
+        # Other processes share the database, so the index is checked against it on every lookup
+        version = (len(rows), rows[-1][0], max(r[2] for r in rows))
+        with cls._lock:
+            index = cls._indexes.get(scope)
+            if index is not None and index["version"] == version:
+                cls._indexes.move_to_end(scope)
+                return index
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        # Words and word pairs: "average sales by region" must not match "total sales by region"
+        vectorizer = TfidfVectorizer(analyzer="word", ngram_range=(1, 2), token_pattern=r"\S+", sublinear_tf=True)
+        matrix = vectorizer.fit_transform(r[1] for r in rows)
+        index = {"version": version, "ids": [r[0] for r in rows], "vectorizer": vectorizer, "matrix": matrix}
+        with cls._lock:
+            cls._indexes[scope] = index
+            while len(cls._indexes) > INDEXES_KEPT:
+                cls._indexes.popitem(last=False)
+        return index
+
+    @classmethod
+    def _entry(cls, entry_id: int):
+        with closing(cls._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM query_library WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    @classmethod
+    def _touch(cls, entry_id: int):
+        with closing(cls._connect()) as conn:
+            conn.execute("UPDATE query_library SET last_used = ?, uses = uses + 1 WHERE id = ?",
+                         (time.time(), entry_id))
+
+    @classmethod
+    def _evict(cls, conn):
+        conn.execute(
+            "DELETE FROM query_library WHERE id NOT IN "
+            "(SELECT id FROM query_library ORDER BY last_used DESC LIMIT ?)",
+            (MAX_ENTRIES,),
+        )
+
+    @classmethod
+    def _connect(cls):
+        return ensure_schema(cls._schema)
+
+
+def _substitute(code: str, old_filename: str, new_filename: str, language: str) -> str:
+    # Stored code names the file it was generated for; point it at the current one
+    if not old_filename or not new_filename or old_filename == new_filename:
+        return code
+    from .connections import table_name_for
+
+    code = code.replace(old_filename, new_filename)
+    if language == "SQL":
+        old_table, new_table = table_name_for(old_filename), table_name_for(new_filename)
+        code = re.sub(rf"(?<![\w.]){re.escape(old_table)}(?!\w)", new_table.replace("\\", r"\\"), code)
+    return code
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+from .tracing import Tracer
+from .invokers import AIActionInvoker
+from .ingest import IngestCache
+from .sandbox import SANDBOX_ENABLED
+from .library import QueryLibrary
+from .database import env_flag, env_float, env_int
+from .scheduler import LLMLoop
+
+# --- settings ---
+# Off by default: every upload would spend LLM tokens on answers nobody may ask for
+PREFETCH_ENABLED = env_flag("MYQUERY_PREFETCH", default=False)
+BUDGET_SECONDS = env_float("MYQUERY_PREFETCH_BUDGET", 90)   # wall clock per upload
+MAX_ANSWERS = env_int("MYQUERY_PREFETCH_ANSWERS", 5)         # 0 = fetch the suggestions only
+# Answers are prepared for one mode/language; other choices go through the normal round trip
+MODE = "Just Code"
+LANGUAGE = os.getenv("MYQUERY_PREFETCH_LANGUAGE", "Python")
+
+
+class PrefetchJob:
+    # --- speculative work for one upload: suggestions, then code + a warm result for each ---
+    # Runs on the shared LLM loop (see utils/scheduler.py), so it must stay session-free: everything
+    # it needs is captured in `dataset` when the job starts. Results are read back by the script thread.
+    def __init__(self, dataset: dict):
+        self.dataset = dataset          # filename, dataset_key, parquet_path, columns, types, source, out_of_core
+        self.suggestions = None
+        self.answers = {}               # question -> (standalone code, in-app code)
+        self._ready = {}                # question -> Event, set once its answer exists (or never will)
+        self._suggested = threading.Event()
+        self._future = None
+
+    def start(self) -> "PrefetchJob":
+        self._future = LLMLoop.submit(self._main())
+        self._future.add_done_callback(self._finished)
+        return self
+
+    def cancel(self):
+        # Stops in-flight LLM calls too: the job's task is cancelled on the LLM loop
+        if self._future is not None:
+            self._future.cancel()
+
+    def wait_suggestions(self, timeout: float = BUDGET_SECONDS):
+        self._suggested.wait(timeout)
+        return self.suggestions
+
+    def is_ready(self, question: str) -> bool:
+        event = self._ready.get(question)
+        return event is not None and event.is_set()
+
+    def answer(self, question: str, mode: str, language: str, timeout: float = BUDGET_SECONDS):
+        # The prepared answer, waiting for it if it is being generated right now; None if there is none
+        if (mode, language) != (MODE, LANGUAGE):
+            return None
+        event = self._ready.get(question)
+        if event is None:
+            return None
+        event.wait(timeout)
+        return self.answers.get(question)
+
+    # --- on the LLM loop ---
+    def _finished(self, future):
+        # Done, cancelled or failed (the error is on the prefetch span): nobody may wait on
+        # work that will no longer happen
+        self._suggested.set()
+        for event in list(self._ready.values()):
+            event.set()
+
+    async def _main(self):
+        # Blocking work (DuckDB, sync LLM calls, runs) goes to threads: the loop is shared
+        with Tracer.span("prefetch", language=LANGUAGE) as span:
+            sql = await asyncio.to_thread(self._connect) if LANGUAGE == "SQL" else None
+            try:
+                await asyncio.wait_for(self._work(span, sql), BUDGET_SECONDS)
+            except asyncio.TimeoutError:
+                span.set(budget_exhausted=True)
+            finally:
+                if sql is not None:
+                    sql.close()
+
+    async def _work(self, span, sql):
+        data = self.dataset
+        questions = await asyncio.to_thread(AIActionInvoker.suggest_questions, data["columns"], data["types"])
+        self.suggestions = questions
+        questions = [q for q in questions if q.strip()][:max(0, MAX_ANSWERS)]
+        for question in questions:
+            self._ready[question] = threading.Event()
+        self._suggested.set()
+
+        # In suggestion order, so the first button is the first one ready
+        for question in questions:
+            try:
+                self.answers[question] = await AIActionInvoker.generate_sections(
+                    question, MODE, LANGUAGE, data["filename"], data["columns"], sql_conn=sql, types=data["types"],
+                    tables=data["tables"],
+                )
+            except Exception:
+                span.add(failed=1)
+                continue
+            finally:
+                self._ready[question].set()
+            span.add(answers=1)
+
+            # Running it now leaves the result in the ResultCache for when the user clicks Run
+            if await asyncio.to_thread(self._execute, self.answers[question][1], sql):
+                span.add(executed=1)
+                full, in_app = self.answers[question]
+                QueryLibrary.remember(question, MODE, LANGUAGE, data["filename"], data["columns"], data["types"],
+                                      full, in_app)
+
+    def _execute(self, in_app: str, sql) -> bool:
+        from .formats import rewrite_in_app_code
+        from .handlers import ExecutionHandler  # handlers starts prefetch jobs; import here to avoid a cycle
+
+        data = self.dataset
+        code = rewrite_in_app_code(in_app)
+        try:
+            with Tracer.span("prefetch.execute", language=LANGUAGE):
+                if LANGUAGE == "SQL":
+                    ExecutionHandler.run_sql(sql, code)
+                    return True
+                if SANDBOX_ENABLED and not data["out_of_core"]:
+                    # Only in the sandbox (in-process runs render straight into the page), and never
+                    # for out-of-core data, whose Arrow copy is only worth building if the user asks
+                    ipc_path = IngestCache.ensure_ipc(data["dataset_key"], parquet_path=data["parquet_path"])
+                    return not ExecutionHandler.run_python(code, data["dataset_key"], ipc_path)[0].error
+        except Exception:
+            pass  # a speculative run failing just means the user's run isn't cached
+        return False
+
+    def _connect(self):
+        from .connections import DuckDBConnectionManager, table_name_for
+
+        data = self.dataset
+        return DuckDBConnectionManager.acquire(data["dataset_key"], table_name_for(data["filename"]), data["source"])
+
+
+class Prefetcher:
+    @staticmethod
+    def start(dataset: dict):
+        if not PREFETCH_ENABLED:
+            return None
+        return PrefetchJob(dataset).start()
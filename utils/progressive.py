@@ -0,0 +1,65 @@
+import threading
+import time
+from .tracing import Tracer
+from .database import env_flag, env_int
+
+# --- settings ---
+PROGRESSIVE_ENABLED = env_flag("MYQUERY_PROGRESSIVE")
+PROGRESSIVE_MIN_ROWS = env_int("MYQUERY_PROGRESSIVE_ROWS", 1_000_000)   # smaller datasets just run
+PREVIEW_ROWS = env_int("MYQUERY_PREVIEW_ROWS", 100_000)
+
+
+class ProgressiveRun:
+    # --- the full-data run of one piece of generated code, on a background thread ---
+    # The preview (the same code on a sample) is computed up front by the caller; this object
+    # holds it until the full result replaces it. Session-free: `run` gets only the cancel event.
+    def __init__(self, code: str, language: str, preview, sample_rows: int, total_rows: int, run, interrupt=None,
+                 on_done=None):
+        self.code = code
+        self.language = language
+        self.preview = preview          # DataFrame (SQL) or SandboxResult (Python) computed on the sample
+        self.sample_rows = sample_rows
+        self.total_rows = total_rows
+        self.status = "running"         # running -> done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.seconds = None
+        self._cancel = threading.Event()
+        self._interrupt = interrupt     # extra hook for work the event alone can't stop (DuckDB queries)
+        self._on_done = on_done         # called with the result on this thread after the full run finishes
+        self._thread = threading.Thread(target=self._run, args=(run,), name="myquery-full-run", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def elapsed(self) -> float:
+        return self.seconds if self.seconds is not None else time.monotonic() - self.started
+
+    def cancel(self):
+        if not self.running:
+            return
+        self._cancel.set()
+        if self._interrupt is not None:
+            self._interrupt(self._cancel)
+
+    def _run(self, run):
+        with Tracer.span("execute.full", language=self.language, rows=self.total_rows) as span:
+            try:
+                self.result = run(self._cancel)
+                status = "cancelled" if self._cancel.is_set() else "done"
+            except Exception as e:
+                status = "cancelled" if self._cancel.is_set() else "failed"
+                self.error = f"{type(e).__name__}: {e}" if status == "failed" else None
+                if status == "failed":
+                    span.fail(e)
+            span.set(status=status)
+        self.seconds = time.monotonic() - self.started
+        self.status = status
+        if status == "done" and self._on_done is not None:
+            try:
+                self._on_done(self.result)
+            except Exception:
+                pass  # bookkeeping only; the result is already there
@@ -1,6 +1,11 @@
 from enum import Enum
 
 class PromptTemplate(Enum):
+    REVIEW_ISSUES = """
+        An automatic check found these problems; fix every one of them:
+        {diagnostics}
+    """
+
     SUGGEST_QUESTIONS ="""List only 5 analytical questions based on these dataset columns: {cols}. 
             Output only the questions in plain bullet points. Do not include any introductory or concluding sentence.
         """
@@ -16,7 +21,7 @@ class PromptTemplate(Enum):
         6. Do not include explanations — return only the revised Python code.
         7. Do not define a data loading function; keep `df = df.copy()` as the starting point.
         8. Replace `plt.show()` with `st.pyplot(plt.gcf())` if applicable.
-
+        {issues}
         Code:
         {code}
     """
@@ -30,6 +35,7 @@ class PromptTemplate(Enum):
         5. Ensure the code is clean, professional, and safe to execute.
         6. Do not explain — just return the revised, executable SQL code.
         7. Do not define a data loading function; directly to access the dataset.
+        {issues}
         Code:
         {code}
     """
@@ -63,11 +69,12 @@ class PromptTemplate(Enum):
         - Use pandas, matplotlib, seaborn, sklearn, or nltk as needed.
         - Start with: df = df.copy()
         - Clean column names by stripping spaces: df.columns = df.columns.str.strip()
+        - Date columns may already be datetime64.
         - If computing correlation:
             - Convert datetime columns using:
                 df[col] = pd.to_datetime(df[col], errors='coerce').astype('int64')
-            - Detect and encode all non-numeric object columns dynamically:
-                object_cols = df.select_dtypes(include='object').columns
+            - Detect and encode all non-numeric text columns dynamically:
+                object_cols = df.select_dtypes(include=['object', 'string']).columns
                 for col in object_cols:
                     df[col] = pd.factorize(df[col])[0]
             - Ensure all columns used in correlation or plotting are numeric
@@ -91,7 +98,7 @@ class PromptTemplate(Enum):
         You are a SQL coding assistant. Your task is to generate SQL code to answer the following question:
 
         - Question: "{question}"
-        - Dataset: '{filename}' with columns [{cols}]
+        - Dataset: '{filename}' with columns [{cols}]{tables}
         - Educational focus: {explain_flag}
 
         Your response must include exactly two parts, in this order:
@@ -123,5 +130,6 @@ class PromptTemplate(Enum):
         General Rules:
         - Use DuckDB/PostgreSQL-compatible SQL
         - Reference the table exactly as '{filename}' (with .csv if present)
+        - Reference any other table by the name listed above, and combine tables with JOINs in the query itself
         - Output only valid SQL — no markdown, no extra text, no narration
     """
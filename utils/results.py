@@ -0,0 +1,164 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .database import CACHE_DIR, env_int
+from .formats import normalize_sql, quote_sql_identifier, quote_sql_literal
+
+# --- settings ---
+PAGE_ROWS = env_int("MYQUERY_RESULT_PAGE_ROWS", 1000)
+DISK_BUDGET_BYTES = env_int("MYQUERY_RESULT_DISK_MB", 2048) * 1024 * 1024
+RESULTS_DIR = CACHE_DIR / "views"
+ROW_NUMBER = "file_row_number"   # added by read_parquet; keeps the query's own row order
+
+
+class ResultSet:
+    # --- one SQL result, spilled to Parquet by DuckDB and read back a page at a time ---
+    # The file is written while the query streams, so no result is ever fully materialized in this
+    # process. Pages, filtered counts, summary statistics and exports are DuckDB queries over it.
+    # Files are named by the result cache key: the file existing means the result is cached.
+    _reader = None
+    _reader_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        metadata = pq.read_metadata(self.path)
+        self.row_count = metadata.num_rows
+        self.schema = metadata.schema.to_arrow_schema()
+        self.columns = [c for c in self.schema.names if c != ROW_NUMBER]
+        self._counts = {}
+        self._summary = None
+
+    @classmethod
+    def path_for(cls, cache_key: str) -> Path:
+        return RESULTS_DIR / f"{cache_key}.parquet"
+
+    @classmethod
+    def cached(cls, cache_key: str):
+        path = cls.path_for(cache_key)
+        return cls(path) if path.exists() else None
+
+    @classmethod
+    def create(cls, conn, query: str, cache_key: str, cancel=None) -> "ResultSet":
+        # conn: a DuckDBHandle on the dataset the query reads
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        path = cls.path_for(cache_key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            statements = duckdb.extract_statements(query)
+            copied = False
+            if len(statements) == 1 and statements[0].type == duckdb.StatementType.SELECT:
+                # Without comments or the trailing semicolon, which would break out of the parentheses
+                select = normalize_sql(statements[0].query)
+                try:
+                    conn.execute(f"COPY ({select}) TO {quote_sql_literal(tmp_path)} (FORMAT PARQUET)", cancel=cancel)
+                    copied = True
+                except duckdb.ParserException:
+                    pass  # DESCRIBE, SHOW, SUMMARIZE and PRAGMA count as SELECT but can't be a COPY source
+            if not copied:
+                # SHOW, DESCRIBE, PRAGMA, several statements...: small outputs, run as written
+                table = conn.execute(query, arrow=True, cancel=cancel)
+                pq.write_table(table if isinstance(table, pa.Table) else pa.table({}), tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        cls._trim(keep=path)
+        return cls(path)
+
+    # --- reads ---
+    def page(self, number: int, rows: int = PAGE_ROWS, sort: str = None, descending: bool = False,
+             filter_column: str = None, filter_text: str = ""):
+        order = f"{quote_sql_identifier(sort)} {'DESC' if descending else 'ASC'} NULLS LAST, " if sort else ""
+        return self._query(
+            f"SELECT * EXCLUDE ({ROW_NUMBER}) FROM {self._source()}{self._where(filter_column, filter_text)} "
+            f"ORDER BY {order}{ROW_NUMBER} LIMIT {int(rows)} OFFSET {int(number) * int(rows)}"
+        ).fetchdf()
+
+    def count(self, filter_column: str = None, filter_text: str = "") -> int:
+        if not filter_text:
+            return self.row_count  # from the Parquet footer, nothing scanned
+        key = (filter_column, filter_text)
+        if key not in self._counts:
+            self._counts[key] = self._query(
+                f"SELECT count(*) FROM {self._source()}{self._where(filter_column, filter_text)}"
+            ).fetchone()[0]
+        return self._counts[key]
+
+    def summary(self):
+        # min/max/unique/mean/quartiles/nulls per column, computed by DuckDB in one streaming pass
+        if self._summary is None:
+            self._summary = self._query(
+                f"SUMMARIZE SELECT * EXCLUDE ({ROW_NUMBER}) FROM {self._source()}"
+            ).fetchdf().set_index("column_name")
+        return self._summary
+
+    def head(self, rows: int):
+        return self.page(0, rows)
+
+    def export_csv(self, sort: str = None, descending: bool = False, filter_column: str = None,
+                   filter_text: str = "") -> Path:
+        # Written by DuckDB in chunks straight to disk, in the order and with the filter on screen
+        order = f"{quote_sql_identifier(sort)} {'DESC' if descending else 'ASC'} NULLS LAST, " if sort else ""
+        view = hashlib.sha1(repr((sort, descending, filter_column, filter_text)).encode("utf-8")).hexdigest()[:12]
+        path = self.path.with_name(f"{self.path.stem}-{view}.csv")
+        if not path.exists():
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                self._query(
+                    f"COPY (SELECT * EXCLUDE ({ROW_NUMBER}) FROM {self._source()}"
+                    f"{self._where(filter_column, filter_text)} ORDER BY {order}{ROW_NUMBER}) "
+                    f"TO {quote_sql_literal(tmp_path)} (FORMAT CSV, HEADER)"
+                )
+                os.replace(tmp_path, path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        return path
+
+    # --- helpers ---
+    def _source(self) -> str:
+        return f"read_parquet({quote_sql_literal(self.path)}, file_row_number = true)"
+
+    def _where(self, column: str, text: str) -> str:
+        # Case-insensitive "contains" on one column, or on any column when none is given
+        if not text:
+            return ""
+        pattern = quote_sql_literal(f"%{text}%")
+        columns = [column] if column else self.columns
+        tests = " OR ".join(f"CAST({quote_sql_identifier(c)} AS VARCHAR) ILIKE {pattern}" for c in columns)
+        return f" WHERE {tests}"
+
+    def _query(self, sql: str):
+        try:
+            os.utime(self.path)  # recently used, for _trim
+        except OSError:
+            raise FileNotFoundError("this result was evicted from the disk cache; run the query again")
+        return self._cursor().execute(sql)
+
+    @classmethod
+    def _cursor(cls):
+        # One in-memory DuckDB for reading result files; each call gets its own cursor (thread-safe)
+        if cls._reader is None:
+            with cls._reader_lock:
+                if cls._reader is None:
+                    cls._reader = duckdb.connect()
+        return cls._reader.cursor()
+
+    @classmethod
+    def _trim(cls, keep: Path):
+        # Least recently read results go first once the folder is over budget
+        files = []
+        for path in RESULTS_DIR.glob("*.*"):
+            try:
+                if path.suffix in (".parquet", ".csv") and path != keep:
+                    stat = path.stat()
+                    files.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue  # removed by another session meanwhile
+        total = keep.stat().st_size
+        for _, size, path in sorted(files, reverse=True):
+            total += size
+            if total > DISK_BUDGET_BYTES:
+                path.unlink(missing_ok=True)
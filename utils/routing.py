@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from .tracing import Tracer, percentile
+from .scheduler import LLMLoop
+from .database import env_flag, env_float, env_int
+
+# --- settings ---
+HEDGE_ENABLED = env_flag("MYQUERY_HEDGE")
+HEDGE_DEFAULT_SECONDS = env_float("MYQUERY_HEDGE_AFTER", 8)   # until a backend has enough samples
+HEDGE_MIN_SECONDS = 0.25
+BREAKER_FAILURES = env_int("MYQUERY_BREAKER_FAILURES", 3)
+BREAKER_COOLDOWN_SECONDS = env_float("MYQUERY_BREAKER_COOLDOWN", 30)
+LATENCY_WINDOW = 50
+MIN_SAMPLES = 5
+
+
+class AllBackendsFailed(Exception):
+    pass
+
+
+class BackendHealth:
+    # --- rolling latency/error window plus a circuit breaker for one backend ---
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {"invoke": deque(maxlen=LATENCY_WINDOW), "stream": deque(maxlen=LATENCY_WINDOW)}
+        self._outcomes = deque(maxlen=LATENCY_WINDOW)   # True = success
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._probing = False
+
+    def record_success(self, kind: str, seconds: float = None):
+        with self._lock:
+            if seconds is not None:
+                self._latencies[kind].append(seconds)
+            self._outcomes.append(True)
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.consecutive_failures >= BREAKER_FAILURES:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN_SECONDS
+
+    def state(self) -> str:
+        with self._lock:
+            if self.open_until == 0.0:
+                return "closed"
+            return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self) -> bool:
+        # Half-open lets exactly one probe through; its outcome closes or re-opens the breaker
+        with self._lock:
+            if self.open_until == 0.0:
+                return True
+            if time.monotonic() < self.open_until or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def percentile(self, kind: str, pct: float):
+        with self._lock:
+            samples = sorted(self._latencies[kind])
+        return percentile(samples, pct) if len(samples) >= MIN_SAMPLES else None
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def expected_seconds(self, kind: str):
+        # Median latency inflated by the error rate; None until there are enough samples
+        p50 = self.percentile(kind, 50)
+        if p50 is None:
+            return None
+        return p50 / max(0.1, 1 - self.error_rate())
+
+
+class Backend:
+    def __init__(self, name: str, llm):
+        self.name = name
+        self.llm = llm
+        self.health = BackendHealth()
+
+
+class ModelRouter:
+    # --- one role (generation, review) served by several chat models ---
+    # Exposes invoke / ainvoke / astream like a langchain chat model, so it drops into llm_config.
+    # Picks the fastest healthy backend, hedges a second request once the first runs past its p95,
+    # and fails over when a backend errors or its circuit breaker is open.
+    def __init__(self, role: str, backends: list, hedge: bool = HEDGE_ENABLED, max_attempts: int = 3):
+        self.role = role
+        self.backends = [b if isinstance(b, Backend) else Backend(_backend_name(b), b) for b in backends]
+        self.hedge = hedge
+        self.max_attempts = max_attempts
+        # The LLM cache is keyed per role: any backend's answer is good for the next identical prompt
+        self.model_name = f"router:{role}:" + ",".join(b.name for b in self.backends)
+        self.temperature = getattr(self.backends[0].llm, "temperature", None)
+
+    # --- selection ---
+    def candidates(self, kind: str) -> list:
+        # Configured order is the prior; measured backends are re-ranked by expected latency,
+        # unmeasured ones keep their place behind them. Open breakers go last (never skipped
+        # outright, so a fully degraded role still gets an attempt).
+        def rank(indexed):
+            index, backend = indexed
+            expected = backend.health.expected_seconds(kind)
+            return (backend.health.state() == "open", expected is None, expected or 0.0, index)
+        return [b for _, b in sorted(enumerate(self.backends), key=rank)]
+
+    def hedge_delay(self, backend: Backend, kind: str) -> float:
+        p95 = backend.health.percentile(kind, 95)
+        return HEDGE_DEFAULT_SECONDS if p95 is None else max(HEDGE_MIN_SECONDS, p95)
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "role": self.role,
+                "backend": b.name,
+                "state": b.health.state(),
+                "invoke_p50_s": b.health.percentile("invoke", 50),
+                "invoke_p95_s": b.health.percentile("invoke", 95),
+                "stream_p50_s": b.health.percentile("stream", 50),
+                "stream_p95_s": b.health.percentile("stream", 95),
+                "error_rate": round(b.health.error_rate(), 3),
+            }
+            for b in self.backends
+        ]
+
+    # --- chat-model interface ---
+    def invoke(self, prompt: str):
+        # Sync callers wait on the shared LLM loop, where the clients' async connections live
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return LLMLoop.run(self.ainvoke(prompt))
+        return self._invoke_failover(prompt)  # called from inside a loop: no hedging, plain failover
+
+    async def ainvoke(self, prompt: str):
+        async def call(backend):
+            return await backend.llm.ainvoke(prompt)
+        message, _ = await self._race("invoke", call)
+        return message
+
+    async def astream(self, prompt: str):
+        async def open_stream(backend):
+            # A stream "responds" when its first chunk arrives; that's what gets raced and hedged
+            stream = backend.llm.astream(prompt).__aiter__()
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await _aclose(stream)
+                raise
+
+        (stream, first), backend = await self._race("stream", open_stream, on_loser=lambda r: _aclose(r[0]))
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            backend.health.record_failure()  # mid-stream failure: text was already emitted, can't fail over
+            raise
+        finally:
+            await _aclose(stream)
+
+    # --- internals ---
+    async def _race(self, kind: str, call, on_loser=None):
+        errors = []
+        tried = set()
+        for _ in range(self.max_attempts):
+            ordered = [b for b in self.candidates(kind) if b.name not in tried] or self.candidates(kind)
+            # allow() claims the half-open probe, so only ask the backends actually used
+            primary = next((b for b in ordered if b.health.allow()), ordered[0])
+            tried.add(primary.name)
+
+            running = {asyncio.ensure_future(self._timed(primary, kind, call)): primary}
+            hedge_at = self.hedge_delay(primary, kind) if self.hedge else None
+            hedged = False
+            try:
+                while running:
+                    done, _ = await asyncio.wait(
+                        running, timeout=hedge_at,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if not done:
+                        # Primary is past its p95: ask another healthy backend, first good answer wins.
+                        # Asking the same (slow) provider again would only double the tokens spent.
+                        hedge_at = None   # at most one hedge per attempt
+                        spare = next((b for b in ordered if b is not primary and b.health.allow()), None)
+                        if spare is not None:
+                            hedged = True
+                            tried.add(spare.name)
+                            running[asyncio.ensure_future(self._timed(spare, kind, call))] = spare
+                        continue
+                    for task in done:
+                        backend = running.pop(task)
+                        if task.exception() is None:
+                            Tracer.annotate(backend=backend.name, hedged=hedged, attempts=len(tried))
+                            return task.result(), backend
+                        errors.append(f"{backend.name}: {task.exception()}")
+            finally:
+                for task, backend in running.items():
+                    task.cancel()
+                    if on_loser is not None:
+                        task.add_done_callback(_close_loser(on_loser))
+        Tracer.annotate(attempts=len(tried))
+        raise AllBackendsFailed(f"{self.role}: every backend failed ({'; '.join(errors)})")
+
+    @staticmethod
+    async def _timed(backend: Backend, kind: str, call):
+        start = time.monotonic()
+        try:
+            result = await call(backend)
+        except asyncio.CancelledError:
+            raise  # lost a hedge race: not the backend's fault
+        except Exception:
+            backend.health.record_failure()
+            raise
+        backend.health.record_success(kind, time.monotonic() - start)
+        return result
+
+    def _invoke_failover(self, prompt: str):
+        errors = []
+        for backend in self.candidates("invoke")[: self.max_attempts]:
+            if not backend.health.allow():
+                continue
+            start = time.monotonic()
+            try:
+                message = backend.llm.invoke(prompt)
+            except Exception as e:
+                backend.health.record_failure()
+                errors.append(f"{backend.name}: {e}")
+                continue
+            backend.health.record_success("invoke", time.monotonic() - start)
+            return message
+        raise AllBackendsFailed(f"{self.role}: every backend failed ({'; '.join(errors)})")
+
+
+def _backend_name(llm) -> str:
+    return getattr(llm, "model_name", None) or type(llm).__name__
+
+
+async def _aclose(stream):
+    close = getattr(stream, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+def _close_loser(on_loser):
+    # A cancelled hedge may still have finished opening its stream; close it so the connection is freed
+    def callback(task):
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(on_loser(task.result()))
+    return callback
@@ -0,0 +1,331 @@
+import io
+import os
+import sys
+import types
+import pickle
+import queue
+import threading
+import time
+import multiprocessing as mp
+from collections import OrderedDict
+from contextlib import contextmanager
+from .database import env_flag, env_float, env_int
+
+# --- settings; the worker side of this module must stay import-light (spawned processes re-import it) ---
+SANDBOX_ENABLED = env_flag("MYQUERY_SANDBOX")
+WORKERS = env_int("MYQUERY_EXEC_WORKERS", min(4, os.cpu_count() or 1))
+TIMEOUT_SECONDS = env_float("MYQUERY_EXEC_TIMEOUT", 60)
+MEMORY_LIMIT_MB = env_int("MYQUERY_EXEC_MEMORY_MB", 4096)
+FRAMES_PER_WORKER = 2
+CANCEL_POLL_SECONDS = 0.2
+
+
+class SandboxError(Exception):
+    pass
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+class SandboxCancelled(SandboxError):
+    pass
+
+
+class SandboxResult:
+    def __init__(self, outputs, has_result, error=None):
+        self.outputs = outputs          # recorded st.* calls, replayed in the Streamlit process
+        self.has_result = has_result    # generated code assigned `result`
+        self.error = error
+
+    def replay(self, st):
+        for name, args, kwargs in self.outputs:
+            if name == "image_png":
+                st.image(args[0])
+                continue
+            try:
+                getattr(st, name)(*args, **kwargs)
+            except Exception as e:
+                st.warning(f"Could not display st.{name} output: {e}")
+
+
+class SandboxExecutor:
+    # --- warm pool of worker processes; a stuck or oversized job is killed and its worker replaced ---
+    _lock = threading.Lock()
+    _idle = None
+    _workers = []
+
+    @classmethod
+    def run(cls, code: str, frame_key: str, ipc_path: str, timeout: float = TIMEOUT_SECONDS,
+            cancel=None) -> SandboxResult:
+        # cancel: optional threading.Event; setting it kills the job's worker (and replaces it)
+        cls._start()
+        worker = cls._idle.get()  # blocks while every worker is busy; other sessions are unaffected
+        try:
+            worker.conn.send({"code": code, "frame_key": frame_key, "ipc_path": str(ipc_path)})
+            if not cls._wait(worker, timeout, cancel):
+                worker = cls._replace(worker)
+                if cancel is not None and cancel.is_set():
+                    raise SandboxCancelled("execution was cancelled")
+                raise SandboxTimeout(f"execution exceeded {timeout:g}s and was stopped")
+            try:
+                return worker.conn.recv()
+            except (EOFError, OSError):
+                worker = cls._replace(worker)
+                raise SandboxError(
+                    f"worker process died (memory limit is {MEMORY_LIMIT_MB} MB)"
+                )
+        finally:
+            cls._idle.put(worker)
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            for worker in cls._workers:
+                worker.stop()
+            cls._workers = []
+            cls._idle = None
+
+    @classmethod
+    def _start(cls):
+        if cls._idle is not None:
+            return
+        with cls._lock:
+            if cls._idle is None:
+                idle = queue.Queue()
+                for _ in range(max(1, WORKERS)):
+                    worker = _Worker()
+                    cls._workers.append(worker)
+                    idle.put(worker)
+                cls._idle = idle
+
+    @staticmethod
+    def _wait(worker, timeout: float, cancel) -> bool:
+        # True once the worker has answered; False on timeout or cancellation
+        if cancel is None:
+            return worker.conn.poll(timeout)
+        deadline = time.monotonic() + timeout
+        while not cancel.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if worker.conn.poll(min(CANCEL_POLL_SECONDS, remaining)):
+                return True
+        return False
+
+    @classmethod
+    def _replace(cls, worker):
+        worker.kill()
+        fresh = _Worker()
+        with cls._lock:
+            cls._workers = [w for w in cls._workers if w is not worker] + [fresh]
+        return fresh
+
+
+class _Worker:
+    def __init__(self):
+        ctx = mp.get_context("spawn")  # never fork the Streamlit server and its threads
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, MEMORY_LIMIT_MB), daemon=True
+        )
+        with _plain_main_module():
+            self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+@contextmanager
+def _plain_main_module():
+    # Streamlit runs main.py as __main__, and spawn re-imports __main__ in the child.
+    # Hide it while starting so workers don't execute the whole app script.
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+# --- worker process side ---
+
+def _worker_main(conn, memory_limit_mb):
+    _limit_memory(memory_limit_mb)
+
+    import matplotlib
+    matplotlib.use("Agg")
+
+    # Pay the heavy imports while the worker is idle, not on the first job
+    import numpy, pandas, pyarrow  # noqa: F401
+    import utils.frames  # noqa: F401
+
+    frames = OrderedDict()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        conn.send(_run_job(job, frames))
+
+
+def _limit_memory(memory_limit_mb):
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    # RLIMIT_DATA caps heap/anonymous memory but not the memory-mapped dataset file
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+def _load_frame(frames, frame_key, ipc_path):
+    # Memory-mapped Arrow IPC: the dataset is shared through the page cache, never pickled
+    if frame_key in frames:
+        frames.move_to_end(frame_key)
+        return frames[frame_key]
+
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    with pa.memory_map(ipc_path) as source:
+        table = ipc.open_file(source).read_all()
+    from utils.frames import arrow_to_pandas
+    df = arrow_to_pandas(table)
+
+    frames[frame_key] = df
+    while len(frames) > FRAMES_PER_WORKER:
+        frames.popitem(last=False)
+    return df
+
+
+def _run_job(job, frames):
+    try:
+        df = _load_frame(frames, job["frame_key"], job["ipc_path"])
+    except MemoryError:
+        return SandboxResult([], False, "out of memory inside the sandbox")
+    return run_recorded(job["code"], df)
+
+
+def run_recorded(code: str, df) -> SandboxResult:
+    # Executes with `st` recorded instead of rendered. Sandbox workers run every job through this;
+    # the server uses it directly for charts when the sandbox is off, so they can be cached too.
+    import warnings
+    import numpy as np
+    import pandas as pd
+    from utils.frames import isolated_view, cheap_copies
+    from utils.lazy import plt, sns, nltk, ensure_nltk_data, english_stopwords
+
+    recorder = _StreamlitRecorder()
+    open_figures = set(plt.get_fignums())
+    try:
+        local = {
+            "df": isolated_view(df),
+            "pd": pd,
+            "np": np,
+            "plt": plt,
+            "sns": sns,
+            "nltk": nltk,
+            "st": recorder,
+            "__builtins__": __builtins__,
+        }
+        if "stopwords" in code:
+            ensure_nltk_data("stopwords")
+            local["stopwords"] = nltk.corpus.stopwords
+            local["stopwords_words"] = english_stopwords()
+        if "tokenize" in code:
+            ensure_nltk_data("punkt", "punkt_tab")
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=DeprecationWarning)
+            exec(cheap_copies(code), local, local)
+
+            func_candidates = [v for v in local.values() if callable(v)]
+            if len(func_candidates) == 1:
+                func_candidates[0]()
+
+        return SandboxResult(recorder.sendable_calls(), "result" in local)
+    except MemoryError:
+        return SandboxResult(recorder.sendable_calls(), False, "out of memory inside the sandbox")
+    except Exception as e:
+        return SandboxResult(recorder.sendable_calls(), False, str(e))
+    finally:
+        # Only the figures this code opened: in the server, other sessions may be drawing too
+        for number in set(plt.get_fignums()) - open_figures:
+            plt.close(number)
+
+
+class _StreamlitRecorder:
+    # Stands in for `st` inside the worker; every call is recorded and replayed by the server
+    def __init__(self):
+        self.calls = []
+
+    def pyplot(self, fig=None, **kwargs):
+        from utils.lazy import plt
+        self.calls.append(("image_png", (_figure_png(fig or plt.gcf()),), {}))
+
+    def columns(self, spec, *args, **kwargs):
+        return [self] * (spec if isinstance(spec, int) else len(spec))
+
+    def tabs(self, labels, *args, **kwargs):
+        return [self] * len(labels)
+
+    def cache_data(self, func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+    cache = cache_resource = cache_data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in ("sidebar", "container", "expander"):
+            return self
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return record
+
+    def sendable_calls(self):
+        sendable = []
+        for name, args, kwargs in self.calls:
+            figures = [a for a in args if _is_figure(a)]
+            if figures:  # e.g. st.write(fig): ship the rendered image instead of the object
+                sendable.extend(("image_png", (_figure_png(fig),), {}) for fig in figures)
+                continue
+            try:
+                pickle.dumps((args, kwargs))
+            except Exception:
+                args, kwargs = tuple(repr(a) for a in args), {}
+            sendable.append((name, args, kwargs))
+        return sendable
+
+
+def _is_figure(value):
+    return type(value).__name__ == "Figure" and hasattr(value, "savefig")
+
+
+def _figure_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
@@ -0,0 +1,517 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from .cache import LLMCache
+from .schema import estimate_tokens
+from .tracing import Tracer, token_usage, percentile
+from .database import env_flag, env_float, env_int
+
+# --- settings ---
+# "provider:requests/tokens" per minute for each API key every session of this process shares; 0 = no limit
+RATE_LIMITS = os.getenv("MYQUERY_RATE_LIMITS", "groq:30/6000,mistral:60/500000")
+COMPLETION_TOKENS = env_int("MYQUERY_RATE_COMPLETION_TOKENS", 600)   # reserved per call until usage is known
+RATE_LIMITED_PAUSE_SECONDS = env_float("MYQUERY_RATE_LIMIT_PAUSE", 10)  # after a 429 without Retry-After
+COALESCE_ENABLED = env_flag("MYQUERY_COALESCE")
+WAIT_WINDOW = 200
+
+
+class RateLimiter:
+    # --- token buckets for requests and tokens per minute in front of one provider ---
+    # Callers queue per client (Streamlit session, or thread outside one); a dispatcher thread grants
+    # the clients' oldest requests round-robin, so one busy session can't starve the others.
+    # Token costs are estimated up front and settled with the usage the provider reports.
+    def __init__(self, provider: str, requests_per_minute: float, tokens_per_minute: float):
+        self.provider = provider
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._cond = threading.Condition()
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._queues = OrderedDict()     # client -> deque of tickets; the next client to serve is first
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self.granted = 0
+        self.rate_limited = 0
+        threading.Thread(target=self._dispatch, name=f"rate-limiter-{provider}", daemon=True).start()
+
+    # --- callers ---
+    def wait(self, prompt: str) -> int:
+        # Blocks until the request may be sent; returns the tokens reserved for it
+        ticket = self._enqueue(prompt)
+        with Tracer.span("llm.queue", provider=self.provider, reserved_tokens=ticket["cost"]):
+            ticket["future"].result()
+        return ticket["cost"]
+
+    async def await_turn(self, prompt: str) -> int:
+        ticket = self._enqueue(prompt)
+        with Tracer.span("llm.queue", provider=self.provider, reserved_tokens=ticket["cost"]):
+            await asyncio.wrap_future(ticket["future"])  # cancelling the caller withdraws the ticket
+        return ticket["cost"]
+
+    def settle(self, reserved: int, usage: dict):
+        # Give back (or charge) the difference between the reservation and what the call really used
+        used = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        if not used:
+            return
+        with self._cond:
+            self._tokens += reserved - used
+            self._cond.notify()
+
+    def failed(self, error: BaseException):
+        # A 429 means the provider's own limit is tighter than ours: hold every caller off for a while
+        pause = _retry_after(error)
+        if pause is None:
+            return
+        with self._cond:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill()
+            waits = sorted(self._waits)
+            return {
+                "provider": self.provider,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "clients_waiting": len(self._queues),
+                "wait_p50_s": round(percentile(waits, 50), 2) if waits else None,
+                "wait_p95_s": round(percentile(waits, 95), 2) if waits else None,
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "requests_left": int(self._requests) if self.requests_per_minute else None,
+                "tokens_left": int(self._tokens) if self.tokens_per_minute else None,
+            }
+
+    # --- internals ---
+    def _enqueue(self, prompt: str) -> dict:
+        cost = estimate_tokens(prompt) + COMPLETION_TOKENS
+        if self.tokens_per_minute:
+            cost = min(cost, int(self.tokens_per_minute))  # a huge prompt still goes once the bucket is full
+        ticket = {"cost": cost, "future": concurrent.futures.Future(), "queued_at": time.monotonic()}
+        with self._cond:
+            self._queues.setdefault(_current_client(), deque()).append(ticket)
+            self._cond.notify()
+        return ticket
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                ticket = self._next()
+                if ticket is None:
+                    self._cond.wait()
+                    continue
+                self._refill()
+                delay = self._delay(ticket["cost"])
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                client, queue = next(iter(self._queues.items()))
+                queue.popleft()
+                # The client just served goes to the back of the rotation
+                del self._queues[client]
+                if queue:
+                    self._queues[client] = queue
+                if ticket["future"].set_running_or_notify_cancel():
+                    self._requests -= 1
+                    self._tokens -= ticket["cost"]
+                    self.granted += 1
+                    self._waits.append(time.monotonic() - ticket["queued_at"])
+                    ticket["future"].set_result(None)
+
+    def _next(self):
+        # Oldest live ticket of the first client in the rotation; withdrawn tickets are dropped
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            while queue and queue[0]["future"].cancelled():
+                queue.popleft()
+            if queue:
+                return queue[0]
+            del self._queues[client]
+        return None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._refilled = now - self._refilled, now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _delay(self, cost: int) -> float:
+        # Seconds until both buckets can pay for this request (0 when they can now)
+        delay = self._paused_until - time.monotonic()
+        if self.requests_per_minute and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < cost:
+            delay = max(delay, (cost - self._tokens) * 60 / self.tokens_per_minute)
+        return delay
+
+
+class ScheduledModel:
+    # --- a chat model whose calls wait for their turn at the provider's RateLimiter ---
+    # Same invoke / ainvoke / astream interface, so ModelRouter backends wrap it transparently.
+    def __init__(self, llm, limiter: RateLimiter):
+        self.llm = llm
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)   # model_name, temperature...
+
+    def invoke(self, prompt: str):
+        reserved = self.limiter.wait(prompt)
+        try:
+            message = self.llm.invoke(prompt)
+        except Exception as e:
+            self.limiter.failed(e)
+            raise
+        self.limiter.settle(reserved, token_usage(message))
+        return message
+
+    async def ainvoke(self, prompt: str):
+        reserved = await self.limiter.await_turn(prompt)
+        try:
+            message = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            self.limiter.failed(e)
+            raise
+        self.limiter.settle(reserved, token_usage(message))
+        return message
+
+    async def astream(self, prompt: str):
+        reserved = await self.limiter.await_turn(prompt)
+        usage = {}
+        try:
+            async for chunk in self.llm.astream(prompt):
+                for key, value in token_usage(chunk).items():
+                    usage[key] = usage.get(key, 0) + (value or 0)
+                yield chunk
+        except Exception as e:
+            self.limiter.failed(e)
+            raise
+        finally:
+            self.limiter.settle(reserved, usage)
+
+
+class LLMScheduler:
+    # --- one RateLimiter per provider named in MYQUERY_RATE_LIMITS, shared process-wide ---
+    _lock = threading.Lock()
+    _limiters = {}
+
+    @classmethod
+    def wrap(cls, provider: str, llm):
+        limiter = cls.limiter(provider)
+        return llm if limiter is None else ScheduledModel(llm, limiter)
+
+    @classmethod
+    def limiter(cls, provider: str):
+        with cls._lock:
+            if provider not in cls._limiters:
+                limits = _parse_limits(RATE_LIMITS).get(provider)
+                cls._limiters[provider] = RateLimiter(provider, *limits) if limits else None
+            return cls._limiters[provider]
+
+    @classmethod
+    def stats(cls) -> list[dict]:
+        with cls._lock:
+            limiters = [l for l in cls._limiters.values() if l is not None]
+        return [limiter.stats() for limiter in limiters]
+
+
+class LLMLoop:
+    # --- one long-lived event loop thread for every async LLM call in the process ---
+    # Chat clients are cached per role and each holds one async HTTP client, which only works on the
+    # loop it first ran on: a fresh asyncio.run per call fails with "Event loop is closed". Sessions,
+    # sync router calls and prefetch jobs all submit their coroutines here instead.
+    _lock = threading.Lock()
+    _loop = None
+
+    @classmethod
+    def submit(cls, coro) -> concurrent.futures.Future:
+        # The caller's context variables (the current trace span) carry over to the task;
+        # cancelling the returned future cancels the task
+        return asyncio.run_coroutine_threadsafe(coro, cls._start())
+
+    @classmethod
+    def run(cls, coro):
+        # Blocks the calling thread until the coroutine is done; never call it from the loop itself
+        future = cls.submit(coro)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    @classmethod
+    def _start(cls):
+        with cls._lock:
+            if cls._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="myquery-llm-loop", daemon=True).start()
+                cls._loop = loop
+            return cls._loop
+
+class Abandoned(Exception):
+    # The shared request was cancelled before it finished; whoever was waiting on it asks again
+    pass
+
+
+class InFlight:
+    # --- identical LLM requests running at the same time share one upstream call ---
+    # The first caller (the leader) makes the call and publishes its chunks and final text; callers
+    # arriving meanwhile with the same key read those instead. Keys are the LLM cache's, so this
+    # covers exactly the window before the first answer lands in the cache.
+    _lock = threading.Lock()
+    _calls = {}
+    coalesced = 0
+
+    @classmethod
+    def join(cls, key: str):
+        # (call, True) for the leader, (call, False) for a follower
+        with cls._lock:
+            call = cls._calls.get(key) if COALESCE_ENABLED else None
+            if call is not None:
+                cls.coalesced += 1
+                return call, False
+            call = SharedCall(key)
+            if COALESCE_ENABLED:
+                cls._calls[key] = call
+            return call, True
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            return {"in_flight": len(cls._calls), "coalesced": cls.coalesced}
+
+    @classmethod
+    def _drop(cls, call: "SharedCall"):
+        with cls._lock:
+            if cls._calls.get(call.key) is call:
+                del cls._calls[call.key]
+
+
+class SharedCall:
+    # Followers may be on other threads and other event loops: they are woken through callbacks
+    # that each schedule onto the follower's own loop
+    def __init__(self, key: str):
+        self.key = key
+        self.future = concurrent.futures.Future()
+        self.chunks = []
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    # --- leader ---
+    def publish(self, chunk: str):
+        with self._lock:
+            self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, content: str):
+        InFlight._drop(self)
+        self.future.set_result(content)
+        self._notify()
+
+    def fail(self, error: BaseException):
+        # Errors are shared; a cancelled leader (GeneratorExit, CancelledError) lets followers retry
+        InFlight._drop(self)
+        self.future.set_exception(
+            error if isinstance(error, Exception) else Abandoned("the shared request was cancelled by its caller")
+        )
+        self._notify()
+
+    # --- followers ---
+    def result(self) -> str:
+        return self.future.result()
+
+    async def aresult(self) -> str:
+        async for _ in self._updates():
+            pass
+        return self.future.result()
+
+    async def follow(self):
+        # The leader's chunks as they arrive; the whole text as one chunk if it didn't stream
+        position = 0
+        async for chunks in self._updates():
+            for chunk in chunks[position:]:
+                yield chunk
+            position = len(chunks)
+        content = self.future.result()
+        if position == 0 and content:
+            yield content
+
+    async def _updates(self):
+        # Yields the chunk list after every change until the leader is done
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener():
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                pass  # the follower's loop is gone
+
+        with self._lock:
+            self._listeners.append(listener)
+        try:
+            while True:
+                changed.clear()
+                done = self.future.done()   # before the chunks: once done, no chunk can be missing
+                with self._lock:
+                    chunks = list(self.chunks)
+                yield chunks
+                if done:
+                    return
+                await changed.wait()
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+
+    def _notify(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+
+class SharedRequest:
+    # --- one LLM request: answered from the LLM cache, else by the identical request in flight, else upstream ---
+    # invoke_llm, ainvoke_llm and astream_llm differ only in how they wait and how they call the model.
+    # Only the leader calls upstream; its outcome (or Abandoned, if it was cancelled) goes to the followers.
+    def __init__(self, model: str, prompt: str, temperature, span):
+        self.model = model
+        self.prompt = prompt
+        self.temperature = temperature
+        self.span = span
+        self.call = None   # the SharedCall this request leads
+
+    def invoke(self, send) -> str:
+        # send(): the upstream call, returning a message
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        for call in self._followed_calls():
+            try:
+                return self._coalesced(call.result())
+            except Abandoned:
+                continue
+        with self._leading():
+            message = send()
+            self.span.add(**token_usage(message))
+            return self._finish(message.content)
+
+    async def ainvoke(self, send) -> str:
+        # send(): coroutine of the upstream call, returning a message
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        for call in self._followed_calls():
+            try:
+                return self._coalesced(await call.aresult())
+            except Abandoned:
+                continue
+        with self._leading():
+            message = await send()
+            self.span.add(**token_usage(message))
+            return self._finish(message.content)
+
+    async def astream(self, send):
+        # send(): async iterator of upstream message chunks. Yields text chunks; a cache hit is one chunk.
+        cached = self._cached()
+        if cached is not None:
+            yield cached
+            return
+        for call in self._followed_calls():
+            followed = 0
+            try:
+                async for chunk in call.follow():
+                    followed += len(chunk)
+                    yield chunk
+                self.span.set(coalesced=True, response_chars=followed)
+                return
+            except Abandoned:
+                if followed:
+                    raise  # part of the answer was already passed on; asking again would repeat it
+                continue
+        chunks = []
+        with self._leading():
+            async for chunk in send():
+                self.span.add(**token_usage(chunk))
+                if chunk.content:
+                    if not chunks:
+                        self.span.set(first_chunk_ms=round(self.span.elapsed_ms(), 1))
+                    chunks.append(chunk.content)
+                    self.call.publish(chunk.content)
+                    yield chunk.content
+            self._finish("".join(chunks))
+
+    def _cached(self):
+        content = LLMCache.get(self.model, self.prompt, self.temperature)
+        self.span.set(cache_hit=content is not None)
+        return content
+
+    def _followed_calls(self):
+        # The identical call in flight, again after each Abandoned, until this request leads one itself
+        key = LLMCache.make_key(self.model, self.prompt, self.temperature)
+        while True:
+            call, leader = InFlight.join(key)
+            if leader:
+                self.call = call
+                return
+            yield call
+
+    def _coalesced(self, content: str) -> str:
+        self.span.set(coalesced=True, response_chars=len(content))
+        return content
+
+    @contextmanager
+    def _leading(self):
+        try:
+            yield
+        except BaseException as e:
+            self.call.fail(e)
+            raise
+
+    def _finish(self, content: str) -> str:
+        self.span.set(response_chars=len(content))
+        LLMCache.set(self.model, self.prompt, self.temperature, content)
+        self.call.finish(content)
+        return content
+
+def _current_client() -> str:
+    # Fair queuing is per Streamlit session; prefetch jobs and batch runs queue per thread
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    return threading.current_thread().name
+
+
+def _parse_limits(specs: str) -> dict:
+    # "groq:30/6000,mistral:60" -> {"groq": (30.0, 6000.0), "mistral": (60.0, 0.0)}
+    limits = {}
+    for spec in filter(None, (s.strip() for s in specs.split(","))):
+        provider, _, rates = spec.partition(":")
+        requests, _, tokens = rates.partition("/")
+        limits[provider.strip()] = (float(requests or 0), float(tokens or 0))
+    return {p: rates for p, rates in limits.items() if any(rates)}
+
+
+def _retry_after(error: BaseException):
+    # Seconds to hold off after a rate-limit error, None for any other error
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status != 429 and type(error).__name__ != "RateLimitError" and "rate limit" not in str(error).lower():
+        return None
+    try:
+        return float((getattr(response, "headers", None) or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return RATE_LIMITED_PAUSE_SECONDS
@@ -0,0 +1,120 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from .database import env_int
+
+# --- settings ---
+MAX_PROMPT_COLUMNS = env_int("MYQUERY_PROMPT_MAX_COLUMNS", 60)   # narrower datasets send every column
+TOP_COLUMNS = env_int("MYQUERY_PROMPT_TOP_COLUMNS", 40)          # columns kept for a wide dataset
+INDEXES_KEPT = 16
+
+TYPE_NAMES = (("bool", "bool"), ("int", "int"), ("float", "float"), ("double", "float"), ("decimal", "float"),
+              ("date", "date"), ("timestamp", "date"), ("time", "time"))
+
+
+def short_type(arrow_type) -> str:
+    # Compact dtype label for prompts: int / float / bool / date / time / str
+    # (dictionary-encoded text is a storage detail; code sees plain strings)
+    name = str(arrow_type).lower()
+    for prefix, short in TYPE_NAMES:
+        if name.startswith(prefix):
+            return short
+    return "str"
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English and identifiers; close enough to report savings
+    return (len(text) + 3) // 4
+
+
+class ColumnIndex:
+    # --- TF-IDF retrieval over column names, so prompts for wide datasets carry only relevant columns ---
+    # Indexes are keyed by the column list itself and shared by every session using that schema.
+    _lock = threading.Lock()
+    _indexes = OrderedDict()
+
+    @staticmethod
+    def is_wide(columns: list[str]) -> bool:
+        return len(columns) > MAX_PROMPT_COLUMNS
+
+    @staticmethod
+    def fingerprint(columns: list[str]) -> str:
+        return hashlib.sha1("\x00".join(map(str, columns)).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def warm(cls, columns: list[str], types: dict = None):
+        # Called on upload; only wide datasets need an index (and scikit-learn's import cost)
+        if cls.is_wide(columns):
+            cls._index(columns, types or {})
+
+    @classmethod
+    def select(cls, query: str, columns: list[str], types: dict = None, k: int = TOP_COLUMNS) -> list[str]:
+        if not cls.is_wide(columns):
+            return list(columns)
+
+        index = cls._index(columns, types or {})
+        lowered = query.lower()
+        # Columns named verbatim in the question always make it in
+        mentioned = [i for i, c in enumerate(columns) if len(str(c)) >= 3 and str(c).lower() in lowered]
+
+        scores = (index["matrix"] @ index["vectorizer"].transform([_document(query)]).T).toarray().ravel()
+        ranked = [i for i in scores.argsort()[::-1] if scores[i] > 0]
+        chosen = list(dict.fromkeys(mentioned + ranked))[:max(k, len(mentioned))]
+        if not chosen:  # nothing matched (e.g. a generic request): lead with the first columns
+            chosen = list(range(min(k, len(columns))))
+        return [columns[i] for i in sorted(chosen)]  # keep the file's column order
+
+    @classmethod
+    def prompt_columns(cls, query: str, columns: list[str], types: dict = None) -> tuple[str, dict]:
+        # Text for a prompt's column list, plus what it saved compared to listing every column
+        full_text = ", ".join(map(str, columns))
+        if not cls.is_wide(columns):
+            return full_text, {"columns_total": len(columns), "columns_sent": len(columns), "tokens_saved": 0}
+
+        types = types or {}
+        chosen = cls.select(query, columns, types)
+        text = ", ".join(f"{c} ({types[c]})" if c in types else str(c) for c in chosen)
+
+        left_out = [c for c in columns if c not in set(chosen)]
+        counts = OrderedDict()
+        for c in left_out:
+            kind = types.get(c, "other")
+            counts[kind] = counts.get(kind, 0) + 1
+        text += f" ... and {len(left_out)} more columns not listed (" + ", ".join(
+            f"{n} {kind}" for kind, n in counts.items()
+        ) + ")"
+
+        return text, {
+            "columns_total": len(columns),
+            "columns_sent": len(chosen),
+            "tokens_saved": max(0, estimate_tokens(full_text) - estimate_tokens(text)),
+        }
+
+    @classmethod
+    def _index(cls, columns: list[str], types: dict) -> dict:
+        key = cls.fingerprint(columns)
+        with cls._lock:
+            if key in cls._indexes:
+                cls._indexes.move_to_end(key)
+                return cls._indexes[key]
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        # Character n-grams match partial names ("temp" -> "Temperature_C", "sensor 12" -> "sensor_12")
+        vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), lowercase=True, sublinear_tf=True)
+        matrix = vectorizer.fit_transform(_document(str(c), types.get(c, "")) for c in columns)
+        index = {"vectorizer": vectorizer, "matrix": matrix}
+
+        with cls._lock:
+            cls._indexes[key] = index
+            while len(cls._indexes) > INDEXES_KEPT:
+                cls._indexes.popitem(last=False)
+        return index
+
+
+def _document(name: str, kind: str = "") -> str:
+    # "maxTemp_C" -> "maxTemp_C max temp c": raw name plus its word pieces (and dtype, for columns)
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    words = re.sub(r"[_\-./]+", " ", words).lower()
+    return f"{name} {words} {kind}".strip()
@@ -3,7 +3,7 @@ import streamlit as st
 
 class SessionState:
     _defaults = {
-        "df": None,
+        "dataset_handle": None,   # DatasetHandle into the shared DatasetStore, see utils/store.py
         "recent_questions": [],
         "full_code": "",
         "in_app_code": "",
@@ -11,6 +11,19 @@ class SessionState:
         "explanation": "",
         "suggested_questions": [],
         "question_input": "",
+        "dataset_key": "",
+        "uploads": {},            # file_id -> dataset_key of every file in the uploader, see FileHandler
+        "catalog_tables": {},     # catalog tables this session sees: name -> True if it uploaded it
+        "dataset_path": "",
+        "out_of_core": False,
+        "columns": [],
+        "column_types": {},
+        "dtype_report": {},
+        "row_count": 0,
+        "progressive_run": None,  # ProgressiveRun of the last executed code, see utils/progressive.py
+        "result_view": None,      # {"code", "result"}: the last SQL ResultSet, kept for paging
+        "prefetch_job": None,     # PrefetchJob for the current upload, see utils/prefetch.py
+        "code_origin": None,      # question/mode/language the shown code answers, for the query library
     }
 
     @classmethod
@@ -27,7 +40,14 @@ class SessionState:
     @classmethod
     def get_columns_as_list(cls):
         df = cls.get_df()
-        return df.columns.tolist() if df is not None else []
+        if df is not None:
+            return df.columns.tolist()
+        return list(st.session_state.get("columns", [])) if cls.has_data() else []
+
+    @classmethod
+    def has_data(cls):
+        # Out-of-core datasets live on disk behind DuckDB, so there is no DataFrame to check
+        return cls.get_df() is not None or (cls.is_out_of_core() and bool(cls.get_dataset_path()))
     
     @classmethod
     def remove_recent_question(cls, index):
@@ -39,7 +59,13 @@ class SessionState:
     # --- Getters ---
     @classmethod
     def get_df(cls):
-        return st.session_state.get("df")
+        # The frame is shared with every session that loaded the same file; treat it as read-only
+        handle = st.session_state.get("dataset_handle")
+        return handle.frame if handle is not None else None
+
+    @classmethod
+    def get_dataset_handle(cls):
+        return st.session_state.get("dataset_handle")
 
     @classmethod
     def get_filename(cls):
@@ -47,8 +73,7 @@ class SessionState:
     
     @classmethod
     def get_columns(cls):
-        df = cls.get_df()
-        return ", ".join(df.columns) if df is not None else ""
+        return ", ".join(cls.get_columns_as_list())
     
     @classmethod
     def get_suggested_questions(cls):
@@ -74,10 +99,61 @@ class SessionState:
     def get_explanation(cls):
         return st.session_state.get("explanation", "")
 
+    @classmethod
+    def get_dataset_key(cls):
+        return st.session_state.get("dataset_key", "")
+
+    @classmethod
+    def get_uploads(cls):
+        return st.session_state.get("uploads", {})
+
+    @classmethod
+    def get_catalog_tables(cls):
+        return st.session_state.get("catalog_tables", {})
+
+    @classmethod
+    def get_dataset_path(cls):
+        return st.session_state.get("dataset_path", "")
+
+    @classmethod
+    def get_column_types(cls):
+        return st.session_state.get("column_types", {})
+
+    @classmethod
+    def get_dtype_report(cls):
+        return st.session_state.get("dtype_report", {})
+
+    @classmethod
+    def get_row_count(cls):
+        return st.session_state.get("row_count", 0)
+
+    @classmethod
+    def get_progressive_run(cls):
+        return st.session_state.get("progressive_run")
+
+    @classmethod
+    def get_result_view(cls):
+        return st.session_state.get("result_view")
+
+    @classmethod
+    def get_prefetch_job(cls):
+        return st.session_state.get("prefetch_job")
+
+    @classmethod
+    def get_code_origin(cls):
+        return st.session_state.get("code_origin")
+
+    @classmethod
+    def is_out_of_core(cls):
+        return st.session_state.get("out_of_core", False)
+
     # --- Setters ---
     @classmethod
-    def set_df(self, value):
-        st.session_state["df"] = value
+    def set_dataset_handle(cls, handle):
+        previous = st.session_state.get("dataset_handle")
+        if previous is not None and previous is not handle:
+            previous.close()
+        st.session_state["dataset_handle"] = handle
     
     @classmethod
     def set_filename(cls, value):
@@ -91,6 +167,12 @@ class SessionState:
     def set_question_input(cls, value):
         st.session_state["question_input"] = value
 
+    @classmethod
+    def set_code_origin(cls, question, mode, language):
+        st.session_state["code_origin"] = {
+            "question": question, "mode": mode, "language": language, "in_app": cls.get_in_app_code()
+        }
+
     @classmethod
     def set_recent_questions(cls, questions):
         st.session_state["recent_questions"] = questions
@@ -105,4 +187,60 @@ class SessionState:
 
     @classmethod
     def set_explanation(cls, value):
-        st.session_state["explanation"] = value
\ No newline at end of file
+        st.session_state["explanation"] = value
+
+    @classmethod
+    def set_dataset_key(cls, value):
+        st.session_state["dataset_key"] = value
+
+    @classmethod
+    def set_uploads(cls, value):
+        st.session_state["uploads"] = value
+
+    @classmethod
+    def set_catalog_tables(cls, value):
+        st.session_state["catalog_tables"] = value
+
+    @classmethod
+    def set_dataset_path(cls, value):
+        st.session_state["dataset_path"] = value
+
+    @classmethod
+    def set_out_of_core(cls, value):
+        st.session_state["out_of_core"] = value
+
+    @classmethod
+    def set_columns(cls, value):
+        st.session_state["columns"] = value
+
+    @classmethod
+    def set_column_types(cls, value):
+        st.session_state["column_types"] = value
+
+    @classmethod
+    def set_dtype_report(cls, value):
+        st.session_state["dtype_report"] = value
+
+    @classmethod
+    def set_row_count(cls, value):
+        st.session_state["row_count"] = value
+
+    @classmethod
+    def set_progressive_run(cls, run):
+        # Only one full run per session: starting another (or clearing it) cancels the old one
+        previous = st.session_state.get("progressive_run")
+        if previous is not None and previous is not run:
+            previous.cancel()
+        st.session_state["progressive_run"] = run
+
+    @classmethod
+    def set_result_view(cls, code, result):
+        st.session_state["result_view"] = {"code": code, "result": result} if result is not None else None
+
+    @classmethod
+    def set_prefetch_job(cls, job):
+        # A new upload's job replaces the old one; whatever the old one hadn't finished is dropped
+        previous = st.session_state.get("prefetch_job")
+        if previous is not None and previous is not job:
+            previous.cancel()
+        st.session_state["prefetch_job"] = job
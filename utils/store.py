@@ -0,0 +1,101 @@
+import threading
+import weakref
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+from .ingest import IngestCache
+from .frames import arrow_to_pandas
+from .dtypes import DtypeOptimizer
+from .database import env_int
+
+# --- settings ---
+# Datasets no session holds any more stay loaded (for the next upload of the same file) up to this budget
+IDLE_BUDGET_BYTES = env_int("MYQUERY_STORE_IDLE_MB", 1024) * 1024 * 1024
+
+
+class DatasetStore:
+    # --- one DataFrame per distinct dataset, shared by every session that uploaded it ---
+    # Frames are built from the memory-mapped Arrow IPC copy (the same file sandbox workers map),
+    # so null-free numeric and text columns are read-only views of the page cache rather than private memory.
+    # Sessions hold DatasetHandles; a dataset with no handles left is kept in an LRU until evicted.
+    _lock = threading.Lock()
+    _entries = {}
+    _idle = OrderedDict()   # dataset_key -> None, least recently released first
+
+    @classmethod
+    def acquire(cls, dataset_key: str, parquet_path) -> "DatasetHandle":
+        with cls._lock:
+            entry = cls._entries.get(dataset_key)
+            if entry is None:
+                entry = {"table": None, "frame": None, "lock": threading.Lock(), "refs": 0, "nbytes": 0}
+                cls._entries[dataset_key] = entry
+            entry["refs"] += 1
+            cls._idle.pop(dataset_key, None)
+
+        # Concurrent first uploads of the same file load it once; the others wait here
+        with entry["lock"]:
+            if entry["frame"] is None:
+                try:
+                    # Widened once here, so the frame's numeric columns are views of the table DuckDB scans
+                    entry["table"] = DtypeOptimizer.widen(cls._load(dataset_key, parquet_path))
+                    entry["frame"] = arrow_to_pandas(entry["table"])
+                except BaseException:
+                    cls.release(dataset_key)
+                    raise
+                entry["nbytes"] = int(entry["frame"].memory_usage(index=True, deep=True).sum())
+
+        return DatasetHandle(dataset_key, entry["frame"], entry["table"])
+
+    @classmethod
+    def release(cls, dataset_key: str):
+        with cls._lock:
+            entry = cls._entries.get(dataset_key)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            cls._idle[dataset_key] = None
+            cls._evict()
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            return {
+                "datasets": len(cls._entries),
+                "idle": len(cls._idle),
+                "sessions": sum(e["refs"] for e in cls._entries.values()),
+                "bytes": sum(e["nbytes"] for e in cls._entries.values()),
+            }
+
+    @classmethod
+    def clear(cls):
+        # Drops idle datasets only; frames still held by a session stay valid through their handles
+        with cls._lock:
+            for dataset_key in cls._idle:
+                cls._entries.pop(dataset_key, None)
+            cls._idle.clear()
+
+    @classmethod
+    def _evict(cls):
+        # Called with _lock held. Only unreferenced datasets are ever dropped.
+        idle_bytes = sum(cls._entries[k]["nbytes"] for k in cls._idle)
+        while cls._idle and idle_bytes > IDLE_BUDGET_BYTES:
+            dataset_key, _ = cls._idle.popitem(last=False)
+            idle_bytes -= cls._entries.pop(dataset_key)["nbytes"]
+
+    @staticmethod
+    def _load(dataset_key: str, parquet_path) -> pa.Table:
+        return IngestCache.read_ipc(IngestCache.ensure_ipc(dataset_key, parquet_path=parquet_path))
+
+
+class DatasetHandle:
+    # --- lightweight per-session reference; releasing it (or GC at session end) drops the ref ---
+    def __init__(self, dataset_key: str, frame: pd.DataFrame, table: pa.Table):
+        self.dataset_key = dataset_key
+        self.frame = frame
+        self.table = table      # the (widened) Arrow table the frame was built from; DuckDB scans it zero-copy
+        self._finalizer = weakref.finalize(self, DatasetStore.release, dataset_key)
+
+    def close(self):
+        self._finalizer()
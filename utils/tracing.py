@@ -0,0 +1,244 @@
+import json
+import sqlite3
+import time
+import uuid
+import contextvars
+import functools
+from contextlib import closing, contextmanager
+from .database import ensure_schema, env_flag, env_float
+
+# --- settings ---
+TRACING_ENABLED = env_flag("MYQUERY_TRACING")
+RETENTION_SECONDS = env_float("MYQUERY_TRACE_RETENTION_DAYS", 30) * 24 * 3600
+
+_current = contextvars.ContextVar("myquery_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace, parent_id=None, **attrs):
+        self.name = name
+        self.trace = trace              # [trace id, ended spans, root ended], shared by one user action
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.error = None
+        self._start = time.perf_counter()
+        self._ended = False
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace[0]
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        # Accumulate numeric attributes, e.g. tokens over several chunks
+        for key, value in counts.items():
+            if value is not None:
+                self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def fail(self, error):
+        # For errors that are handled (shown to the user) rather than raised through the span
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def end(self, error=None):
+        if self._ended:
+            return
+        self._ended = True
+        self.duration_ms = self.elapsed_ms()
+        if error is not None:
+            self.fail(error)
+        self.trace[1].append(self)
+        if self.parent_id is None:  # the root closes the trace
+            self.trace[2] = True
+        if self.trace[2]:
+            # Detached spans can outlive the root (a stream still being read, a review task):
+            # they are written when they end
+            Tracer.flush(self.trace)
+
+
+class Tracer:
+    # --- span-style timings for one user action (generate, run, chart...), persisted to database.db ---
+    enabled = TRACING_ENABLED
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS trace_spans (
+            trace_id TEXT NOT NULL,
+            span_id TEXT PRIMARY KEY,
+            parent_id TEXT,
+            name TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            duration_ms REAL NOT NULL,
+            error TEXT,
+            attrs TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE INDEX IF NOT EXISTS trace_spans_started_at ON trace_spans (started_at);
+    """
+
+    @staticmethod
+    def current():
+        return _current.get()
+
+    @classmethod
+    def start(cls, name: str, **attrs) -> Span:
+        # A detached span: it is timed and recorded but doesn't become the parent of later spans.
+        # Used where a `with` block can't be, e.g. around async generators.
+        parent = _current.get()
+        if parent is None:
+            return Span(name, [uuid.uuid4().hex, [], False], **attrs)
+        return Span(name, parent.trace, parent.span_id, **attrs)
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str, **attrs):
+        span = cls.start(name, **attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.end(error=e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    @classmethod
+    def traced(cls, name: str, **attrs):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with cls.span(name, **attrs):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def annotate(cls, **attrs):
+        # Attach attributes to the innermost open span, if any
+        span = _current.get()
+        if span is not None:
+            span.set(**attrs)
+
+    @classmethod
+    def fail(cls, error):
+        span = _current.get()
+        if span is not None:
+            span.fail(error)
+
+    @classmethod
+    def flush(cls, trace):
+        # Spans ending on another thread meanwhile are appended after the ones taken here
+        spans = trace[1][:]
+        del trace[1][:len(spans)]
+        if not cls.enabled or not spans:
+            return
+        rows = [
+            (s.trace_id, s.span_id, s.parent_id, s.name, s.started_at, s.duration_ms,
+             s.error, json.dumps(s.attrs, default=str))
+            for s in spans
+        ]
+        try:
+            with closing(cls._connect()) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO trace_spans "
+                    "(trace_id, span_id, parent_id, name, started_at, duration_ms, error, attrs) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("DELETE FROM trace_spans WHERE started_at < ?", (time.time() - RETENTION_SECONDS,))
+        except sqlite3.Error:
+            pass  # metrics must never break the request they measure
+
+    @classmethod
+    def export(cls, since_seconds=None, name=None) -> list[dict]:
+        query = "SELECT trace_id, span_id, parent_id, name, started_at, duration_ms, error, attrs FROM trace_spans"
+        clauses, params = [], []
+        if since_seconds is not None:
+            clauses.append("started_at >= ?")
+            params.append(time.time() - since_seconds)
+        if name is not None:
+            clauses.append("name = ?")
+            params.append(name)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY started_at"
+
+        with closing(cls._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        columns = ("trace_id", "span_id", "parent_id", "name", "started_at", "duration_ms", "error")
+        return [{**dict(zip(columns, row[:7])), **json.loads(row[7] or "{}")} for row in rows]
+
+    @classmethod
+    def summary(cls, since_seconds=None, spans=None) -> list[dict]:
+        # p50/p95 per stage, plus cache hit rate and token totals where the stage records them.
+        # Pass spans already fetched with export() to avoid reading them twice.
+        stages = {}
+        for span in spans if spans is not None else cls.export(since_seconds):
+            stages.setdefault(span["name"], []).append(span)
+
+        summary = []
+        for name, spans in sorted(stages.items()):
+            durations = sorted(s["duration_ms"] for s in spans)
+            cached = [s["cache_hit"] for s in spans if "cache_hit" in s]
+            summary.append({
+                "stage": name,
+                "count": len(spans),
+                "p50_ms": round(percentile(durations, 50), 1),
+                "p95_ms": round(percentile(durations, 95), 1),
+                "mean_ms": round(sum(durations) / len(durations), 1),
+                "errors": sum(1 for s in spans if s["error"]),
+                "cache_hit_rate": round(sum(cached) / len(cached), 3) if cached else None,
+                "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in spans),
+                "completion_tokens": sum(s.get("completion_tokens", 0) for s in spans),
+                "tokens_saved": sum(s.get("tokens_saved", 0) for s in spans),
+                "library_hits": sum(1 for s in spans if s.get("library_hit")),
+                "coalesced": sum(1 for s in spans if s.get("coalesced")),
+            })
+        return summary
+
+    @classmethod
+    def clear(cls):
+        with closing(cls._connect()) as conn:
+            conn.execute("DELETE FROM trace_spans")
+
+    @classmethod
+    def _connect(cls):
+        return ensure_schema(cls._schema)
+
+
+def token_usage(message) -> dict:
+    # langchain messages report usage in one of two shapes depending on provider and version
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        return {"prompt_tokens": usage.get("input_tokens"), "completion_tokens": usage.get("output_tokens")}
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+
+
+def percentile(ordered: list, pct: float) -> float:
+    # Linear interpolation between closest ranks of an already sorted list
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+if __name__ == "__main__":
+    # python -m utils.tracing [--since HOURS] [--summary] > spans.jsonl
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export recorded spans as JSON lines.")
+    parser.add_argument("--since", type=float, help="only spans from the last N hours")
+    parser.add_argument("--summary", action="store_true", help="per-stage p50/p95 instead of raw spans")
+    args = parser.parse_args()
+
+    since = args.since * 3600 if args.since is not None else None
+    for record in (Tracer.summary(since) if args.summary else Tracer.export(since)):
+        print(json.dumps(record))
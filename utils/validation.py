@@ -0,0 +1,242 @@
+import ast
+import builtins
+import difflib
+from .database import env_flag
+
+# --- settings ---
+LOCAL_VALIDATION = env_flag("MYQUERY_LOCAL_VALIDATION")
+
+# Names the execution environment provides to generated Python (see ExecutionHandler / sandbox)
+PROVIDED_NAMES = {"df", "pd", "np", "plt", "sns", "nltk", "st", "stopwords", "stopwords_words"}
+
+# DataFrame methods whose string arguments name existing columns: method -> keyword names
+COLUMN_ARGUMENTS = {
+    "groupby": ("by",),
+    "sort_values": ("by",),
+    "set_index": ("keys",),
+    "drop_duplicates": ("subset",),
+    "dropna": ("subset",),
+    "pivot_table": ("index", "columns", "values"),
+    "pivot": ("index", "columns", "values"),
+    "melt": ("id_vars", "value_vars"),
+}
+# Methods that return the same columns, so their result is still a view of the dataset
+FRAME_PRESERVING = {"copy", "dropna", "fillna", "query", "sort_values", "head", "tail", "sample",
+                    "drop_duplicates", "reset_index", "astype", "replace", "round", "abs"}
+
+
+class CodeValidator:
+    # --- cheap local checks that let generated code skip the review LLM ---
+    # Each validate_* returns a list of human-readable diagnostics; an empty list means it passed.
+
+    @staticmethod
+    def validate(code: str, language: str, columns: list[str], sql_conn=None) -> list[str]:
+        if language == "SQL":
+            if sql_conn is None:
+                return ["no dataset connection to check the query against"]
+            return CodeValidator.validate_sql(code, sql_conn)
+        return CodeValidator.validate_python(code, columns)
+
+    @staticmethod
+    def validate_python(code: str, columns: list[str]) -> list[str]:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            return [f"syntax error on line {e.lineno}: {e.msg}"]
+
+        checker = _PythonChecker(columns)
+        checker.visit(tree)
+        return checker.diagnostics()
+
+    @staticmethod
+    def validate_sql(code: str, sql_conn) -> list[str]:
+        # EXPLAIN plans each statement against the registered table without running it:
+        # the parser catches syntax errors, the binder catches unknown tables and columns
+        import duckdb
+
+        try:
+            statements = duckdb.extract_statements(code)
+        except duckdb.Error as e:
+            return [_first_line(e)]
+        if not statements:
+            return ["no SQL statement found"]
+
+        # Only the last statement's result is shown, so anything before it would run unseen
+        diagnostics = []
+        if len(statements) > 1:
+            diagnostics.append(f"expected a single SQL statement, got {len(statements)}")
+        for statement in statements:
+            if statement.type != duckdb.StatementType.SELECT:
+                diagnostics.append(f"only SELECT queries are checked locally, got {statement.type.name}")
+                continue
+            try:
+                sql_conn.execute(f"EXPLAIN {statement.query}")
+            except duckdb.Error as e:
+                diagnostics.append(str(e).strip())
+        return diagnostics
+
+
+class _PythonChecker(ast.NodeVisitor):
+    def __init__(self, columns: list[str]):
+        self.columns = list(columns)
+        self.stripped_columns = {str(c).strip(): c for c in columns}
+        self.created_columns = set()
+        self.frames = {"df"}                  # names bound to (a view of) the dataset
+        self.stripped = set()                 # frames whose column names the code has stripped
+        self.defined = set(PROVIDED_NAMES) | set(dir(builtins))
+        self.loaded = {}                      # name -> first line it is read on
+        self.column_refs = []                 # (column, line)
+
+    # --- names ---
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.setdefault(node.id, node.lineno)
+        else:
+            self.defined.add(node.id)
+
+    def visit_FunctionDef(self, node):
+        self.defined.add(node.name)
+        self.defined.update(a.arg for a in node.args.args + node.args.kwonlyargs + node.args.posonlyargs)
+        for extra in (node.args.vararg, node.args.kwarg):
+            if extra is not None:
+                self.defined.add(extra.arg)
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.defined.update(a.arg for a in node.args.args + node.args.kwonlyargs)
+        self.generic_visit(node)
+
+    def visit_ClassDef(self, node):
+        self.defined.add(node.name)
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.defined.add((alias.asname or alias.name).split(".")[0])
+
+    visit_ImportFrom = visit_Import
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.defined.add(node.name)
+        self.generic_visit(node)
+
+    # --- columns ---
+    def visit_Assign(self, node):
+        for target in node.targets:
+            # df["new"] = ... creates a column; later reads of it are fine
+            if isinstance(target, ast.Subscript) and self._is_frame(target.value):
+                self.created_columns.update(_strings(target.slice))
+            # df.columns = df.columns.str.strip(): later references use the stripped names
+            if (isinstance(target, ast.Attribute) and target.attr == "columns" and self._is_frame(target.value)
+                    and _calls_strip(node.value)):
+                self.stripped.add(_root(target.value))
+            # data = df.copy() / df[mask] / df.dropna() ... is still the dataset
+            if isinstance(target, ast.Name):
+                if self._is_frame(node.value):
+                    self.frames.add(target.id)
+                else:
+                    self.frames.discard(target.id)
+                if self._is_frame(node.value) and _root(node.value) in self.stripped:
+                    self.stripped.add(target.id)
+                else:
+                    self.stripped.discard(target.id)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.ctx, ast.Load) and (self._is_frame(node.value) or self._is_groupby(node.value)):
+            self._refs(node.slice, node.lineno, node.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Attribute) and self._is_frame(func.value):
+            if func.attr in COLUMN_ARGUMENTS:
+                if node.args:
+                    self._refs(node.args[0], node.lineno, func.value)
+                for keyword in node.keywords:
+                    if keyword.arg in COLUMN_ARGUMENTS[func.attr]:
+                        self._refs(keyword.value, node.lineno, func.value)
+            elif func.attr == "rename":
+                for keyword in node.keywords:
+                    if keyword.arg == "columns" and isinstance(keyword.value, ast.Dict):
+                        self.created_columns.update(_strings(ast.List(elts=keyword.value.values)))
+            elif func.attr == "assign":
+                self.created_columns.update(k.arg for k in node.keywords if k.arg)
+        self.generic_visit(node)
+
+    def _is_frame(self, node) -> bool:
+        if isinstance(node, ast.Name):
+            return node.id in self.frames
+        if isinstance(node, ast.Subscript):  # df[mask], df[df["a"] > 1]
+            return self._is_frame(node.value) and not _strings(node.slice)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr == "read_csv":  # the standalone version loads the dataset itself
+                return True
+            return node.func.attr in FRAME_PRESERVING and self._is_frame(node.func.value)
+        return False
+
+    def _is_groupby(self, node) -> bool:
+        # df.groupby(...)["col"] selects a column of the dataset too
+        return (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr == "groupby" and self._is_frame(node.func.value))
+
+    def _refs(self, node, line, frame):
+        stripped = _root(frame) in self.stripped
+        self.column_refs.extend((column, line, stripped) for column in _strings(node))
+
+    def diagnostics(self) -> list[str]:
+        found = []
+        for name, line in sorted(self.loaded.items(), key=lambda item: item[1]):
+            if name not in self.defined:
+                found.append(f"line {line}: name '{name}' is not defined")
+
+        reported = set()
+        for column, line, stripped in self.column_refs:
+            known = self.stripped_columns if stripped else self.columns
+            if column in known or column in self.created_columns or column in reported:
+                continue
+            reported.add(column)
+            if not stripped and column in self.stripped_columns:
+                # Only there once the code strips the header's whitespace
+                found.append(f"line {line}: column '{column}' is '{self.stripped_columns[column]}' in the "
+                             f"dataset; strip df.columns first")
+                continue
+            close = difflib.get_close_matches(column, self.columns, n=1, cutoff=0.6)
+            hint = f" (did you mean '{close[0]}'?)" if close else ""
+            found.append(f"line {line}: column '{column}' is not in the dataset{hint}")
+        return found
+
+
+def _strings(node) -> list[str]:
+    # String constants in a subscript/argument: "a" or ["a", "b"] or ("a", "b")
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [e.value for e in node.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+    return []
+
+
+def _root(node):
+    # The variable a frame expression starts from: df in df[mask].copy(), None for pd.read_csv(...)
+    while True:
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Subscript):
+            node = node.value
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr != "read_csv":
+            node = node.func.value
+        else:
+            return None
+
+
+def _calls_strip(node) -> bool:
+    # df.columns.str.strip(), [c.strip() for c in df.columns], ...
+    return any(isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute) and n.func.attr == "strip"
+               for n in ast.walk(node))
+
+
+def _first_line(error) -> str:
+    return str(error).strip().splitlines()[0]